@@ -0,0 +1,340 @@
+# bench_e2e.py
+
+"""
+
+End-to-end replay benchmark for the whitelist pipeline.
+
+Starts a local UDP stand-in for the BattlEye RCON server, runs whitelist.py's
+main() in a child process against a generated logs_*/console.log, writes
+realistic console traffic at a fixed rate and reports:
+
+- p50/p99 join-to-kick latency (join line written -> kick received by RCON)
+- lines/sec read by the tailer (scraped from the metrics endpoint)
+- CPU time and peak RSS of the whitelist process
+
+Unix only, since it reads the child's resource usage.
+
+    python benchmarks/bench_e2e.py --rate 5000 --duration 20 --join-ratio 0.01
+    python benchmarks/bench_e2e.py --async
+
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from zlib import crc32
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WHITELIST_SCRIPT = os.path.join(ROOT_DIR, "whitelist.py")
+
+NOISE_LINES = [
+    "SCRIPT       : Replication: sending snapshot for entity %d",
+    "RESOURCES    : Loaded resource {%08X}Prefabs/Props/Crate_%d.et",
+    "ENGINE       : FPS: %d.000000, frame time (avg: 16.67 ms, min: 15.90 ms, max: 19.%d ms)",
+    "NETWORK      : Bandwidth stats: in %d B/s, out %d B/s",
+    "WORLD        : Entity spawned at position <%d.0, 12.5, %d.0>",
+    "AI           : Group %d changed waypoint to %d",
+]
+
+
+def packet(typ: int, payload: bytes) -> bytes:
+    """
+    Builds a BattlEye RCON packet.
+    """
+    body = bytes((0xFF, typ)) + payload
+    return b"BE" + crc32(body).to_bytes(4, "little") + body
+
+
+class FakeBattlEyeServer:
+    """
+    UDP stand-in for the BattlEye RCON server that timestamps every kick.
+    """
+
+    def __init__(self, password: str, response_delay: float = 0.0) -> None:
+        self.password = password
+        self.response_delay = response_delay
+        self.kicks = {}
+        self.logins = 0
+        self.commands = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+        self.port = self.sock.getsockname()[1]
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                data, address = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            received = time.time()
+            if len(data) < 8 or data[:2] != b"BE":
+                continue
+            typ, payload = data[7], data[8:]
+            if typ == 0x00:
+                self.logins += 1
+                success = payload.decode("ascii", "replace") == self.password
+                self.sock.sendto(packet(0x00, b"\x01" if success else b"\x00"), address)
+            elif typ == 0x01:
+                self.commands += 1
+                command = payload[1:].decode("ascii", "replace")
+                if command.startswith("#kick "):
+                    self.kicks.setdefault(command[6:].strip(), received)
+                if self.response_delay:
+                    time.sleep(self.response_delay)
+                self.sock.sendto(packet(0x01, payload[:1]), address)
+
+    def close(self) -> None:
+        self._stop_event.set()
+        self._thread.join()
+        self.sock.close()
+
+
+class ConsoleLogWriter:
+    """
+    Appends synthetic Reforger console traffic and remembers when each join was written.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        join_ratio: float,
+        whitelisted_ratio: float,
+        whitelisted_players: list,
+        update_ratio: float,
+        seed: int = 1,
+    ) -> None:
+        self.path = path
+        self.join_ratio = join_ratio
+        self.whitelisted_ratio = whitelisted_ratio
+        self.whitelisted_players = whitelisted_players
+        self.update_ratio = update_ratio
+        self.rng = random.Random(seed)
+        self.lines = 0
+        self.next_player_id = 1
+        self.kick_expected = {}
+        self.whitelisted_joins = 0
+
+    def _join_lines(self, timestamp: str) -> list:
+        player_id = self.next_player_id
+        self.next_player_id += 1
+        if self.rng.random() < self.whitelisted_ratio:
+            name, identity_id = self.rng.choice(self.whitelisted_players)
+            self.whitelisted_joins += 1
+        else:
+            name = "Intruder%d" % player_id
+            identity_id = str(uuid.UUID(int=self.rng.getrandbits(128)))
+            self.kick_expected[str(player_id)] = None
+        line = "%s   NETWORK      : ### %%s player: PlayerId=%d, Name=%s, IdentityId=%s\n" % (
+            timestamp, player_id, name, identity_id
+        )
+        lines = [line % "Creating"]
+        if self.rng.random() < self.update_ratio:
+            lines.append(line % "Updating")
+        return lines
+
+    def write(self, count: int) -> None:
+        """
+        Appends count lines and records the write time of any join among them.
+        """
+        now = time.time()
+        timestamp = time.strftime("%H:%M:%S", time.localtime(now)) + ".%03d" % (now % 1 * 1000)
+        chunk = []
+        new_kicks = []
+        for _ in range(count):
+            if self.rng.random() < self.join_ratio:
+                before = len(self.kick_expected)
+                chunk.extend(self._join_lines(timestamp))
+                if len(self.kick_expected) > before:
+                    new_kicks.append(str(self.next_player_id - 1))
+            else:
+                template = self.rng.choice(NOISE_LINES)
+                values = tuple(self.rng.randrange(1, 100000) for _ in range(template.count("%")))
+                chunk.append("%s   %s\n" % (timestamp, template % values))
+        with open(self.path, "a", encoding="utf-8") as log_file:
+            log_file.write("".join(chunk))
+        written = time.time()
+        for player_id in new_kicks:
+            self.kick_expected[player_id] = written
+        self.lines += len(chunk)
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def scrape_metrics(port: int) -> str:
+    with urllib.request.urlopen("http://127.0.0.1:%s/metrics" % port, timeout=1) as response:
+        return response.read().decode("utf-8")
+
+
+def metric_value(text: str, name: str) -> float:
+    match = re.search(r"^%s(?:\{[^}]*\})? (\S+)$" % re.escape(name), text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end join-to-kick benchmark.")
+    parser.add_argument("--rate", type=int, default=2000, help="Console lines written per second.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of traffic to write.")
+    parser.add_argument("--join-ratio", type=float, default=0.005, help="Share of lines that are joins.")
+    parser.add_argument("--whitelisted-ratio", type=float, default=0.5, help="Share of joins that are whitelisted.")
+    parser.add_argument("--update-ratio", type=float, default=0.8, help="Share of joins followed by an Updating line.")
+    parser.add_argument("--whitelist-size", type=int, default=10000, help="Entries in the generated JSON whitelist.")
+    parser.add_argument("--rcon-delay", type=float, default=0.0, help="Seconds the fake RCON server waits before replying.")
+    parser.add_argument("--kick-rate", type=float, default=0, help="RCON kick rate limit passed to the whitelist, 0 for none.")
+    parser.add_argument("--async", action="store_true", dest="use_async", help="Benchmark the --async runtime.")
+    parser.add_argument("--json", action="store_true", dest="as_json", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    rng = random.Random(2)
+    whitelisted_players = [
+        ("Member%d" % index, str(uuid.UUID(int=rng.getrandbits(128))))
+        for index in range(args.whitelist_size)
+    ]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        whitelist_path = os.path.join(temp_dir, "whitelist.json")
+        with open(whitelist_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "players": [
+                        {"game_name": name, "identity_id": identity_id, "whitelisted": 1}
+                        for name, identity_id in whitelisted_players
+                    ]
+                },
+                file,
+            )
+        base_log_dir = os.path.join(temp_dir, "server_logs")
+        session_dir = os.path.join(base_log_dir, time.strftime("logs_%Y-%m-%d_%H-%M-%S"))
+        os.makedirs(session_dir)
+        console_log_path = os.path.join(session_dir, "console.log")
+        open(console_log_path, "w").close()
+
+        server = FakeBattlEyeServer("password", args.rcon_delay)
+        metrics_port = free_port()
+        command = [
+            sys.executable, WHITELIST_SCRIPT, "--daemon",
+            "--ld", os.path.join(temp_dir, "whitelist_logs"),
+            "--wt", "json",
+            "--wp", whitelist_path,
+            "--bl", base_log_dir,
+            "--rh", "127.0.0.1",
+            "--rp", str(server.port),
+            "--rpw", "password",
+            "--mp", str(metrics_port),
+            "--kick-rate", str(args.kick_rate),
+        ]
+        if args.use_async:
+            command.append("--async")
+        child = subprocess.Popen(
+            command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+
+        try:
+            deadline = time.time() + 15
+            while True:
+                try:
+                    scrape_metrics(metrics_port)
+                    break
+                except OSError:
+                    if time.time() > deadline or child.poll() is not None:
+                        raise RuntimeError("whitelist process did not start")
+                    time.sleep(0.05)
+            # Give the tailer time to open the log before writing traffic.
+            time.sleep(0.5)
+
+            writer = ConsoleLogWriter(
+                console_log_path,
+                args.join_ratio,
+                args.whitelisted_ratio,
+                whitelisted_players,
+                args.update_ratio,
+            )
+            tick = 0.01
+            per_tick = args.rate * tick
+            started = time.time()
+            owed = 0.0
+            while time.time() - started < args.duration:
+                owed += per_tick
+                count = int(owed)
+                owed -= count
+                if count:
+                    writer.write(count)
+                time.sleep(max(0.0, started + (writer.lines / args.rate) - time.time()))
+            write_seconds = time.time() - started
+
+            drain_deadline = time.time() + 10
+            while time.time() < drain_deadline and len(server.kicks) < len(writer.kick_expected):
+                time.sleep(0.05)
+            metrics = scrape_metrics(metrics_port)
+        finally:
+            child.send_signal(signal.SIGINT)
+            try:
+                child.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                child.kill()
+                child.wait()
+            server.close()
+
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        latencies = [
+            server.kicks[player_id] - written
+            for player_id, written in writer.kick_expected.items()
+            if player_id in server.kicks and written is not None
+        ]
+        lines_read = metric_value(metrics, "whitelist_log_lines_total")
+        # ru_maxrss is in KiB on Linux and bytes on macOS.
+        rss_mib = usage.ru_maxrss / (1048576 if sys.platform == "darwin" else 1024)
+        report = {
+            "runtime": "async" if args.use_async else "threaded",
+            "lines_written": writer.lines,
+            "lines_read": int(lines_read),
+            "lines_per_sec": round(lines_read / write_seconds, 1),
+            "joins_to_kick": len(writer.kick_expected),
+            "kicks_received": len(server.kicks),
+            "whitelisted_joins": writer.whitelisted_joins,
+            "unexpected_kicks": len(set(server.kicks) - set(writer.kick_expected)),
+            "rcon_logins": server.logins,
+            "join_to_kick_p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "join_to_kick_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 2),
+            "cpu_percent": round((usage.ru_utime + usage.ru_stime) / write_seconds * 100, 1),
+            "max_rss_mib": round(rss_mib, 1),
+        }
+
+    if args.as_json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print("%-20s %s" % (key, value))
+
+
+if __name__ == "__main__":
+    main()
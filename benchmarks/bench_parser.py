@@ -0,0 +1,142 @@
+# bench_parser.py
+
+"""
+
+Measures how many console.log lines per second the log parser can handle.
+
+Generates a synthetic console.log that is mostly engine noise with a small
+share of player join lines, then compares the original per-line parser
+(uncompiled re.search plus an eagerly formatted debug message per line)
+with the prefiltered buffer parser the tailer now uses.
+
+    python benchmarks/bench_parser.py --lines 1000000 --join-ratio 0.001
+
+"""
+
+import argparse
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whitelist import LogTailer, parse_log_buffer
+
+
+NOISE_LINES = [
+    "SCRIPT       : Replication: sending snapshot for entity %d",
+    "RESOURCES    : Loaded resource {%08X}Prefabs/Props/Crate_%d.et",
+    "ENGINE       : FPS: %d.000000, frame time (avg: 16.67 ms, min: 15.90 ms, max: 19.%d ms)",
+    "NETWORK      : Bandwidth stats: in %d B/s, out %d B/s",
+    "WORLD        : Entity spawned at position <%d.0, 12.5, %d.0>",
+    "AI           : Group %d changed waypoint to %d",
+]
+
+
+def generate_console_log(path: str, lines: int, join_ratio: float) -> int:
+    """
+    Writes a synthetic console.log and returns the number of join lines in it.
+    """
+    rng = random.Random(1)
+    joins = 0
+    with open(path, "w", encoding="utf-8") as log_file:
+        for index in range(lines):
+            timestamp = "%02d:%02d:%02d.%03d" % (
+                index // 3600000 % 24, index // 60000 % 60, index // 1000 % 60, index % 1000
+            )
+            if rng.random() < join_ratio:
+                joins += 1
+                log_file.write(
+                    "%s   NETWORK      : ### %s player: PlayerId=%d, Name=Player%d, IdentityId=%s\n" % (
+                        timestamp,
+                        rng.choice(("Creating", "Updating")),
+                        joins,
+                        joins,
+                        uuid.UUID(int=rng.getrandbits(128)),
+                    )
+                )
+            else:
+                template = rng.choice(NOISE_LINES)
+                values = tuple(rng.randrange(1, 100000) for _ in range(template.count("%")))
+                log_file.write("%s   %s\n" % (timestamp, template % values))
+    return joins
+
+
+def run_legacy(path: str) -> int:
+    """
+    The original per-line loop from process_log_line.
+    """
+    matches = 0
+    with open(path, "r", encoding="utf-8") as log_file:
+        while True:
+            chunk = log_file.read(1024)
+            if not chunk:
+                break
+            for line in chunk.splitlines():
+                match = re.search(
+                    r"(Creating|Updating) player: PlayerId=(\d+), Name=([^,]+), IdentityId=([a-f0-9-]+)",
+                    line,
+                )
+                if match:
+                    matches += 1
+                else:
+                    logging.debug("Unmatched line: %s" % line)
+    return matches
+
+
+def run_buffered(path: str) -> int:
+    """
+    The tailer in batch mode feeding parse_log_buffer.
+    """
+    events = []
+    tailer = LogTailer(
+        path,
+        lambda text: events.extend(parse_log_buffer(text)),
+        follow_sessions=False,
+        batch=True,
+    )
+    tailer.open(offset=0)
+    tailer.read_available()
+    tailer.close()
+    return len(events)
+
+
+def measure(name: str, function: callable, path: str, lines: int, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        matches = function(path)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    rate = lines / best
+    print("%-10s %10.0f lines/sec  (%.3f s, %s joins)" % (name, rate, best, matches))
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark console.log parsing throughput.")
+    parser.add_argument("--lines", type=int, default=500000, help="Lines in the synthetic log.")
+    parser.add_argument("--join-ratio", type=float, default=0.001, help="Share of join lines.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per parser, best is reported.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "console.log")
+        joins = generate_console_log(path, args.lines, args.join_ratio)
+        print(
+            "Synthetic console.log: %s lines, %s joins, %.1f MiB" % (
+                args.lines, joins, os.path.getsize(path) / 1048576
+            )
+        )
+        legacy = measure("legacy", run_legacy, path, args.lines, args.repeat)
+        buffered = measure("buffered", run_buffered, path, args.lines, args.repeat)
+        print("speedup    %10.1fx" % (buffered / legacy))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,15 +6,67 @@ import os
 import json
 import sqlite3
 import re
+import time
+import asyncio
+import socket
+import threading
+import urllib.request
+import logging
+import queue
+import signal
+import tracemalloc
+import concurrent.futures
+from rcon.battleye.proto import Header
+import whitelist
 from whitelist import (
     setup_logging,
+    DeferredQueueHandler,
+    Diagnostics,
+    install_diagnostics,
     heartbeat,
+    Watchdog,
+    health_status,
+    sd_notify,
+    option_defaults,
+    PersistentDecisionCache,
+    set_persistent_decision_cache,
     find_latest_log_dir,
+    LogDirectoryWatcher,
     is_player_in_database,
+    DatabaseWhitelist,
+    migrate_database,
     is_player_in_json,
+    JsonWhitelist,
+    SnapshotWhitelist,
+    compile_snapshot,
+    iter_json_players,
+    import_json_to_database,
+    sync_json_to_database,
+    export_database_to_json,
     execute_kick_command,
+    KickResult,
+    RconManager,
+    TokenBucket,
+    jittered_backoff,
+    DecisionCache,
     tail_log_file,
+    LogTailer,
+    InotifyWaiter,
     process_log_line,
+    parse_log_line,
+    parse_log_buffer,
+    PlayerEvent,
+    Checkpoint,
+    scan_log_backlog,
+    resume_from_checkpoint,
+    MetricsRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    start_metrics_server,
+    run_async_pipeline,
+    load_servers_config,
+    run_servers,
 )
 
 
@@ -26,6 +78,52 @@ def test_setup_logging(tmp_path):
     assert log_file.exists()
 
 
+def test_setup_logging_twice_logs_to_the_new_file(tmp_path):
+    setup_logging(str(tmp_path / "first"))
+    setup_logging(str(tmp_path / "second"))
+    logging.getLogger().info("After second setup")
+    whitelist._log_listener.stop()
+
+    assert "After second setup" in (tmp_path / "second" / "whitelist.log").read_text()
+    assert "After second setup" not in (tmp_path / "first" / "whitelist.log").read_text()
+    whitelist._log_listener.start()
+
+
+def test_deferred_queue_handler_keeps_arguments():
+    handler = DeferredQueueHandler(queue.SimpleQueue())
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "Player %s", ("A",), None)
+
+    prepared = handler.prepare(record)
+    assert prepared.msg == "Player %s"
+    assert prepared.args == ("A",)
+
+
+def test_audit_log_records_decisions(tmp_path, mocker):
+    mocker.patch("whitelist.is_player_in_json", side_effect=[True, False])
+    kick = concurrent.futures.Future()
+    mocker.patch("whitelist.execute_kick_command", return_value=kick)
+    audit_path = tmp_path / "audit.jsonl"
+    whitelist.set_audit_log(str(audit_path))
+    try:
+        for line in (
+            "### Creating player: PlayerId=1, Name=Allowed, IdentityId=aaaa-1111",
+            "### Creating player: PlayerId=2, Name=Blocked, IdentityId=bbbb-2222",
+        ):
+            process_log_line(line, "json", str(tmp_path / "wl.json"), "localhost", 2302, "pw")
+        kick.set_result(KickResult("2", False, "timed out"))
+    finally:
+        whitelist.set_audit_log(None)
+
+    records = [json.loads(line) for line in audit_path.read_text().splitlines()]
+    assert [record["player"] for record in records] == ["Allowed", "Blocked"]
+    assert records[0]["whitelisted"] is True
+    assert records[0]["cached"] is False
+    assert "kick" not in records[0]
+    assert records[1]["server"] == "localhost:2302"
+    assert records[1]["kick"] == "failure"
+    assert records[1]["kick_error"] == "timed out"
+
+
 def test_heartbeat(mocker):
     mock_sleep = mocker.patch("time.sleep", side_effect=KeyboardInterrupt)
     with pytest.raises(KeyboardInterrupt):
@@ -33,6 +131,59 @@ def test_heartbeat(mocker):
     assert mock_sleep.call_count == 1
 
 
+def test_diagnostics_capture_writes_reports(tmp_path):
+    stop = threading.Event()
+
+    def busy_loop():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_loop, name="BusyThread")
+    worker.start()
+    diagnostics = Diagnostics(
+        str(tmp_path), profile_seconds=0.2, sample_interval=0.01, trace_memory=True
+    )
+    try:
+        profile_path, memory_path = diagnostics.capture()
+        _, second_memory_path = diagnostics.capture()
+    finally:
+        stop.set()
+        worker.join()
+        tracemalloc.stop()
+
+    profile = open(profile_path, encoding="utf-8").read()
+    assert "BusyThread" in profile
+    assert "busy_loop" in profile
+    collapsed = open(profile_path[:-4] + ".collapsed", encoding="utf-8").read()
+    assert collapsed.startswith("BusyThread;") or ";busy_loop" in collapsed
+    assert "Started tracing allocations" in open(memory_path, encoding="utf-8").read()
+    assert "Growth since previous report" in open(second_memory_path, encoding="utf-8").read()
+
+
+def test_diagnostics_capture_leaves_allocation_tracing_off(tmp_path):
+    diagnostics = Diagnostics(str(tmp_path), profile_seconds=0.05, sample_interval=0.01)
+    _, memory_path = diagnostics.capture()
+
+    assert not tracemalloc.is_tracing()
+    report = open(memory_path, encoding="utf-8").read()
+    assert "Queue depths" in report
+    assert "--trace-memory" in report
+    assert "Largest allocations" not in report
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGUSR1"), reason="SIGUSR1 is not available")
+def test_install_diagnostics_on_sigusr1(tmp_path, mocker):
+    mock_trigger = mocker.patch.object(Diagnostics, "trigger")
+    previous = signal.getsignal(signal.SIGUSR1)
+    try:
+        install_diagnostics(str(tmp_path))
+        os.kill(os.getpid(), signal.SIGUSR1)
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
+
+    mock_trigger.assert_called_once_with()
+
+
 def test_find_latest_log_dir(tmp_path):
     base_log_dir = tmp_path / "logs"
     os.makedirs(base_log_dir / "logs_2024-01-01_12-00-00")
@@ -44,13 +195,88 @@ def test_find_latest_log_dir(tmp_path):
     )
 
 
-def test_is_player_in_database(mocker):
-    mock_connect = mocker.patch("sqlite3.connect")
-    mock_cursor = mock_connect.return_value.__enter__.return_value.cursor.return_value
-    mock_cursor.fetchone.return_value = (1,)
+def test_log_directory_watcher_detects_new_session(tmp_path):
+    base_log_dir = tmp_path / "logs"
+    os.makedirs(base_log_dir / "logs_2024-01-01_12-00-00")
+    current = base_log_dir / "logs_2024-01-01_12-00-00" / "console.log"
+    current.write_text("")
+
+    watcher = LogDirectoryWatcher.for_log_file(str(current))
+    assert watcher.check() is None
+
+    new_dir = base_log_dir / "logs_2024-01-02_12-00-00"
+    os.makedirs(new_dir)
+    assert watcher.check() is None
+
+    (new_dir / "console.log").write_text("")
+    assert watcher.check() == str(new_dir / "console.log")
+    assert watcher.check() is None
+
+
+def test_log_tailer_follows_new_session(tmp_path):
+    base_log_dir = tmp_path / "logs"
+    os.makedirs(base_log_dir / "logs_2024-01-01_12-00-00")
+    current = base_log_dir / "logs_2024-01-01_12-00-00" / "console.log"
+    current.write_text("")
+    lines = []
+    tailer = LogTailer(str(current), lines.append, max_wait=0.1)
+    thread = threading.Thread(target=tailer.run)
+    thread.start()
+
+    new_dir = base_log_dir / "logs_2024-01-02_12-00-00"
+    os.makedirs(new_dir)
+    (new_dir / "console.log").write_text("first line\n")
+    for _ in range(50):
+        if lines:
+            break
+        time.sleep(0.05)
+    tailer.stop()
+    thread.join()
+
+    assert lines == ["first line"]
+    assert tailer.file_path == str(new_dir / "console.log")
+
 
-    assert is_player_in_database("player1", "id1", "db_path")
-    mock_cursor.execute.assert_called_once()
+def create_user_data(db_path, rows):
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE user_data (game_name TEXT, whitelisted INTEGER)"
+        )
+        conn.executemany("INSERT INTO user_data VALUES (?, ?)", rows)
+    conn.close()
+
+
+def test_is_player_in_database(tmp_path):
+    db_path = str(tmp_path / "whitelist.db")
+    create_user_data(db_path, [("Player1", 1), ("player2", 0)])
+
+    assert is_player_in_database("player1", "id1", db_path)
+    assert not is_player_in_database("player2", "id2", db_path)
+
+
+def test_migrate_database_adds_identity_lookup(tmp_path):
+    db_path = str(tmp_path / "whitelist.db")
+    create_user_data(db_path, [("player1", 1)])
+
+    migrate_database(db_path)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "UPDATE user_data SET identity_id = ? WHERE game_name = ?",
+            ("6FA40F96-F8E9-44AC-BE26-E0660C79B88A", "player1"),
+        )
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(user_data)")}
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN " + DatabaseWhitelist.IDENTITY_QUERY, ("a", "b")
+        ).fetchall()
+    conn.close()
+
+    assert {"idx_user_data_game_name", "idx_user_data_identity_id"} <= indexes
+    assert "SCAN" not in " ".join(str(row[-1]) for row in plan)
+
+    whitelist = DatabaseWhitelist(db_path)
+    assert whitelist.is_whitelisted("renamed", "6fa40f96-f8e9-44ac-be26-e0660c79b88a")
+    assert not whitelist.is_whitelisted("renamed", "other")
+    whitelist.close()
 
 
 def test_is_player_in_json(tmp_path):
@@ -66,26 +292,1041 @@ def test_is_player_in_json(tmp_path):
     assert is_player_in_json("player1", "id1", str(json_path))
 
 
-def test_execute_kick_command(mocker):
-    mock_client = mocker.patch("rcon.battleye.Client")
-    mock_instance = mock_client.return_value.__enter__.return_value
+def test_json_whitelist_reloads_on_change(tmp_path):
+    json_path = tmp_path / "whitelist.json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": [{"game_name": "Player1", "identity_id": "ID1", "whitelisted": 1}]}, f)
+
+    whitelist = JsonWhitelist(str(json_path))
+    assert whitelist.load()
+    assert whitelist.is_whitelisted("player1", "other")
+    assert whitelist.is_whitelisted("other", "id1")
+    assert not whitelist.refresh()
+
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": [{"game_name": "player2", "identity_id": "id2", "whitelisted": 1}]}, f)
+
+    assert whitelist.refresh()
+    assert not whitelist.is_whitelisted("player1", "id1")
+    assert whitelist.is_whitelisted("player2", "id2")
+
+
+def test_json_whitelist_keeps_last_good_index(tmp_path):
+    json_path = tmp_path / "whitelist.json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": [{"game_name": "player1", "identity_id": "id1", "whitelisted": 1}]}, f)
+
+    whitelist = JsonWhitelist(str(json_path))
+    whitelist.load()
+
+    with open(json_path, "w", encoding="utf-8") as f:
+        f.write('{"players": [')
+
+    assert not whitelist.refresh()
+    assert whitelist.is_whitelisted("player1", "id1")
+
+
+def test_json_whitelist_rejects_wrong_layout(tmp_path):
+    json_path = tmp_path / "whitelist.json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": [
+            {"game_name": None, "identity_id": "id1", "whitelisted": 1},
+            {"game_name": "player2", "whitelisted": 1},
+        ]}, f)
+
+    whitelist = JsonWhitelist(str(json_path))
+    assert whitelist.load()
+    assert whitelist.is_whitelisted("other", "id1")
+    assert whitelist.is_whitelisted("player2", "other")
+
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump([{"game_name": "player3"}], f)
+    assert not whitelist.refresh()
+    assert whitelist.is_whitelisted("player2", "other")
+
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": [{"game_name": 5, "whitelisted": 1}]}, f)
+    assert not whitelist.load()
+    assert whitelist.is_whitelisted("other", "id1")
+
+def test_snapshot_whitelist_from_json(tmp_path):
+    json_path = tmp_path / "whitelist.json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": [
+            {"game_name": "Player1", "identity_id": "6FA40F96-F8E9-44AC-BE26-E0660C79B88A", "whitelisted": 1},
+            {"game_name": "player2", "identity_id": "legacy-id", "whitelisted": 1},
+            {"game_name": "player3", "identity_id": "0b2c5d8e-1111-4a4a-9b9b-000000000003", "whitelisted": 0},
+        ]}, f)
+    snapshot_path = str(tmp_path / "whitelist.snap")
+
+    assert compile_snapshot("json", str(json_path), snapshot_path) == (1, 3)
+
+    whitelist = SnapshotWhitelist(snapshot_path)
+    assert whitelist.load()
+    assert whitelist.is_whitelisted("renamed", "6fa40f96-f8e9-44ac-be26-e0660c79b88a")
+    assert whitelist.is_whitelisted("PLAYER1", "other")
+    assert whitelist.is_whitelisted("renamed", "LEGACY-ID")
+    assert not whitelist.is_whitelisted("player3", "0b2c5d8e-1111-4a4a-9b9b-000000000003")
+    assert not whitelist.refresh()
+
+
+def test_snapshot_whitelist_from_database(tmp_path):
+    db_path = str(tmp_path / "whitelist.db")
+    create_user_data(db_path, [("Player1", 1), ("player2", 0)])
+    snapshot_path = str(tmp_path / "whitelist.snap")
+    compile_snapshot("database", db_path, snapshot_path)
+
+    whitelist = SnapshotWhitelist(snapshot_path)
+    whitelist.load()
+    assert whitelist.is_whitelisted("player1", "id1")
+    assert not whitelist.is_whitelisted("player2", "id2")
+
+    create_user_data(str(tmp_path / "other.db"), [("player2", 1)])
+    compile_snapshot("database", str(tmp_path / "other.db"), snapshot_path)
+    assert whitelist.refresh()
+    assert whitelist.is_whitelisted("player2", "id2")
+    assert not whitelist.is_whitelisted("player1", "id1")
+
+
+def test_snapshot_recompile_replaces_only_the_pointer(tmp_path):
+    db_path = str(tmp_path / "whitelist.db")
+    create_user_data(db_path, [("Player1", 1)])
+    snapshot_path = str(tmp_path / "whitelist.snap")
+    compile_snapshot("database", db_path, snapshot_path)
+    whitelist = SnapshotWhitelist(snapshot_path)
+    whitelist.load()
+    first_mapping = whitelist._snapshot[0]
+
+    for _ in range(2):
+        compile_snapshot("database", db_path, snapshot_path)
+        assert whitelist.refresh()
+
+    assert first_mapping.closed
+    assert whitelist.is_whitelisted("player1", "id1")
+    data_files = [path.name for path in tmp_path.iterdir() if path.name.endswith(".data")]
+    assert data_files == [open(snapshot_path, encoding="utf-8").read()]
+
+
+def test_snapshot_whitelist_rejects_invalid_file(tmp_path):
+    snapshot_path = tmp_path / "whitelist.snap"
+    snapshot_path.write_text("whitelist.snap.data")
+    (tmp_path / "whitelist.snap.data").write_bytes(b"not a snapshot")
+
+    whitelist = SnapshotWhitelist(str(snapshot_path))
+    assert not whitelist.load()
+    assert not whitelist.is_whitelisted("player1", "id1")
+
+
+def test_iter_json_players_streams_across_chunks(tmp_path):
+    json_path = tmp_path / "whitelist.json"
+    players = [
+        {"game_name": "player%s" % index, "identity_id": "id%s" % index, "whitelisted": index % 2}
+        for index in range(50)
+    ]
+    json_path.write_text(json.dumps({"version": 12345, "players": players, "extra": [1, 2]}, indent=2))
+    assert list(iter_json_players(str(json_path), chunk_size=7)) == players
+
+    json_path.write_text('{"players": [{"game_name": "a"}')
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_players(str(json_path), chunk_size=7))
+
+
+def test_iter_json_players_floats_across_chunks(tmp_path):
+    json_path = tmp_path / "whitelist.json"
+    document = {
+        "version": 12.5,
+        "players": [
+            {"game_name": "player%s" % index, "score": value, "whitelisted": 1}
+            for index, value in enumerate([1.25, -3.5e-7, 2e10, 0.0, 1234567.875, -0.5])
+        ],
+        "ratio": 6.02e+23,
+    }
+    text = json.dumps(document)
+    json_path.write_text(text)
+    # Every chunk size that cuts a number after ".", "e", "e-" or a digit.
+    for chunk_size in range(1, len(text) + 1):
+        assert list(iter_json_players(str(json_path), chunk_size)) == document["players"]
+
+
+def test_import_sync_and_export_json(tmp_path):
+    json_path = tmp_path / "whitelist.json"
+    db_path = str(tmp_path / "whitelist.db")
+    json_path.write_text(json.dumps({"players": [
+        {"game_name": "player1", "identity_id": "id1", "whitelisted": 1},
+        {"game_name": "player2", "identity_id": "id2", "whitelisted": 1},
+        {"game_name": "player3", "identity_id": "id3", "whitelisted": 0},
+    ]}))
+
+    assert import_json_to_database(str(json_path), db_path, batch_size=2) == 3
+    assert is_player_in_database("other", "id2", db_path)
+
+    json_path.write_text(json.dumps({"players": [
+        {"game_name": "player1", "identity_id": "id1", "whitelisted": 0},
+        {"game_name": "player3", "identity_id": "id3", "whitelisted": 0},
+        {"game_name": "player4", "identity_id": "id4", "whitelisted": 1},
+    ]}))
+    assert sync_json_to_database(str(json_path), db_path) == (1, 1, 1)
+    assert sync_json_to_database(str(json_path), db_path) == (0, 0, 0)
+
+    export_path = tmp_path / "export.json"
+    assert export_database_to_json(db_path, str(export_path)) == 3
+    exported = json.loads(export_path.read_text())["players"]
+    assert sorted((player["game_name"], player["whitelisted"]) for player in exported) == [
+        ("player1", 0), ("player3", 0), ("player4", 1),
+    ]
+
+
+class FakeBattlEyeServer:
+    """
+    Minimal BattlEye RCON server that records the commands it receives.
+    """
+
+    def __init__(self, password="password"):
+        self.password = password
+        self.commands = []
+        self.logins = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+        self.port = self.sock.getsockname()[1]
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def send(self, typ, payload, address):
+        self.sock.sendto(bytes(Header.create(typ, payload)) + payload, address)
+
+    def serve(self):
+        while not self.stop_event.is_set():
+            try:
+                data, address = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            typ, payload = data[7], data[8:]
+            if typ == 0x00:
+                self.logins += 1
+                success = payload.decode("ascii") == self.password
+                self.send(0x00, b"\x01" if success else b"\x00", address)
+            elif typ == 0x01:
+                self.commands.append(payload[1:].decode("ascii"))
+                self.send(0x01, payload[:1], address)
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.sock.close()
+
+
+@pytest.fixture
+def battleye_server():
+    server = FakeBattlEyeServer()
+    yield server
+    server.close()
+
+
+def test_execute_kick_command(battleye_server):
+    result = execute_kick_command(
+        "player1", "127.0.0.1", battleye_server.port, "password"
+    ).result(timeout=5)
+
+    assert result == KickResult("player1", True)
+    assert battleye_server.commands == ["#kick player1"]
+
+
+def test_rcon_manager_reuses_session(battleye_server):
+    manager = RconManager("127.0.0.1", battleye_server.port, "password")
+    manager.start()
+    futures = [manager.kick(str(player_id)) for player_id in range(5)]
+    results = [future.result(timeout=5) for future in futures]
+    manager.stop()
+
+    assert all(result.success for result in results)
+    assert battleye_server.commands == ["#kick %s" % i for i in range(5)]
+    assert battleye_server.logins == 1
+
+
+def test_rcon_manager_reports_failure(battleye_server):
+    manager = RconManager(
+        "127.0.0.1", battleye_server.port, "wrong", kick_attempts=1
+    )
+    manager.start()
+    result = manager.kick("player1").result(timeout=5)
+    manager.stop()
+
+    assert not result.success
+    assert battleye_server.commands == []
+
+
+def test_rcon_manager_retries_after_fresh_kicks(mocker):
+    calls = []
+
+    def execute_kick(session, player_id):
+        calls.append(player_id)
+        return KickResult(player_id, player_id != "1" or calls.count("1") > 1, "timed out")
+
+    manager = RconManager("127.0.0.1", 1, "password", retry_delay=0.0)
+    mocker.patch.object(manager, "_execute_kick", side_effect=execute_kick)
+    futures = [manager.kick(player_id) for player_id in ("1", "2", "3")]
+    manager.start()
+    results = [future.result(timeout=5) for future in futures]
+    manager.stop()
+
+    assert all(result.success for result in results)
+    assert calls == ["1", "2", "3", "1"]
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_rcon_manager_requeues_retries_when_worker_dies(mocker):
+    calls = []
+
+    def execute_kick(session, player_id):
+        calls.append(player_id)
+        if player_id == "2" and calls.count("2") == 1:
+            raise RuntimeError("worker crashed")
+        if calls.count(player_id) > 1:
+            return KickResult(player_id, True)
+        return KickResult(player_id, False, "timed out")
+
+    manager = RconManager("127.0.0.1", 1, "password", retry_delay=60.0, max_backoff=60.0)
+    mocker.patch.object(manager, "_execute_kick", side_effect=execute_kick)
+    retried = manager.kick("1")
+    crashed = manager.kick("2")
+    manager.start()
+    manager._threads[0].join(timeout=5)
+
+    assert crashed.result(timeout=1) == KickResult("2", False, "RCON worker died: worker crashed")
+    assert not retried.done()
+    manager.revive()
+    assert retried.result(timeout=5) == KickResult("1", True)
+    manager.stop()
+
+    assert calls == ["1", "2", "1"]
+    assert manager.kick("2") is not crashed
+
+
+def test_rcon_manager_drops_kicks_when_queue_is_full():
+    manager = RconManager("127.0.0.1", 1, "password", max_queue=1)
+    manager.kick("1")
+    dropped = whitelist.KICKS.value(("dropped",))
+
+    result = manager.kick("2").result(timeout=1)
+    assert result == KickResult("2", False, "kick queue is full")
+    assert whitelist.KICKS.value(("dropped",)) == dropped + 1
+
+
+def test_token_bucket(mocker):
+    mock_monotonic = mocker.patch("time.monotonic", return_value=100.0)
+    bucket = TokenBucket(rate=10, burst=2)
+
+    assert [bucket.reserve() for _ in range(4)] == pytest.approx([0, 0, 0.1, 0.2])
+    mock_monotonic.return_value = 101.0
+    assert bucket.reserve() == 0
+    assert TokenBucket(rate=0).reserve() == 0
+
+
+def test_jittered_backoff():
+    for attempt in range(8):
+        delay = jittered_backoff(attempt, 1.0, 30.0)
+        assert 0.5 * min(30.0, 2 ** attempt) <= delay <= min(30.0, 1.5 * 2 ** attempt)
+
+
+def test_jittered_backoff_never_exceeds_maximum(mocker):
+    mocker.patch("random.uniform", return_value=1.5)
+
+    assert jittered_backoff(10, 1.0, 30.0) == 30.0
+    assert jittered_backoff(2, 1.0, 30.0) == 6.0
+
+
+def test_decision_cache_ttl_and_lru(mocker):
+    cache = DecisionCache(max_entries=2, ttl=10)
+    mock_monotonic = mocker.patch("time.monotonic", return_value=100.0)
+
+    cache.put("1", "AA", True)
+    cache.put("2", "bb", False)
+    assert cache.get("1", "aa") is True
+    cache.put("3", "cc", True)
+    assert cache.get("2", "bb") is None
+    assert cache.get("3", "cc") is True
+
+    mock_monotonic.return_value = 111.0
+    assert cache.get("1", "aa") is None
+
+
+def test_decision_cache_skips_repeat_lookups(tmp_path, mocker):
+    json_path = tmp_path / "whitelist.json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": []}, f)
+    mock_execute_kick_command = mocker.patch("whitelist.execute_kick_command")
+    mock_is_player_in_json = mocker.spy(whitelist, "is_player_in_json")
+    lines = [
+        "NETWORK : ### Creating player: PlayerId=5, Name=Guest, IdentityId=cc",
+        "NETWORK : ### Updating player: PlayerId=5, Name=Guest, IdentityId=cc",
+    ]
+
+    for line in lines:
+        process_log_line(line, "json", str(json_path), "localhost", 2302, "password")
+    assert mock_is_player_in_json.call_count == 1
+    assert mock_execute_kick_command.call_count == 2
+
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": [{"game_name": "Guest", "identity_id": "cc", "whitelisted": 1}]}, f)
+    whitelist.get_json_whitelist(str(json_path)).refresh()
+    assert len(whitelist.get_decision_cache("json", str(json_path))) == 0
+
+    process_log_line(lines[1], "json", str(json_path), "localhost", 2302, "password")
+    assert mock_is_player_in_json.call_count == 2
+    assert mock_execute_kick_command.call_count == 2
+
+
+def test_database_whitelist_batch_lookup(tmp_path):
+    db_path = str(tmp_path / "whitelist.db")
+    create_user_data(db_path, [("Player1", 1), ("player2", 0), ("legacy-id", 1)])
+    players = [("player1", "x"), ("player2", "y"), ("other", "LEGACY-ID"), ("nobody", "z")]
+
+    whitelist = DatabaseWhitelist(db_path)
+    assert whitelist.is_whitelisted_many(players) == [True, False, True, False]
+
+    migrate_database(db_path)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE user_data SET identity_id = 'ID2', whitelisted = 1 WHERE game_name = 'player2'")
+    conn.close()
+    whitelist = DatabaseWhitelist(db_path)
+    whitelist.BATCH_SIZE = 2
+    # The identity kept in game_name still matches after the migration.
+    assert whitelist.is_whitelisted_many(players) == [True, True, True, False]
+    assert whitelist.is_whitelisted_many([("renamed", "id2")]) == [True]
+    whitelist.close()
+
+
+def test_migrated_database_matches_identity_in_game_name(tmp_path):
+    db_path = str(tmp_path / "whitelist.db")
+    create_user_data(db_path, [("6fa40f96-f8e9-44ac-be26-e0660c79b88a", 1)])
+    migrate_database(db_path)
+
+    whitelist = DatabaseWhitelist(db_path)
+    assert whitelist.is_whitelisted("Renamed", "6FA40F96-F8E9-44AC-BE26-E0660C79B88A")
+    assert not whitelist.is_whitelisted("Renamed", "other-id")
+    whitelist.close()
+
+
+def test_database_whitelist_version_follows_commits(tmp_path):
+    db_path = str(tmp_path / "whitelist.db")
+    create_user_data(db_path, [("Player1", 1)])
+    whitelist = DatabaseWhitelist(db_path)
+    version = whitelist.version()
+    assert version == whitelist.version()
+
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO user_data VALUES ('player2', 1)")
+    conn.close()
+    assert whitelist.version() != version
+    whitelist.close()
+
+
+def test_check_players_looks_up_misses_together(tmp_path, mocker):
+    mock_are_players_whitelisted = mocker.patch(
+        "whitelist.are_players_whitelisted", return_value=[True, False]
+    )
+    path = str(tmp_path / "whitelist.json")
+    events = [
+        PlayerEvent("Creating", "1", "Allowed", "aa"),
+        PlayerEvent("Creating", "2", "Intruder", "bb"),
+        PlayerEvent("Updating", "2", "Intruder", "BB"),
+    ]
+
+    decisions = whitelist.check_players(events, "json", path)
+    assert [decision.whitelisted for decision in decisions] == [True, False, False]
+    mock_are_players_whitelisted.assert_called_once_with(
+        [("Allowed", "aa"), ("Intruder", "bb")], "json", path
+    )
+
+    decisions = whitelist.check_players(events[:1], "json", path)
+    assert decisions[0].cached
+    assert mock_are_players_whitelisted.call_count == 1
+
+
+def test_persistent_decision_cache_warm_start(tmp_path, mocker):
+    json_path = str(tmp_path / "whitelist.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": [{"game_name": "Player1", "identity_id": "id1", "whitelisted": 1}]}, f)
+    cache_path = str(tmp_path / "decisions.db")
+
+    set_persistent_decision_cache(cache_path)
+    try:
+        assert not whitelist.check_player("1", "Player1", "id1", "json", json_path).cached
+        assert not whitelist.check_player("2", "Intruder", "id2", "json", json_path).cached
+    finally:
+        set_persistent_decision_cache(None)
+
+    # After a restart players have new PlayerIds, so only the sidecar knows them.
+    mock_lookup = mocker.patch(
+        "whitelist.is_player_whitelisted", side_effect=AssertionError("looked up")
+    )
+    set_persistent_decision_cache(cache_path)
+    try:
+        decision = whitelist.check_player("11", "Player1", "ID1", "json", json_path)
+        assert decision.whitelisted and decision.cached
+        decision = whitelist.check_player("12", "Intruder", "id2", "json", json_path)
+        assert not decision.whitelisted and decision.cached
+        assert mock_lookup.call_count == 0
+    finally:
+        set_persistent_decision_cache(None)
+
+
+def test_persistent_decision_cache_revalidates_stale_decisions(tmp_path, mocker):
+    json_path = str(tmp_path / "whitelist.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": [{"game_name": "Player1", "identity_id": "id1", "whitelisted": 1}]}, f)
+    cache_path = str(tmp_path / "decisions.db")
+    set_persistent_decision_cache(cache_path)
+    try:
+        whitelist.check_players(
+            [
+                PlayerEvent("Creating", "1", "Player1", "id1"),
+                PlayerEvent("Creating", "2", "Intruder", "id2"),
+            ],
+            "json",
+            json_path,
+        )
+    finally:
+        set_persistent_decision_cache(None)
+
+    # The whitelist changes while the process is down.
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": [{"game_name": "Intruder", "identity_id": "id2", "whitelisted": 1}]}, f)
+    store = whitelist.get_whitelist_store("json", json_path)
+    assert store.refresh()
+    mock_notify = mocker.spy(store, "notify_listeners")
+
+    persistent = PersistentDecisionCache(cache_path, revalidate_delay=0)
+    mocker.patch("whitelist._persistent_decisions", persistent)
+    try:
+        # The stale "whitelisted" is served straight away and revalidated later,
+        decision = whitelist.check_player("11", "Player1", "id1", "json", json_path)
+        assert decision.whitelisted and decision.cached
+        # while a stale "not whitelisted" is looked up again before kicking.
+        decision = whitelist.check_player("12", "Intruder", "id2", "json", json_path)
+        assert decision.whitelisted and not decision.cached
+
+        deadline = time.time() + 5
+        while not mock_notify.called:
+            assert time.time() < deadline
+            time.sleep(0.01)
+        assert persistent.get("json", json_path, "Player1", "id1") == (False, True)
+        change = mock_notify.call_args[0][0]
+        assert change.removed_identities == frozenset({"id1"})
+    finally:
+        persistent.close()
+
+
+def test_persistent_decisions_are_tagged_with_the_loaded_version(tmp_path):
+    json_path = str(tmp_path / "whitelist.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": [{"game_name": "Player1", "identity_id": "id1", "whitelisted": 1}]}, f)
+    cache_path = str(tmp_path / "decisions.db")
+    store = whitelist.get_whitelist_store("json", json_path)
+    loaded = store.version()
+
+    # Written, but not reloaded yet, so lookups still answer from the old index.
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": []}, f)
+    set_persistent_decision_cache(cache_path)
+    try:
+        assert whitelist.check_player("1", "Player1", "id1", "json", json_path).whitelisted
+    finally:
+        set_persistent_decision_cache(None)
+
+    with sqlite3.connect(cache_path) as conn:
+        assert conn.execute("SELECT version FROM decisions").fetchall() == [(loaded,)]
+    conn.close()
+    assert store.refresh()
+    persistent = PersistentDecisionCache(cache_path)
+    try:
+        assert persistent.get("json", json_path, "Player1", "id1") == (True, False)
+    finally:
+        persistent.close()
+
+
+def test_revocation_recheck_skips_persistent_decisions(tmp_path, mocker):
+    json_path = str(tmp_path / "whitelist.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": []}, f)
+    persistent = mocker.patch("whitelist._persistent_decisions")
+    persistent.get.side_effect = AssertionError("sidecar read")
+
+    decisions = whitelist.check_players(
+        [PlayerEvent(whitelist.REVOKED_ACTION, "1", "Player1", "id1")], "json", json_path
+    )
+    assert not decisions[0].whitelisted and not decisions[0].cached
+
+
+def test_join_coalescer_batches_close_joins(tmp_path, mocker):
+    mock_are_players_whitelisted = mocker.patch(
+        "whitelist.are_players_whitelisted", side_effect=lambda players, *args: [False] * len(players)
+    )
+    mock_execute_kick_command = mocker.patch("whitelist.execute_kick_command")
+    coalescer = whitelist.JoinCoalescer("json", str(tmp_path / "whitelist.json"), window=0.2)
+    coalescer.start()
+    for index in range(5):
+        coalescer.add([PlayerEvent("Creating", str(index), "Player%s" % index, "id%s" % index)], "localhost", 2302, "pw")
+    coalescer.stop()
+
+    assert mock_are_players_whitelisted.call_count == 1
+    assert len(mock_are_players_whitelisted.call_args[0][0]) == 5
+    assert mock_execute_kick_command.call_count == 5
+
+
+def test_parse_disconnect_events():
+    text = (
+        "NETWORK : ### Creating player: PlayerId=4, Name=Joiner, IdentityId=aa\n"
+        "NETWORK : ### Creating player: PlayerId=5, Name=NoIdentity\n"
+        "NETWORK : ### Disconnecting player: PlayerId=4, Name=Joiner\n"
+    )
+
+    assert parse_log_buffer(text) == [
+        PlayerEvent("Creating", "4", "Joiner", "aa"),
+        PlayerEvent("Disconnecting", "4", "Joiner", ""),
+    ]
+    assert parse_log_line(text.splitlines()[1]) is None
+    assert parse_log_line(text.splitlines()[2]) == PlayerEvent("Disconnecting", "4", "Joiner", "")
+
+
+def test_roster_revokes_removed_players(tmp_path, mocker):
+    json_path = tmp_path / "whitelist.json"
+    json_path.write_text(json.dumps({"players": [
+        {"game_name": "Stays", "identity_id": "aa", "whitelisted": 1},
+        {"game_name": "Removed", "identity_id": "bb", "whitelisted": 1},
+        {"game_name": "Leaves", "identity_id": "cc", "whitelisted": 1},
+    ]}))
+    mock_execute_kick_command = mocker.patch("whitelist.execute_kick_command")
+    mock_are_players_whitelisted = mocker.spy(whitelist, "are_players_whitelisted")
+
+    whitelist.process_log_lines(
+        "NETWORK : ### Creating player: PlayerId=1, Name=Stays, IdentityId=aa\n"
+        "NETWORK : ### Creating player: PlayerId=2, Name=Removed, IdentityId=bb\n"
+        "NETWORK : ### Creating player: PlayerId=3, Name=Leaves, IdentityId=cc\n"
+        "NETWORK : ### Disconnecting player: PlayerId=3, Name=Leaves\n",
+        "json", str(json_path), "localhost", 2302, "password",
+    )
+    roster = whitelist.get_roster_enforcer("json", str(json_path), "localhost", 2302, "password").roster
+    assert sorted(entry.player_id for entry in roster.entries()) == ["1", "2"]
+    assert not mock_execute_kick_command.called
+
+    json_path.write_text(json.dumps({"players": [
+        {"game_name": "Stays", "identity_id": "aa", "whitelisted": 1},
+        {"game_name": "Leaves", "identity_id": "cc", "whitelisted": 1},
+    ]}))
+    assert whitelist.get_json_whitelist(str(json_path)).refresh()
+
+    mock_execute_kick_command.assert_called_once_with("2", "localhost", 2302, "password")
+    # Only the player whose entry was removed is looked up again.
+    assert mock_are_players_whitelisted.call_args[0][0] == [("Removed", "bb")]
+    assert [entry.player_id for entry in roster.entries()] == ["1"]
+
 
-    execute_kick_command("player1", "localhost", 2302, "password")
-    mock_instance.run.assert_called_once_with("#kick player1")
+def test_rcon_manager_deduplicates_inflight_kicks(battleye_server):
+    manager = RconManager("127.0.0.1", battleye_server.port, "password")
+    first = manager.kick("9")
+    second = manager.kick("9")
+    manager.start()
+    first.result(timeout=5)
+    manager.stop()
+
+    assert first is second
+    assert battleye_server.commands == ["#kick 9"]
+
+
+def test_run_async_pipeline(tmp_path, battleye_server):
+    json_path = tmp_path / "whitelist.json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"players": [{"game_name": "Allowed", "identity_id": "aa", "whitelisted": 1}]}, f)
+    log_file_path = tmp_path / "console.log"
+    log_file_path.write_text("")
+
+    async def scenario():
+        task = asyncio.create_task(
+            run_async_pipeline(
+                str(log_file_path),
+                "json",
+                str(json_path),
+                "127.0.0.1",
+                battleye_server.port,
+                "password",
+            )
+        )
+        await asyncio.sleep(0.2)
+        with open(log_file_path, "a", encoding="utf-8") as f:
+            f.write("NETWORK : ### Creating player: PlayerId=1, Name=Allowed, IdentityId=aa\n")
+            f.write("NETWORK : ### Creating player: PlayerId=2, Name=Intruder, IdentityId=bb\n")
+        for _ in range(50):
+            if battleye_server.commands:
+                break
+            await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert battleye_server.commands == ["#kick 2"]
+
+
+def test_lookup_players_async_decides_joins_before_disconnects(tmp_path, mocker):
+    mock_are_players_whitelisted = mocker.patch(
+        "whitelist.are_players_whitelisted", side_effect=lambda players, *args: [False] * len(players)
+    )
+    mock_execute_kick_command = mocker.patch("whitelist.execute_kick_command", return_value=None)
+
+    async def scenario():
+        join_queue = asyncio.Queue()
+        join_queue.put_nowait((PlayerEvent("Creating", "1", "Intruder", "aa"), time.monotonic()))
+        join_queue.put_nowait((PlayerEvent("Creating", "2", "Other", "bb"), time.monotonic()))
+        join_queue.put_nowait((PlayerEvent("Disconnecting", "1", "Intruder", ""), time.monotonic()))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            task = asyncio.create_task(
+                whitelist.lookup_players_async(
+                    join_queue,
+                    executor,
+                    "json",
+                    str(tmp_path / "whitelist.json"),
+                    ("localhost", 2302, "pw"),
+                )
+            )
+            await asyncio.wait_for(join_queue.join(), 5)
+            task.cancel()
+
+    asyncio.run(scenario())
+    assert mock_are_players_whitelisted.call_count == 1
+    assert [call.args[0] for call in mock_execute_kick_command.call_args_list] == ["1", "2"]
+
+
+def test_run_async_pipeline_kicks_revoked_players_over_its_session(tmp_path, battleye_server, mocker):
+    json_path = tmp_path / "whitelist.json"
+    json_path.write_text(json.dumps({"players": [
+        {"game_name": "Allowed", "identity_id": "aa", "whitelisted": 1},
+    ]}))
+    log_file_path = tmp_path / "console.log"
+    log_file_path.write_text("")
+    mock_get_rcon_manager = mocker.spy(whitelist, "get_rcon_manager")
+
+    async def scenario():
+        task = asyncio.create_task(
+            run_async_pipeline(
+                str(log_file_path),
+                "json",
+                str(json_path),
+                "127.0.0.1",
+                battleye_server.port,
+                "password",
+            )
+        )
+        await asyncio.sleep(0.2)
+        with open(log_file_path, "a", encoding="utf-8") as f:
+            f.write("NETWORK : ### Creating player: PlayerId=1, Name=Allowed, IdentityId=aa\n")
+        roster = whitelist.get_roster_enforcer(
+            "json", str(json_path), "127.0.0.1", battleye_server.port, "password"
+        ).roster
+        for _ in range(50):
+            if roster.entries():
+                break
+            await asyncio.sleep(0.1)
+        json_path.write_text(json.dumps({"players": []}))
+        # The store's reload thread reports the change.
+        store = whitelist.get_json_whitelist(str(json_path))
+        assert await asyncio.get_running_loop().run_in_executor(None, store.refresh)
+        for _ in range(50):
+            if battleye_server.commands:
+                break
+            await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert battleye_server.commands == ["#kick 1"]
+    assert battleye_server.logins == 1
+    assert not mock_get_rcon_manager.called
 
 
 def test_tail_log_file(tmp_path, mocker):
     log_file_path = tmp_path / "console.log"
-    with open(log_file_path, "w", encoding="utf-8") as f:
-        f.write("Test log line\n")
+    log_file_path.write_text("Old log line\n")
+
+    mock_waiter = mocker.Mock()
+    mocker.patch("whitelist.create_log_waiter", return_value=mock_waiter)
+
+    def append_line(timeout):
+        if mock_waiter.wait.call_count > 1:
+            raise KeyboardInterrupt
+        with open(log_file_path, "a", encoding="utf-8") as f:
+            f.write("Test log line\n")
+        return True
 
+    mock_waiter.wait.side_effect = append_line
     mock_callback = mocker.Mock()
-    mock_sleep = mocker.patch("time.sleep", side_effect=KeyboardInterrupt)
 
     with pytest.raises(KeyboardInterrupt):
         tail_log_file(str(log_file_path), mock_callback)
 
-    mock_callback.assert_called_with("Test log line")
+    mock_callback.assert_called_once_with("Test log line")
+
+
+def test_log_tailer_carries_partial_lines(tmp_path):
+    log_file_path = tmp_path / "console.log"
+    log_file_path.write_text("")
+    lines = []
+    tailer = LogTailer(str(log_file_path), lines.append, buffer_size=8)
+    tailer.open()
+
+    with open(log_file_path, "a", encoding="utf-8") as f:
+        f.write("Creating player: PlayerId=1, Na")
+    tailer.read_available()
+    assert lines == []
+
+    with open(log_file_path, "a", encoding="utf-8") as f:
+        f.write("me=Test\r\nsecond line\n")
+    tailer.read_available()
+    assert lines == ["Creating player: PlayerId=1, Name=Test", "second line"]
+
+    log_file_path.write_text("new\n")
+    tailer.read_available()
+    assert lines[-1] == "new"
+    tailer.close()
+
+
+def test_inotify_waiter_wakes_on_write(tmp_path):
+    log_file_path = tmp_path / "console.log"
+    log_file_path.write_text("")
+    try:
+        waiter = InotifyWaiter()
+    except OSError:
+        pytest.skip("inotify is not available")
+    waiter.add_watch(str(log_file_path))
+
+    assert not waiter.wait(0)
+    with open(log_file_path, "a", encoding="utf-8") as f:
+        f.write("line\n")
+    assert waiter.wait(1)
+    waiter.close()
+
+
+def test_inotify_waiter_wakes_event_loop_on_write(tmp_path):
+    log_file_path = tmp_path / "console.log"
+    log_file_path.write_text("")
+    try:
+        waiter = InotifyWaiter()
+    except OSError:
+        pytest.skip("inotify is not available")
+    waiter.add_watch(str(log_file_path))
+
+    async def scenario():
+        assert not await waiter.wait_async(0.01)
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, log_file_path.write_text, "line\n")
+        started = time.monotonic()
+        assert await waiter.wait_async(5)
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) < 1
+    waiter.close()
+
+
+def test_parse_log_buffer():
+    text = "\n".join([
+        "07:38:18.001   SCRIPT       : Noise line",
+        "07:38:19.358   NETWORK      : ### Creating player: PlayerId=3, Name=Test Tag , IdentityId=6fa40f96-f8e9-44ac-be26-e0660c79b88a",
+        "07:38:19.400   NETWORK      : ### Updating player: PlayerId=3, Name=Test Tag, IdentityId=6fa40f96-f8e9-44ac-be26-e0660c79b88a\r",
+        "07:38:20.000   NETWORK      : player: PlayerId=4 without a name",
+    ])
+
+    events = parse_log_buffer(text)
+    assert events == [
+        PlayerEvent("Creating", "3", "Test Tag", "6fa40f96-f8e9-44ac-be26-e0660c79b88a"),
+        PlayerEvent("Updating", "3", "Test Tag", "6fa40f96-f8e9-44ac-be26-e0660c79b88a"),
+    ]
+    assert parse_log_buffer("RESOURCES : nothing to see\n") == []
+    assert parse_log_line(text.splitlines()[1]) == events[0]
+    assert parse_log_line(text.splitlines()[0]) is None
+
+
+def test_log_tailer_batch_mode(tmp_path):
+    log_file_path = tmp_path / "console.log"
+    log_file_path.write_text("")
+    blocks = []
+    tailer = LogTailer(str(log_file_path), blocks.append, batch=True)
+    tailer.open()
+
+    with open(log_file_path, "a", encoding="utf-8") as f:
+        f.write("one\ntwo\nthr")
+    tailer.read_available()
+    with open(log_file_path, "a", encoding="utf-8") as f:
+        f.write("ee\n")
+    tailer.read_available()
+    tailer.close()
+
+    assert blocks == ["one\ntwo", "three"]
+
+
+def test_metrics_render_prometheus_text():
+    registry = MetricsRegistry()
+    counter = registry.register(Counter("test_total", "A counter.", ("result",)))
+    histogram = registry.register(Histogram("test_seconds", "A histogram.", buckets=(0.1, 1.0)))
+    registry.register(Gauge("test_depth", "A gauge.", ("queue",), function=lambda: {("kick",): 3}))
+
+    counter.inc(labels=('say "hi"',))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    text = registry.render()
+    assert 'test_total{result="say \\"hi\\""} 1.0' in text
+    assert 'test_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_seconds_bucket{le="1.0"} 2' in text
+    assert 'test_seconds_bucket{le="+Inf"} 3' in text
+    assert "test_seconds_count 3" in text
+    assert 'test_depth{queue="kick"} 3' in text
+
+
+def test_metrics_endpoint_reports_tail_lag(tmp_path):
+    log_file_path = tmp_path / "console.log"
+    log_file_path.write_text("")
+    tailer = LogTailer(str(log_file_path), lambda line: None)
+    tailer.open()
+    log_file_path.write_text("0123456789\n")
+
+    server = start_metrics_server(0)
+    try:
+        url = "http://127.0.0.1:%s/metrics" % server.server_port
+        with urllib.request.urlopen(url) as response:
+            text = response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
+        tailer.close()
+
+    assert 'whitelist_tail_lag_bytes{path="%s"} 11.0' % log_file_path in text
+    assert "# TYPE whitelist_lookup_seconds histogram" in text
+
+
+def test_scan_log_backlog(tmp_path):
+    log_file_path = tmp_path / "console.log"
+    head = "NETWORK : ### Creating player: PlayerId=1, Name=Early, IdentityId=aa\n"
+    log_file_path.write_text(
+        head
+        + "SCRIPT : noise\n"
+        + "NETWORK : ### Updating player: PlayerId=2, Name=Late, IdentityId=bb\n"
+        + "NETWORK : ### Creating player: PlayerId=3, Name=Parti"
+    )
+
+    events, offset = scan_log_backlog(str(log_file_path), len(head))
+    assert events == [PlayerEvent("Updating", "2", "Late", "bb")]
+    assert offset == log_file_path.read_bytes().rindex(b"\n") + 1
+    assert scan_log_backlog(str(log_file_path), offset) == ([], offset)
+
+
+def test_resume_from_checkpoint(tmp_path):
+    log_file_path = tmp_path / "console.log"
+    log_file_path.write_text(
+        "NETWORK : ### Creating player: PlayerId=1, Name=Before, IdentityId=aa\n"
+    )
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+    handled = []
+
+    assert resume_from_checkpoint(str(log_file_path), checkpoint, handled.append) is None
+
+    tailer = LogTailer(str(log_file_path), lambda line: None, checkpoint=checkpoint)
+    tailer.open()
+    tailer.close()
+    with open(log_file_path, "a", encoding="utf-8") as f:
+        f.write("NETWORK : ### Creating player: PlayerId=2, Name=During, IdentityId=bb\n")
+
+    offset = resume_from_checkpoint(str(log_file_path), checkpoint, handled.append)
+    assert [event.player_name for event in handled] == ["During"]
+    assert offset == log_file_path.stat().st_size
+
+    checkpoint.save(str(tmp_path / "old" / "console.log"), 1, 10)
+    handled.clear()
+    resume_from_checkpoint(str(log_file_path), checkpoint, handled.append)
+    assert [event.player_name for event in handled] == ["Before", "During"]
+
+
+def test_resume_from_checkpoint_skips_players_who_left(tmp_path):
+    log_file_path = tmp_path / "console.log"
+    log_file_path.write_text(
+        "NETWORK : ### Creating player: PlayerId=1, Name=Gone, IdentityId=aa\n"
+        "NETWORK : ### Creating player: PlayerId=2, Name=Stayed, IdentityId=bb\n"
+        "NETWORK : ### Disconnecting player: PlayerId=1, Name=Gone\n"
+        "NETWORK : ### Creating player: PlayerId=1, Name=Reused, IdentityId=cc\n"
+    )
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+    checkpoint.save(str(tmp_path / "old" / "console.log"), 1, 10)
+    handled = []
+
+    resume_from_checkpoint(str(log_file_path), checkpoint, handled.append)
+    assert [(event.action, event.player_name) for event in handled] == [
+        ("Creating", "Stayed"),
+        ("Disconnecting", "Gone"),
+        ("Creating", "Reused"),
+    ]
+
+
+def test_resume_from_checkpoint_with_relative_log_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    log_file_path = tmp_path / "console.log"
+    log_file_path.write_text(
+        "NETWORK : ### Creating player: PlayerId=1, Name=Before, IdentityId=aa\n"
+    )
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+    # A followed session saves the absolute path.
+    checkpoint.save(str(log_file_path), log_file_path.stat().st_ino, log_file_path.stat().st_size)
+    handled = []
+
+    offset = resume_from_checkpoint("console.log", checkpoint, handled.append)
+    assert handled == []
+    assert offset == log_file_path.stat().st_size
+
+
+def test_join_coalescer_runs_checkpoint_saves_after_handling(tmp_path, mocker):
+    handling = threading.Event()
+    release = threading.Event()
+
+    def apply_player_events(batch, *args):
+        handling.set()
+        release.wait(5)
+
+    mocker.patch("whitelist.apply_player_events", side_effect=apply_player_events)
+    coalescer = whitelist.JoinCoalescer("json", str(tmp_path / "whitelist.json"))
+    coalescer.start()
+    idle_save = threading.Event()
+    coalescer.after_handled(idle_save.set)
+    assert idle_save.wait(5)
+
+    save = mocker.Mock()
+    coalescer.add([PlayerEvent("Creating", "1", "Player1", "id1")], "localhost", 2302, "pw")
+    coalescer.after_handled(save)
+    assert handling.wait(5)
+    time.sleep(0.05)
+    assert not save.called
+    release.set()
+    coalescer.stop()
+    save.assert_called_once_with()
+
+
+def test_log_tailer_checkpoint_skips_partial_line(tmp_path):
+    log_file_path = tmp_path / "console.log"
+    log_file_path.write_text("")
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+    tailer = LogTailer(str(log_file_path), lambda line: None, checkpoint=checkpoint)
+    tailer.open()
+
+    with open(log_file_path, "a", encoding="utf-8") as f:
+        f.write("complete\npart")
+    tailer.read_available()
+    tailer.close()
+
+    state = checkpoint.load()
+    assert state["path"] == str(log_file_path)
+    assert state["inode"] == log_file_path.stat().st_ino
+    assert state["offset"] == len("complete\n")
 
 
 def test_process_log_line(mocker):
@@ -110,6 +1351,62 @@ def test_process_log_line(mocker):
     assert mock_execute_kick_command.call_count == 2
 
 
+def test_load_servers_config(tmp_path):
+    config_path = tmp_path / "servers.json"
+    config_path.write_text(json.dumps({
+        "whitelist_type": "json",
+        "whitelist_path": "whitelist.json",
+        "servers": [
+            {"base_log_dir": "a", "rcon_host": "localhost", "rcon_port": "2302", "rcon_password": "pw"},
+            {"name": "eu-2", "base_log_dir": "b", "rcon_host": "localhost", "rcon_port": 2303, "rcon_password": "pw"},
+        ],
+    }))
+
+    config = load_servers_config(str(config_path))
+    assert [server["name"] for server in config["servers"]] == ["localhost:2302", "eu-2"]
+    assert config["servers"][0]["rcon_port"] == 2302
+
+    config_path.write_text(json.dumps({"servers": [{"base_log_dir": "a"}]}))
+    with pytest.raises(ValueError):
+        load_servers_config(str(config_path))
+
+
+def test_run_servers_shares_whitelist(tmp_path, mocker):
+    servers = []
+    for index in range(2):
+        session_dir = tmp_path / ("server%s" % index) / "logs_2024-01-01_12-00-00"
+        os.makedirs(session_dir)
+        servers.append({
+            "name": "server%s" % index,
+            "base_log_dir": str(session_dir.parent),
+            "rcon_host": "localhost",
+            "rcon_port": 2302 + index,
+            "rcon_password": "password",
+        })
+    log_line = "NETWORK : ### Creating player: PlayerId=7, Name=Intruder, IdentityId=bb"
+    tail_lock = threading.Lock()
+
+    def tail_log_file(path, callback, **kwargs):
+        with tail_lock:
+            callback(log_line)
+
+    mocker.patch("whitelist.tail_log_file", side_effect=tail_log_file)
+    mock_are_players_whitelisted = mocker.patch(
+        "whitelist.are_players_whitelisted", return_value=[False]
+    )
+    mock_execute_kick_command = mocker.patch("whitelist.execute_kick_command")
+
+    run_servers(servers, "json", "whitelist.json")
+
+    # Both servers share one decision cache, so the second join is a cache hit
+    # or is looked up in the same batch as the first.
+    mock_are_players_whitelisted.assert_called_once_with(
+        [("Intruder", "bb")], "json", "whitelist.json"
+    )
+    mock_execute_kick_command.assert_any_call("7", "localhost", 2302, "password")
+    mock_execute_kick_command.assert_any_call("7", "localhost", 2303, "password")
+
+
 def test_main(mocker):
     mock_setup_logging = mocker.patch("whitelist.setup_logging")
     mock_find_latest_log_dir = mocker.patch(
@@ -141,9 +1438,146 @@ def test_main(mocker):
 
     mock_setup_logging.assert_called_once()
     mock_find_latest_log_dir.assert_called_once_with("base_log_dir")
-    mock_tail_log_file.assert_called_once_with("latest_log_path", mocker.ANY)
+    mock_tail_log_file.assert_called_once_with(
+        "latest_log_path",
+        mocker.ANY,
+        batch=True,
+        offset=None,
+        checkpoint=mocker.ANY,
+        after_handled=mocker.ANY,
+    )
     mock_thread.assert_called()
 
 
+def test_main_daemon_from_environment(mocker, monkeypatch):
+    mocker.patch("whitelist.setup_logging")
+    mocker.patch("whitelist.find_latest_log_dir", return_value="latest_log_path")
+    mock_tail_log_file = mocker.patch("whitelist.tail_log_file")
+    mock_start_watchdog = mocker.patch("whitelist.start_watchdog")
+    mock_thread = mocker.patch("threading.Thread")
+    mocker.patch("builtins.input", side_effect=AssertionError("prompted in daemon mode"))
+    for name, value in {
+        "WHITELIST_TYPE": "json",
+        "WHITELIST_PATH": "whitelist.json",
+        "WHITELIST_BASE_LOG_DIR": "base_log_dir",
+        "WHITELIST_RCON_HOST": "localhost",
+        "WHITELIST_RCON_PORT": "2302",
+        "WHITELIST_RCON_PASSWORD": "password",
+        "WHITELIST_HEARTBEAT": "30",
+        "WHITELIST_DAEMON": "1",
+    }.items():
+        monkeypatch.setenv(name, value)
+
+    whitelist.main([])
+
+    mock_tail_log_file.assert_called_once()
+    mock_start_watchdog.assert_called_once_with(60.0)
+    mock_thread.assert_any_call(target=heartbeat, args=(30,), name="HeartbeatThread")
+
+
+def test_option_defaults_precedence():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wt", choices=["database", "json"], dest="whitelist_type")
+    parser.add_argument("--rp", type=int, dest="rcon_port")
+    parser.add_argument("--daemon", action="store_true", dest="daemon")
+
+    config = {"whitelist_type": "database", "rcon_port": 2302, "daemon": True}
+    environ = {"WHITELIST_TYPE": "json"}
+    parser.set_defaults(**option_defaults(parser, config, environ))
+    args = parser.parse_args([])
+    assert (args.whitelist_type, args.rcon_port, args.daemon) == ("json", 2302, True)
+    assert parser.parse_args(["--rp", "2303"]).rcon_port == 2303
+
+    with pytest.raises(ValueError):
+        option_defaults(parser, environ={"WHITELIST_TYPE": "csv"})
+
+
+def test_watchdog_flags_and_restarts_stalled_stage(tmp_path, mocker):
+    progress = {"done": 0, "waiting": 3}
+    restart = mocker.Mock()
+    mocker.patch.dict(
+        whitelist._active_stages,
+        {"kick:test": (lambda: progress["done"], lambda: progress["waiting"], restart)},
+    )
+    log_path = tmp_path / "console.log"
+    log_path.write_text("")
+    tailer = LogTailer(str(log_path), lambda line: None, follow_sessions=False)
+    tailer.open()
+    watchdog = Watchdog(stall_seconds=0, interval=1)
+    try:
+        watchdog.check()
+        report = watchdog.check()
+        assert report["kick:test"] == {"pending": 3, "stalled": True}
+        assert restart.call_count == 1
+        assert not watchdog.ready()
+
+        progress["done"] += 1
+        report = watchdog.check()
+        assert report["kick:test"]["stalled"] is False
+        assert "tail:%s" % log_path in report
+        assert watchdog.ready()
+        assert watchdog.alive()
+
+        # Nothing waiting is idle, not stalled.
+        progress["waiting"] = 0
+        watchdog.check()
+        assert not watchdog.check()["kick:test"]["stalled"]
+    finally:
+        tailer.close()
+
+
+def test_health_endpoints(tmp_path, mocker):
+    watchdog = Watchdog(stall_seconds=60, interval=1)
+    mocker.patch("whitelist._watchdog", watchdog)
+    server = start_metrics_server(0)
+    url = "http://127.0.0.1:%s" % server.server_port
+    try:
+        with pytest.raises(urllib.error.HTTPError) as not_alive:
+            urllib.request.urlopen(url + "/healthz")
+        assert not_alive.value.code == 503
+
+        log_path = tmp_path / "console.log"
+        log_path.write_text("")
+        tailer = LogTailer(str(log_path), lambda line: None, follow_sessions=False)
+        tailer.open()
+        try:
+            watchdog.check()
+            with urllib.request.urlopen(url + "/readyz") as response:
+                report = json.loads(response.read())
+            assert report["ready"] is True
+            assert report["stages"]["tail:%s" % log_path]["stalled"] is False
+            assert health_status() == (200, mocker.ANY)
+        finally:
+            tailer.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_sd_notify(tmp_path, monkeypatch):
+    monkeypatch.delenv("NOTIFY_SOCKET", raising=False)
+    assert sd_notify("READY=1") is False
+    socket_path = str(tmp_path / "notify")
+    receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    receiver.bind(socket_path)
+    try:
+        monkeypatch.setenv("NOTIFY_SOCKET", socket_path)
+        assert sd_notify("READY=1") is True
+        assert receiver.recv(64) == b"READY=1"
+    finally:
+        receiver.close()
+
+
 if __name__ == "__main__":
     pytest.main()
+
+
+def test_whitelist_store_requires_lookup_and_refresh():
+    class PartialWhitelist(whitelist.WhitelistStore):
+        def is_whitelisted(self, player_name, identity_id):
+            return True
+
+    with pytest.raises(TypeError):
+        PartialWhitelist()
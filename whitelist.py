@@ -2,262 +2,5143 @@
 
 """
 
+abc => Used for the whitelist backend and kick queue base classes.
 argparse => Used for parsing command line arguments.
+asyncio => Used for the --async pipeline runtime.
+atexit => Used to flush the log and audit queues on exit.
+bisect => Used to place samples in histogram buckets.
+collections => Used for the LRU decision cache.
 subprocess => Used for executing RCON application.
 re => Used to check player identifiers using regex.
 sqlite3 => Used for interacting with the database.
 json => Used for interacting with a JSON.
-time => Used for heartbeat function.
+time => Used for heartbeat function and log polling.
 os => Used for paths and directories.
 sys => Used for stopping the application. 
-datetime => Used to generate date and time for logging.
-threading => Used to create threads per player checks.
+threading => Used to run the RCON worker and whitelist reload threads.
 logging / logging.handlers => Used for handling the logging functionality.
-rcon.battleye => Used for executing kick commands on the server.
+ctypes / select => Used to wait on inotify events when tailing the log.
+mmap => Used to scan the log backlog after a restart and to map whitelist snapshots.
+struct / hashlib / uuid => Used to pack and hash the binary whitelist snapshot.
+urllib.request => Used to build read-only SQLite URIs.
+http.server => Used for the optional Prometheus metrics endpoint.
+weakref => Used to track live tailers for the lag metric.
+socket => Used for the BattlEye RCON UDP session and systemd notifications.
+queue => Used to queue kick commands, log records and audit records for their worker threads.
+heapq / itertools / random => Used to order, delay and jitter kick retries.
+signal / tracemalloc => Used for on-demand profiling and memory growth reports.
+concurrent.futures => Used to report the result of each kick.
+rcon.battleye.proto => Used for building and parsing BattlEye RCON packets.
 
 """
 
+import abc
 import argparse
+import asyncio
+import atexit
+import bisect
+import collections
 import re
 import sqlite3
 import json
+import hashlib
+import struct
+import uuid
 import time
 import os
-import datetime
+import sys
 import threading
 import logging
 import logging.handlers
+import ctypes
+import ctypes.util
+import select
+import mmap
+import urllib.request
+import http.server
+import weakref
+import socket
+import queue
+import signal
+import tracemalloc
+import heapq
+import itertools
+import random
+import concurrent.futures
+from typing import NamedTuple
 
-from rcon.battleye import Client
+from rcon.battleye.proto import (
+    HEADER_SIZE,
+    RESPONSE_TYPES,
+    CommandRequest,
+    CommandResponse,
+    Header,
+    LoginRequest,
+    LoginResponse,
+    ServerMessage,
+    ServerMessageAck,
+)
+from rcon.exceptions import WrongPassword
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records without formatting them, leaving that to the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_log_listener = None
 
 
 def setup_logging(log_directory: str) -> None:
     """
-    Initiates the log for the whitelist.
+    Initiates the log for the whitelist.
+    The file and console handlers run on a listener thread so a slow disk or
+    console never blocks the tail loop.
+    """
+    global _log_listener
+
+    log_file = os.path.join(log_directory, "whitelist.log")
+
+    if not os.path.exists(log_directory):
+        os.makedirs(log_directory)
+
+    file_handler = logging.FileHandler(log_file, mode="a")
+    file_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    file_handler.setFormatter(file_formatter)
+
+    console_handler = logging.StreamHandler()
+    console_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    console_handler.setFormatter(console_formatter)
+
+    if _log_listener is not None:
+        _log_listener.stop()
+        atexit.unregister(_log_listener.stop)
+        for handler in _log_listener.handlers:
+            handler.close()
+    log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(
+        log_queue, file_handler, console_handler, respect_handler_level=True
+    )
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
+    # force replaces the handler of an earlier call, or the default handler
+    # installed by logging before setup, which would keep records away from
+    # the new queue.
+    logging.basicConfig(
+        level=logging.INFO, handlers=[DeferredQueueHandler(log_queue)], force=True
+    )
+
+
+class AuditLog:
+    """
+    Appends one compact JSON record per whitelist decision from a writer thread.
+    """
+
+    def __init__(self, audit_path: str) -> None:
+        self.audit_path = audit_path
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._write, name="AuditThread", daemon=True
+        )
+        self._thread.start()
+
+    def record(self, **fields) -> None:
+        fields["ts"] = round(time.time(), 3)
+        self._queue.put(fields)
+
+    def _write(self) -> None:
+        with open(self.audit_path, "a", encoding="utf-8") as audit_file:
+            while True:
+                fields = self._queue.get()
+                if fields is None:
+                    break
+                audit_file.write(json.dumps(fields, separators=(",", ":")) + "\n")
+                # Flush once the queue is drained rather than after every record.
+                if self._queue.empty():
+                    audit_file.flush()
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+
+_audit_log = None
+
+
+def set_audit_log(audit_path: str) -> AuditLog:
+    """
+    Starts writing decision records to audit_path, or stops if it is None.
+    """
+    global _audit_log
+    if _audit_log is not None:
+        _audit_log.close()
+        atexit.unregister(_audit_log.close)
+    _audit_log = AuditLog(audit_path) if audit_path else None
+    if _audit_log is not None:
+        atexit.register(_audit_log.close)
+    return _audit_log
+
+
+def audit(**fields) -> None:
+    """
+    Records a decision if the audit log is enabled.
+    """
+    if _audit_log is not None:
+        _audit_log.record(**fields)
+
+
+def heartbeat(count: int) -> None:
+    """
+    Logs a health summary every count seconds whilst the application is running.
+    """
+    lines = LOG_LINES.value()
+    since = time.monotonic()
+    while True:
+        time.sleep(count)
+        now = time.monotonic()
+        total = LOG_LINES.value()
+        summary = health_summary((total - lines) / max(now - since, 1e-9))
+        lines, since = total, now
+        logging.info("Whitelist is running... %s", summary)
+        sd_notify("STATUS=%s" % summary)
+
+
+class Metric:
+    """
+    A metric with optional labels, rendered in the Prometheus text format.
+    """
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _format_labels(self, labelvalues: tuple, extra: tuple = ()) -> str:
+        pairs = list(zip(self.labelnames, labelvalues)) + list(extra)
+        if not pairs:
+            return ""
+        return "{%s}" % ",".join(
+            '%s="%s"' % (
+                name,
+                str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+            )
+            for name, value in pairs
+        )
+
+    def samples(self) -> list:
+        """
+        Returns (suffix, labels, value) tuples for rendering.
+        """
+        with self._lock:
+            return [
+                ("", self._format_labels(labelvalues), value)
+                for labelvalues, value in self._values.items()
+            ]
+
+    def render(self) -> str:
+        lines = [
+            "# HELP %s %s" % (self.name, self.documentation),
+            "# TYPE %s %s" % (self.name, self.metric_type),
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append("%s%s%s %s" % (self.name, suffix, labels, repr(float(value))))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1.0, labels: tuple = ()) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, labels: tuple = ()) -> float:
+        return self._values.get(labels, 0.0)
+
+
+class Gauge(Metric):
+    """
+    A gauge set directly, or read from a function returning {labels: value}
+    each time the metrics are rendered.
+    """
+
+    metric_type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        function: callable = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value: float, labels: tuple = ()) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def samples(self) -> list:
+        if self.function is None:
+            return super().samples()
+        return [
+            ("", self._format_labels(labelvalues), value)
+            for labelvalues, value in self.function().items()
+        ]
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    DEFAULT_BUCKETS = (
+        0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+    )
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, labels: tuple = ()) -> None:
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # One count per bucket, then the sum and the total count.
+                counts = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self) -> list:
+        samples = []
+        with self._lock:
+            for labelvalues, counts in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(
+                        ("_bucket", self._format_labels(labelvalues, (("le", repr(bound)),)), cumulative)
+                    )
+                samples.append(
+                    ("_bucket", self._format_labels(labelvalues, (("le", "+Inf"),)), counts[-1])
+                )
+                samples.append(("_sum", self._format_labels(labelvalues), counts[-2]))
+                samples.append(("_count", self._format_labels(labelvalues), counts[-1]))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Holds every metric exposed on the metrics endpoint.
+    """
+
+    def __init__(self) -> None:
+        self._metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+LOG_LINES = METRICS.register(
+    Counter("whitelist_log_lines_total", "Console log lines read by the tailer.")
+)
+LOG_BYTES = METRICS.register(
+    Counter("whitelist_log_bytes_total", "Console log bytes read by the tailer.")
+)
+PARSE_SECONDS = METRICS.register(
+    Histogram("whitelist_parse_seconds", "Time spent parsing a block of log lines.")
+)
+LOOKUP_SECONDS = METRICS.register(
+    Histogram("whitelist_lookup_seconds", "Whitelist lookup latency.", ("backend",))
+)
+LOOKUP_ERRORS = METRICS.register(
+    Counter(
+        "whitelist_lookup_errors_total",
+        "Whitelist lookups that failed and were treated as not whitelisted.",
+    )
+)
+DECISION_CACHE_REQUESTS = METRICS.register(
+    Counter("whitelist_decision_cache_requests_total", "Decision cache lookups.", ("result",))
+)
+KICKS = METRICS.register(
+    Counter("whitelist_kicks_total", "Kick commands by outcome.", ("result",))
+)
+KICK_RETRIES = METRICS.register(
+    Counter("whitelist_kick_retries_total", "Failed kicks scheduled for another attempt.")
+)
+RCON_THROTTLE_SECONDS = METRICS.register(
+    Counter(
+        "whitelist_rcon_throttle_seconds_total",
+        "Time RCON commands spent waiting on the rate limit.",
+    )
+)
+KICK_SECONDS = METRICS.register(
+    Histogram("whitelist_kick_seconds", "Time from queueing a kick to its RCON acknowledgement.")
+)
+JOIN_TO_KICK_SECONDS = METRICS.register(
+    Histogram(
+        "whitelist_join_to_kick_seconds",
+        "Time from reading a join line to the kick being acknowledged.",
+    )
+)
+
+_active_tailers = weakref.WeakSet()
+_active_queues = {}
+# Stages the watchdog checks besides the tailers, as name -> (progress,
+# pending, restart). progress returns a value that changes whenever the stage
+# gets work done, pending how much work is waiting for it.
+_active_stages = {}
+# Functions describing the RCON session of each server, by "host:port".
+_rcon_states = {}
+# When the last join was read, and the player's name.
+_last_join = None
+
+
+def _tail_lag_bytes() -> dict:
+    lag = {}
+    for tailer in list(_active_tailers):
+        try:
+            lag[(tailer.file_path,)] = tailer.lag_bytes()
+        except (OSError, ValueError):
+            continue
+    return lag
+
+
+def _queue_depths() -> dict:
+    return {(name,): depth() for name, depth in list(_active_queues.items())}
+
+
+METRICS.register(
+    Gauge(
+        "whitelist_tail_lag_bytes",
+        "Bytes between the tailer's position and the end of the log file.",
+        ("path",),
+        function=_tail_lag_bytes,
+    )
+)
+METRICS.register(
+    Gauge(
+        "whitelist_queue_depth",
+        "Items waiting in each pipeline queue.",
+        ("queue",),
+        function=_queue_depths,
+    )
+)
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the registry in the Prometheus text format on /metrics, and
+    liveness and readiness for supervisors on /healthz and /readyz.
+    """
+
+    def do_GET(self) -> None:
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            status = 200
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+            body = METRICS.render().encode("utf-8")
+        elif path in ("/healthz", "/readyz"):
+            status, report = health_status(readiness=path == "/readyz")
+            content_type = "application/json"
+            body = json.dumps(report).encode("utf-8")
+        else:
+            self.send_error(404)
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug("Metrics request: " + format, *args)
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> http.server.HTTPServer:
+    """
+    Starts the metrics endpoint on a daemon thread.
+    """
+    server = http.server.ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="MetricsThread", daemon=True
+    )
+    thread.start()
+    logging.info("Serving metrics on http://%s:%s/metrics", host, server.server_port)
+    return server
+
+
+class Diagnostics:
+    """
+    Writes sampling profiles of every thread and memory reports to the log
+    directory, on demand or on an interval. Allocation tracing slows every
+    allocation, so tracemalloc growth is only reported with trace_memory.
+    """
+
+    def __init__(
+        self,
+        report_directory: str,
+        profile_seconds: float = 30.0,
+        sample_interval: float = 0.01,
+        top: int = 25,
+        trace_memory: bool = False,
+    ) -> None:
+        self.report_directory = report_directory
+        self.profile_seconds = profile_seconds
+        self.sample_interval = sample_interval
+        self.top = top
+        self.trace_memory = trace_memory
+        self._baseline = None
+        self._previous = None
+        self._capture_thread = None
+        self._captures = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def trigger(self) -> bool:
+        """
+        Starts a capture in the background unless one is already running.
+        """
+        with self._lock:
+            if self._capture_thread is not None and self._capture_thread.is_alive():
+                logging.info("Diagnostics capture already running.")
+                return False
+            self._capture_thread = threading.Thread(
+                target=self.capture, name="DiagnosticsThread", daemon=True
+            )
+            self._capture_thread.start()
+            return True
+
+    def capture(self) -> tuple:
+        """
+        Profiles the process for profile_seconds, then writes the profile and
+        memory reports. Returns their paths.
+        """
+        stamp = "%s-%s" % (time.strftime("%Y%m%d-%H%M%S"), next(self._captures))
+        logging.info("Capturing a %ss profile.", self.profile_seconds)
+        stacks, samples = self.sample(self.profile_seconds)
+        profile_path = os.path.join(self.report_directory, "profile-%s.txt" % stamp)
+        self.write_profile(stacks, samples, profile_path)
+        memory_path = os.path.join(self.report_directory, "memory-%s.txt" % stamp)
+        self.write_memory_report(memory_path)
+        logging.info("Wrote diagnostics to %s and %s", profile_path, memory_path)
+        return profile_path, memory_path
+
+    def sample(self, seconds: float) -> tuple:
+        """
+        Samples the stack of every other thread, returning stack counts and the number of samples.
+        """
+        # Sampling works across all threads without tracing every call, so
+        # the tail, lookup and RCON threads run at close to full speed.
+        stacks = collections.Counter()
+        own_ident = threading.get_ident()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        "%s:%s:%s"
+                        % (os.path.basename(code.co_filename), code.co_name, frame.f_lineno)
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread-%s" % ident))
+                stacks[tuple(reversed(stack))] += 1
+            samples += 1
+            time.sleep(self.sample_interval)
+        return stacks, samples
+
+    def write_profile(self, stacks: collections.Counter, samples: int, path: str) -> None:
+        """
+        Writes the busiest functions per thread, plus collapsed stacks for flame graph tools.
+        """
+        own = collections.Counter()
+        total = collections.Counter()
+        threads = collections.Counter()
+        for stack, count in stacks.items():
+            threads[stack[0]] += count
+            own[(stack[0], stack[-1])] += count
+            for frame in set(stack[1:]):
+                total[(stack[0], frame)] += count
+
+        with open(path, "w", encoding="utf-8") as report:
+            report.write(
+                "Sampling profile: %s samples every %ss over %ss\n\n"
+                % (samples, self.sample_interval, self.profile_seconds)
+            )
+            for title, counter in (("Top frames by own samples", own), ("Top frames by total samples", total)):
+                report.write("%s:\n" % title)
+                for (thread, frame), count in counter.most_common(self.top):
+                    report.write(
+                        "%7.1f%%  %-28s %s\n"
+                        % (100.0 * count / max(1, samples), thread, frame)
+                    )
+                report.write("\n")
+            report.write("Samples per thread:\n")
+            for thread, count in threads.most_common():
+                report.write("%7s  %s\n" % (count, thread))
+        with open(path[:-len(".txt")] + ".collapsed", "w", encoding="utf-8") as collapsed:
+            for stack, count in stacks.items():
+                collapsed.write("%s %s\n" % (";".join(stack), count))
+
+    def write_memory_report(self, path: str) -> None:
+        """
+        Writes RSS, thread and buffer counts, plus allocation growth since the
+        previous and first snapshots when trace_memory is set.
+        """
+        snapshot = None
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                )
+            )
+        threads = threading.enumerate()
+        with open(path, "w", encoding="utf-8") as report:
+            if snapshot is not None:
+                current, peak = tracemalloc.get_traced_memory()
+                report.write("Traced memory: %.1f MiB (peak %.1f MiB)\n" % (current / 1048576, peak / 1048576))
+            try:
+                with open("/proc/self/statm", "r") as statm:
+                    rss_pages = int(statm.read().split()[1])
+                report.write("RSS: %.1f MiB\n" % (rss_pages * os.sysconf("SC_PAGE_SIZE") / 1048576))
+            except (OSError, ValueError, AttributeError):
+                pass
+            report.write("Threads (%s): %s\n" % (len(threads), ", ".join(sorted(thread.name for thread in threads))))
+            report.write(
+                "Tailer pending bytes: %s\n"
+                % sum(len(tailer._pending) for tailer in list(_active_tailers))
+            )
+            report.write(
+                "Queue depths: %s\n\n"
+                % ", ".join("%s=%s" % (name, qsize()) for name, qsize in list(_active_queues.items()))
+            )
+            if snapshot is None:
+                report.write("Allocation tracing is off, start with --trace-memory to report growth.\n")
+                return
+            if self._baseline is None:
+                report.write("Started tracing allocations, later reports show growth from here.\n")
+            for title, previous in (
+                ("Growth since previous report", self._previous),
+                ("Growth since first report", self._baseline),
+            ):
+                if previous is None:
+                    continue
+                report.write("%s:\n" % title)
+                for stat in snapshot.compare_to(previous, "lineno")[:self.top]:
+                    report.write("%s\n" % stat)
+                report.write("\n")
+            report.write("Largest allocations:\n")
+            for stat in snapshot.statistics("lineno")[:self.top]:
+                report.write("%s\n" % stat)
+        if self._baseline is None:
+            self._baseline = snapshot
+        self._previous = snapshot
+
+    def run_periodically(self, interval: float) -> threading.Thread:
+        """
+        Starts a thread that captures diagnostics every interval seconds.
+        """
+        def run() -> None:
+            while True:
+                time.sleep(interval)
+                try:
+                    self.capture()
+                except Exception:
+                    logging.exception("Diagnostics capture failed")
+
+        thread = threading.Thread(target=run, name="DiagnosticsIntervalThread", daemon=True)
+        thread.start()
+        return thread
+
+
+def install_diagnostics(
+    report_directory: str,
+    profile_seconds: float = 30.0,
+    interval: float = 0,
+    trace_memory: bool = False,
+) -> Diagnostics:
+    """
+    Captures diagnostics on SIGUSR1, where available, and every interval seconds if set.
+    """
+    diagnostics = Diagnostics(report_directory, profile_seconds, trace_memory=trace_memory)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: diagnostics.trigger())
+        logging.info("Send SIGUSR1 to process %s to capture diagnostics.", os.getpid())
+    if interval:
+        diagnostics.run_periodically(interval)
+    return diagnostics
+
+
+STAGE_STALLS = METRICS.register(
+    Counter(
+        "whitelist_stage_stalls_total",
+        "Times the watchdog found a pipeline stage making no progress.",
+        ("stage",),
+    )
+)
+
+
+class Watchdog:
+    """
+    Flags pipeline stages that make no progress while work is waiting for them,
+    restarts the ones that can be restarted and decides readiness.
+    """
+
+    def __init__(self, stall_seconds: float = 60.0, interval: float = 5.0) -> None:
+        self.stall_seconds = stall_seconds
+        self.interval = interval
+        self.last_check = None
+        self.report = {}
+        # The last progress value of each stage and when it last changed.
+        self._progress = {}
+        self._stalled = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def stages(self) -> dict:
+        """
+        Returns every watched stage as name -> (progress, pending, restart).
+        """
+        stages = dict(_active_stages)
+        for tailer in list(_active_tailers):
+            stages["tail:%s" % tailer.file_path] = (
+                lambda tailer=tailer: tailer.bytes_read,
+                tailer.lag_bytes,
+                None,
+            )
+        return stages
+
+    def check(self) -> dict:
+        """
+        Checks every stage once and returns name -> {"pending": ..., "stalled": ...}.
+        """
+        now = time.monotonic()
+        report = {}
+        with self._lock:
+            stages = self.stages()
+            for name in set(self._progress) - set(stages):
+                del self._progress[name]
+                self._stalled.discard(name)
+            for name, (progress, pending, restart) in stages.items():
+                try:
+                    current = progress()
+                    waiting = pending()
+                except (OSError, ValueError, AttributeError):
+                    # The stage is shutting down between the two reads.
+                    continue
+                previous, changed = self._progress.get(name, (None, now))
+                if current != previous or not waiting:
+                    self._progress[name] = (current, now)
+                    if name in self._stalled:
+                        self._stalled.discard(name)
+                        logging.info("Watchdog: %s is making progress again.", name)
+                elif now - changed >= self.stall_seconds:
+                    if name not in self._stalled:
+                        self._stalled.add(name)
+                        STAGE_STALLS.inc(labels=(name,))
+                    logging.warning(
+                        "Watchdog: %s has made no progress for %.0fs with %s waiting%s.",
+                        name,
+                        now - changed,
+                        waiting,
+                        ", restarting it" if restart is not None else "",
+                    )
+                    if restart is not None:
+                        try:
+                            restart()
+                        except Exception:
+                            logging.exception("Watchdog: unable to restart %s", name)
+                    # Give the stage another full period before warning again.
+                    self._progress[name] = (current, now)
+                report[name] = {"pending": waiting, "stalled": name in self._stalled}
+            self.report = report
+            self.last_check = now
+        return report
+
+    def stalled(self) -> set:
+        with self._lock:
+            return set(self._stalled)
+
+    def alive(self) -> bool:
+        """
+        Returns whether the watchdog has checked the stages recently.
+        """
+        return self.last_check is not None and (
+            time.monotonic() - self.last_check < 3 * self.interval
+        )
+
+    def ready(self) -> bool:
+        """
+        Returns whether a log is being tailed and no stage is stalled.
+        """
+        with self._lock:
+            return (
+                self.last_check is not None
+                and not self._stalled
+                and any(name.startswith("tail:") for name in self.report)
+            )
+
+    def run(self) -> None:
+        """
+        Checks the stages every interval, telling systemd once the whitelist
+        is ready and for as long as nothing is stalled.
+        """
+        notified_ready = False
+        while True:
+            self.check()
+            if not notified_ready and self.ready():
+                sd_notify("READY=1")
+                notified_ready = True
+                logging.info("Whitelist is ready.")
+            if not self.stalled():
+                sd_notify("WATCHDOG=1")
+            time.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run, name="WatchdogThread", daemon=True)
+        self._thread.start()
+
+
+_watchdog = None
+
+
+def start_watchdog(stall_seconds: float, interval: float = 5.0) -> Watchdog:
+    """
+    Starts the watchdog used for the heartbeat, health endpoints and systemd.
+    """
+    global _watchdog
+
+    _watchdog = Watchdog(stall_seconds, min(interval, stall_seconds))
+    _watchdog.start()
+    return _watchdog
+
+
+def _stalled_stages() -> dict:
+    if _watchdog is None:
+        return {}
+    return {
+        (name,): float(state["stalled"]) for name, state in _watchdog.report.items()
+    }
+
+
+METRICS.register(
+    Gauge(
+        "whitelist_stage_stalled",
+        "Whether the watchdog currently considers each pipeline stage stalled.",
+        ("stage",),
+        function=_stalled_stages,
+    )
+)
+METRICS.register(
+    Gauge(
+        "whitelist_ready",
+        "Whether a log is being tailed and no pipeline stage is stalled.",
+        function=lambda: {(): float(_watchdog is not None and _watchdog.ready())},
+    )
+)
+
+
+def health_summary(lines_per_second: float) -> str:
+    """
+    Describes throughput, tail lag, the last join and the RCON sessions in one line.
+    """
+    parts = [
+        "%.0f lines/s" % lines_per_second,
+        "%s bytes behind" % sum(_tail_lag_bytes().values()),
+    ]
+    if _last_join is None:
+        parts.append("no joins seen")
+    else:
+        seen, player_name = _last_join
+        parts.append("last join %s %.0fs ago" % (player_name, time.monotonic() - seen))
+    sessions = ", ".join(
+        "%s %s" % (server, state()) for server, state in sorted(_rcon_states.items())
+    )
+    parts.append("RCON %s" % (sessions or "not started"))
+    if _watchdog is not None:
+        stalled = _watchdog.stalled()
+        if stalled:
+            parts.append("stalled: %s" % ", ".join(sorted(stalled)))
+    return ", ".join(parts)
+
+
+def health_status(readiness: bool = False) -> tuple:
+    """
+    Returns the HTTP status and report for the liveness or readiness endpoint.
+    """
+    report = {
+        "lag_bytes": sum(_tail_lag_bytes().values()),
+        "last_join_seconds_ago": None
+        if _last_join is None
+        else round(time.monotonic() - _last_join[0], 3),
+        "rcon": {server: state() for server, state in _rcon_states.items()},
+    }
+    if _watchdog is None:
+        # Without the watchdog, tailing a log is the best sign of life there is.
+        healthy = ready = bool(_active_tailers)
+    else:
+        healthy = _watchdog.alive()
+        ready = _watchdog.ready()
+        report["stages"] = _watchdog.report
+    report["alive"] = healthy
+    report["ready"] = ready
+    return (200 if (ready if readiness else healthy) else 503), report
+
+
+def sd_notify(message: str) -> bool:
+    """
+    Sends a state change to systemd when running as a Type=notify service.
+    """
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address or not hasattr(socket, "AF_UNIX"):
+        return False
+    if address.startswith("@"):
+        address = "\0" + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(message.encode("utf-8"))
+    except OSError as e:
+        logging.debug("Unable to notify systemd: %s", e)
+        return False
+    return True
+
+
+LOG_DIR_PATTERN = re.compile(r"logs_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}")
+
+
+def find_latest_log_dir(base_log_dir: str) -> str:
+    """
+    Used to find the latest game server log directory.
+    """
+    # The timestamp in the directory name is zero padded, so the newest
+    # session is also the greatest name.
+    log_dirs = [
+        entry.name
+        for entry in os.scandir(base_log_dir)
+        if LOG_DIR_PATTERN.fullmatch(entry.name) and entry.is_dir()
+    ]
+
+    if not log_dirs:
+        return None
+
+    return os.path.join(base_log_dir, max(log_dirs), "console.log")
+
+
+class LogDirectoryWatcher:
+    """
+    Detects new server session directories under the base log directory.
+    """
+
+    def __init__(self, base_log_dir: str, current_log_path: str) -> None:
+        self.base_log_dir = base_log_dir
+        self.current_log_path = current_log_path
+        self._candidate = None
+        self._mtime = None
+
+    def _base_mtime(self) -> int:
+        try:
+            return os.stat(self.base_log_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    def check(self) -> str:
+        """
+        Returns the console.log of a newer session once it exists, otherwise None.
+        """
+        # Creating a directory updates the parent's mtime, so the directory
+        # is only listed when something was added or removed.
+        mtime = self._base_mtime()
+        if mtime != self._mtime:
+            self._mtime = mtime
+            latest_log_path = find_latest_log_dir(self.base_log_dir)
+            if latest_log_path and latest_log_path > self.current_log_path:
+                self._candidate = latest_log_path
+
+        if self._candidate and os.path.exists(self._candidate):
+            self.current_log_path, self._candidate = self._candidate, None
+            return self.current_log_path
+        return None
+
+    @property
+    def watch_paths(self) -> list:
+        """
+        Directories whose changes should wake the tailer.
+        """
+        paths = [self.base_log_dir]
+        if self._candidate:
+            paths.append(os.path.dirname(self._candidate))
+        return paths
+
+    @classmethod
+    def for_log_file(cls, file_path: str):
+        """
+        Returns a watcher if the file lives in a session directory, otherwise None.
+        """
+        session_dir = os.path.dirname(os.path.abspath(file_path))
+        if not LOG_DIR_PATTERN.fullmatch(os.path.basename(session_dir)):
+            return None
+        base_log_dir = os.path.dirname(session_dir)
+        return cls(base_log_dir, os.path.join(base_log_dir, os.path.basename(session_dir), "console.log"))
+
+
+class WhitelistChange(NamedTuple):
+    """
+    Lowercased names and identities added to or removed from a whitelist.
+    """
+
+    added_names: frozenset
+    removed_names: frozenset
+    added_identities: frozenset
+    removed_identities: frozenset
+
+
+class WhitelistStore(abc.ABC):
+    """
+    Base for whitelist backends that watch their source for changes.
+    """
+
+    def __init__(self, reload_interval: float = 2.0) -> None:
+        self.reload_interval = reload_interval
+        self._listeners = []
+        self._stop_event = threading.Event()
+        self._reload_thread = None
+
+    @abc.abstractmethod
+    def is_whitelisted(self, player_name: str, identity_id: str) -> bool:
+        pass
+
+    def is_whitelisted_many(self, players: list) -> list:
+        """
+        Checks a list of (player_name, identity_id) pairs, returning one bool per pair.
+        """
+        return [
+            self.is_whitelisted(player_name, identity_id)
+            for player_name, identity_id in players
+        ]
+
+    @abc.abstractmethod
+    def refresh(self) -> bool:
+        """
+        Picks up changes to the source, returns True if the whitelist changed.
+        """
+
+    def version(self) -> str:
+        """
+        Returns a tag for the state of the whitelist lookups are answered
+        from, stable across restarts, or None if it is not known.
+        """
+        return None
+
+    def add_listener(self, callback: callable) -> None:
+        """
+        Registers a callback to run with the WhitelistChange, or None when the
+        exact change is unknown, after the whitelist changes.
+        """
+        self._listeners.append(callback)
+
+    def notify_listeners(self, change: "WhitelistChange" = None) -> None:
+        for callback in self._listeners:
+            try:
+                callback(change)
+            except Exception:
+                logging.exception("Error in whitelist change listener")
+
+    def _watch(self) -> None:
+        """
+        Checks the source for changes until stopped.
+        """
+        while not self._stop_event.wait(self.reload_interval):
+            try:
+                self.refresh()
+            except Exception:
+                logging.exception("Error reloading %s", type(self).__name__)
+
+    def start(self) -> None:
+        """
+        Starts the background reload thread.
+        """
+        if self._reload_thread is not None:
+            return
+        self._reload_thread = threading.Thread(
+            target=self._watch,
+            name="%sReloadThread" % type(self).__name__,
+            daemon=True,
+        )
+        self._reload_thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the background reload thread.
+        """
+        self._stop_event.set()
+        if self._reload_thread is not None:
+            self._reload_thread.join()
+            self._reload_thread = None
+
+
+class DatabaseWhitelist(WhitelistStore):
+    """
+    Long-lived read-only connection to a SQLite whitelist.
+    """
+
+    # sqlite3 keeps a per-connection cache of prepared statements keyed by
+    # the SQL text, so reusing these constants on one connection skips
+    # re-preparing the query on every join.
+    # Identities are also matched against game_name, where the legacy schema
+    # kept them and where migrate-db leaves them.
+    IDENTITY_QUERY = """
+        SELECT 1
+        FROM user_data
+        WHERE (
+            game_name = ?1 COLLATE NOCASE
+            OR identity_id = ?2 COLLATE NOCASE
+            OR game_name = ?2 COLLATE NOCASE
+        )
+        AND whitelisted = 1
+        LIMIT 1
+        """
+    LEGACY_QUERY = """
+        SELECT 1
+        FROM user_data
+        WHERE (game_name = ? COLLATE NOCASE OR game_name = ? COLLATE NOCASE)
+        AND whitelisted = 1
+        LIMIT 1
+        """
+    IDENTITY_BATCH_QUERY = """
+        SELECT game_name, identity_id
+        FROM user_data
+        WHERE (game_name COLLATE NOCASE IN (%s) OR identity_id COLLATE NOCASE IN (%s))
+        AND whitelisted = 1
+        """
+    LEGACY_BATCH_QUERY = """
+        SELECT game_name, NULL
+        FROM user_data
+        WHERE game_name COLLATE NOCASE IN (%s)
+        AND whitelisted = 1
+        """
+    # Pairs per batch query, keeping well under SQLite's bound parameter limit.
+    BATCH_SIZE = 400
+
+    def __init__(self, db_path: str, reload_interval: float = 2.0) -> None:
+        super().__init__(reload_interval)
+        self.db_path = db_path
+        self._conn = None
+        self._query = None
+        self._data_version = None
+        # (data_version, tag) of the last version() call.
+        self._version = (None, None)
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Opens the read-only connection and picks the query for the schema.
+        """
+        uri = "file:%s?mode=ro" % urllib.request.pathname2url(
+            os.path.abspath(self.db_path)
+        )
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        try:
+            conn.execute("PRAGMA query_only = 1")
+            columns = {
+                row[1] for row in conn.execute("PRAGMA table_info(user_data)")
+            }
+        except sqlite3.Error:
+            conn.close()
+            raise
+        if "identity_id" in columns:
+            self._query = self.IDENTITY_QUERY
+        else:
+            self._query = self.LEGACY_QUERY
+            logging.warning(
+                "Database %s has no identity_id column, run 'migrate-db' to add it.",
+                self.db_path,
+            )
+        return conn
+
+    def is_whitelisted(self, player_name: str, identity_id: str) -> bool:
+        """
+        Checks the player's name or identity against the database.
+        """
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._conn = self._connect()
+                row = self._conn.execute(
+                    self._query, (player_name, identity_id)
+                ).fetchone()
+            except sqlite3.Error:
+                # Drop the connection so the next lookup reconnects.
+                self.close()
+                raise
+        return row is not None
+
+    def is_whitelisted_many(self, players: list) -> list:
+        """
+        Checks a list of (player_name, identity_id) pairs with one query per BATCH_SIZE pairs.
+        """
+        names = set()
+        identities = set()
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._conn = self._connect()
+                for start in range(0, len(players), self.BATCH_SIZE):
+                    chunk = players[start:start + self.BATCH_SIZE]
+                    placeholders = ", ".join("?" * len(chunk))
+                    chunk_names = [player_name for player_name, _ in chunk]
+                    chunk_identities = [identity_id for _, identity_id in chunk]
+                    if self._query is self.IDENTITY_QUERY:
+                        rows = self._conn.execute(
+                            self.IDENTITY_BATCH_QUERY
+                            % (", ".join("?" * (2 * len(chunk))), placeholders),
+                            chunk_names + chunk_identities + chunk_identities,
+                        )
+                    else:
+                        rows = self._conn.execute(
+                            self.LEGACY_BATCH_QUERY
+                            % ", ".join("?" * (2 * len(chunk))),
+                            chunk_names + chunk_identities,
+                        )
+                    for game_name, identity_id in rows:
+                        if game_name:
+                            names.add(game_name.lower())
+                        if identity_id:
+                            identities.add(identity_id.lower())
+            except sqlite3.Error:
+                self.close()
+                raise
+        # Both schemas match identities against game_name.
+        identities |= names
+        return [
+            player_name.lower() in names or identity_id.lower() in identities
+            for player_name, identity_id in players
+        ]
+
+    def version(self) -> str:
+        """
+        Returns a tag built from the database header's change counter and the
+        inode, mtime and size of the database and its WAL. It is only built
+        again once data_version on the lookup connection shows a commit from
+        another connection.
+        """
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._conn = self._connect()
+                data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            except sqlite3.Error:
+                self.close()
+                return None
+            last_data_version, last_tag = self._version
+            if data_version == last_data_version:
+                return last_tag
+            parts = []
+            try:
+                with open(self.db_path, "rb") as file:
+                    parts.append(str(int.from_bytes(file.read(28)[24:], "big")))
+            except OSError:
+                parts.append("-")
+            # In WAL mode commits only reach the main file at checkpoints.
+            for path in (self.db_path, self.db_path + "-wal"):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    parts.append("-")
+                    continue
+                parts.append("%s:%s:%s" % (stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            tag = "/".join(parts)
+            if last_data_version is not None and tag == last_tag:
+                # A commit that did not show in the files yet. Without a tag
+                # of its own, decisions are not persisted until it does.
+                return None
+            self._version = (data_version, tag)
+            return tag
+
+    def refresh(self) -> bool:
+        """
+        Notifies listeners if another connection has committed to the database.
+        """
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._conn = self._connect()
+                data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            except sqlite3.Error:
+                self.close()
+                return False
+            changed = (
+                self._data_version is not None and data_version != self._data_version
+            )
+            self._data_version = data_version
+        if changed:
+            self.notify_listeners()
+        return changed
+
+    def close(self) -> None:
+        """
+        Closes the connection if it is open.
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_database_whitelists = {}
+_database_whitelists_lock = threading.Lock()
+
+
+def get_database_whitelist(db_path: str) -> DatabaseWhitelist:
+    """
+    Returns the shared connection wrapper for a database whitelist.
+    """
+    with _database_whitelists_lock:
+        whitelist = _database_whitelists.get(db_path)
+        if whitelist is None:
+            whitelist = DatabaseWhitelist(db_path)
+            whitelist.start()
+            _database_whitelists[db_path] = whitelist
+        return whitelist
+
+
+def migrate_database(db_path: str) -> None:
+    """
+    Adds the identity_id column and case-insensitive lookup indexes to user_data.
+    """
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("PRAGMA journal_mode = WAL")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(user_data)")}
+        if not columns:
+            raise sqlite3.OperationalError("no such table: user_data")
+        if "identity_id" not in columns:
+            conn.execute("ALTER TABLE user_data ADD COLUMN identity_id TEXT")
+            logging.info("Added identity_id column to user_data.")
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_user_data_game_name
+            ON user_data (game_name COLLATE NOCASE)
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_user_data_identity_id
+            ON user_data (identity_id COLLATE NOCASE)
+            """
+        )
+    conn.close()
+    logging.info("Database %s migrated.", db_path)
+
+
+def is_player_in_database(player_name: str, identity_id: str, db_path: str) -> bool:
+    """
+    Checks if the player's identifier is in the database.
+    """
+    try:
+        is_whitelisted = get_database_whitelist(db_path).is_whitelisted(
+            player_name, identity_id
+        )
+    except sqlite3.Error as database_error:
+        logging.error("Database error: %s", database_error)
+        LOOKUP_ERRORS.inc()
+        return False
+
+    if is_whitelisted:
+        logging.info(
+            "Player %s or IdentityId %s found in database and is whitelisted.",
+            player_name,
+            identity_id,
+        )
+        return True
+    logging.info(
+        "Player %s or IdentityId %s not found in database or not whitelisted.",
+        player_name,
+        identity_id,
+    )
+    return False
+
+
+_json_decoder = json.JSONDecoder()
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_JSON_SEPARATOR = re.compile(r"[ \t\n\r]*([,:\]}])")
+# What can follow a decoded number prefix when the number itself is cut off,
+# as in "12." or "1e-".
+_JSON_NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+
+
+class JsonStream:
+    """
+    Reads JSON values one at a time from a file, holding only a chunk in memory.
+    """
+
+    def __init__(self, file, chunk_size: int = 65536) -> None:
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """
+        Appends the next chunk to the buffer, returns False at the end of the file.
+        """
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Skips whitespace and returns the next character, or "" at the end of the file.
+        """
+        while True:
+            self.position = _JSON_WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer) or not self._fill():
+                return self.buffer[self.position:self.position + 1]
+
+    def separator(self) -> str:
+        """
+        Consumes and returns the next structural character.
+        """
+        while True:
+            match = _JSON_SEPARATOR.match(self.buffer, self.position)
+            if match is not None:
+                self.position = match.end()
+                return match.group(1)
+            if self.peek() not in (",", ":", "]", "}"):
+                raise json.JSONDecodeError(
+                    "Expecting ',', ':', ']' or '}'", self.buffer, self.position
+                )
+
+    def expect(self, character: str) -> None:
+        if self.separator() != character:
+            raise json.JSONDecodeError(
+                "Expecting %r" % character, self.buffer, self.position - 1
+            )
+
+    def value(self):
+        """
+        Decodes the next complete value, reading more of the file as needed.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _json_decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                # The value may be cut off at the end of the buffer.
+                if self._fill():
+                    continue
+                raise
+            # A number that reaches the end of the buffer, possibly cut off
+            # after ".", "e" or "e-", may continue in the next chunk.
+            if (
+                isinstance(value, (int, float))
+                and not isinstance(value, bool)
+                and _JSON_NUMBER_TAIL.match(self.buffer, end).end() == len(self.buffer)
+                and self._fill()
+            ):
+                continue
+            self.position = end
+            return value
+
+
+def iter_json_players(json_path: str, chunk_size: int = 65536):
+    """
+    Yields each entry of the top-level "players" array without loading the whole file.
+    """
+    with open(json_path, "r", encoding="utf-8") as file:
+        stream = JsonStream(file, chunk_size)
+        if stream.peek() != "{":
+            raise json.JSONDecodeError("Expecting '{'", stream.buffer, stream.position)
+        stream.position += 1
+        if stream.peek() == "}":
+            return
+        while True:
+            key = stream.value()
+            stream.expect(":")
+            if key == "players":
+                if stream.peek() != "[":
+                    raise json.JSONDecodeError(
+                        "Expecting '['", stream.buffer, stream.position
+                    )
+                stream.position += 1
+                if stream.peek() == "]":
+                    stream.position += 1
+                else:
+                    while True:
+                        yield stream.value()
+                        separator = stream.separator()
+                        if separator == "]":
+                            break
+                        if separator != ",":
+                            raise json.JSONDecodeError(
+                                "Expecting ',' or ']'", stream.buffer, stream.position - 1
+                            )
+            else:
+                stream.value()
+            separator = stream.separator()
+            if separator == "}":
+                return
+            if separator != ",":
+                raise json.JSONDecodeError(
+                    "Expecting ',' or '}'", stream.buffer, stream.position - 1
+                )
+
+
+class JsonWhitelist(WhitelistStore):
+    """
+    In-memory index of a JSON whitelist, reloaded when the file changes.
+    """
+
+    def __init__(self, json_path: str, reload_interval: float = 2.0) -> None:
+        super().__init__(reload_interval)
+        self.json_path = json_path
+        # (names, identities, file signature), swapped as one object on reload.
+        self._index = ({}, {}, None)
+        self._reload_lock = threading.Lock()
+
+    def _file_signature(self) -> tuple:
+        """
+        Returns the (mtime, size) pair used to detect changes to the file.
+        """
+        stat = os.stat(self.json_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def load(self) -> bool:
+        """
+        Parses the JSON file and swaps in a fresh index.
+        Returns False and keeps the last good index if the file cannot be read.
+        """
+        with self._reload_lock:
+            try:
+                signature = self._file_signature()
+                with open(self.json_path, "r", encoding="utf-8") as file:
+                    data = json.load(file)
+                names = {}
+                identities = {}
+                for player in data.get("players", []):
+                    if player.get("whitelisted", 0) != 1:
+                        continue
+                    game_name = (player.get("game_name") or "").lower()
+                    identity_id = (player.get("identity_id") or "").lower()
+                    if game_name:
+                        names[game_name] = player
+                    if identity_id:
+                        identities[identity_id] = player
+            except json.JSONDecodeError as json_error:
+                logging.error("JSON error: %s", json_error)
+                return False
+            except (AttributeError, TypeError) as shape_error:
+                # Valid JSON, but not an object with a list of player objects.
+                logging.error("Unexpected JSON whitelist layout: %s", shape_error)
+                return False
+            except OSError as os_error:
+                logging.error("Unable to read JSON whitelist: %s", os_error)
+                return False
+
+            old_names, old_identities, _ = self._index
+            change = WhitelistChange(
+                frozenset(names.keys() - old_names.keys()),
+                frozenset(old_names.keys() - names.keys()),
+                frozenset(identities.keys() - old_identities.keys()),
+                frozenset(old_identities.keys() - identities.keys()),
+            )
+            # Replaced as one object so lookups never see a half-built index,
+            # or an index with the signature of another.
+            self._index = (names, identities, signature)
+            logging.info(
+                "Loaded JSON whitelist %s with %s names and %s identities.",
+                self.json_path,
+                len(names),
+                len(identities),
+            )
+        self.notify_listeners(change)
+        return True
+
+    def refresh(self) -> bool:
+        """
+        Reloads the index if the file's mtime or size has changed.
+        """
+        try:
+            signature = self._file_signature()
+        except OSError:
+            return False
+        if signature == self._index[2]:
+            return False
+        return self.load()
+
+    def version(self) -> str:
+        """
+        Returns the mtime and size of the file the index was loaded from.
+        """
+        signature = self._index[2]
+        return "%s:%s" % signature if signature is not None else None
+
+    def is_whitelisted(self, player_name: str, identity_id: str) -> bool:
+        """
+        Checks the player's name or identity against the index.
+        """
+        names, identities, _ = self._index
+        return player_name.lower() in names or identity_id.lower() in identities
+
+
+_json_whitelists = {}
+_json_whitelists_lock = threading.Lock()
+
+
+def get_json_whitelist(json_path: str) -> JsonWhitelist:
+    """
+    Returns the shared, auto-reloading index for a JSON whitelist.
+    """
+    with _json_whitelists_lock:
+        whitelist = _json_whitelists.get(json_path)
+        if whitelist is None:
+            whitelist = JsonWhitelist(json_path)
+            whitelist.load()
+            whitelist.start()
+            _json_whitelists[json_path] = whitelist
+        return whitelist
+
+
+def is_player_in_json(player_name: str, identity_id: str, json_path: str) -> bool:
+    """
+    Checks if the player's identifier is in the JSON.
+    """
+    if get_json_whitelist(json_path).is_whitelisted(player_name, identity_id):
+        logging.info(
+            "Player %s or IdentityId %s found in JSON and is whitelisted.",
+            player_name,
+            identity_id,
+        )
+        return True
+    logging.info(
+        "Player %s or IdentityId %s not found in JSON or not whitelisted.",
+        player_name,
+        identity_id,
+    )
+    return False
+
+
+SNAPSHOT_MAGIC = b"RWLS"
+SNAPSHOT_VERSION = 1
+# Magic, version, identity count, name count.
+SNAPSHOT_HEADER = struct.Struct("<4sIQQ")
+IDENTITY_KEY_SIZE = 16
+NAME_HASH_SIZE = 8
+SNAPSHOT_DATA_SUFFIX = ".data"
+
+
+def _snapshot_hash(kind: bytes, text: str) -> bytes:
+    """
+    Hashes a lowercased name, or an identity that is not a UUID, for the name table.
+    """
+    return hashlib.blake2b(
+        text.lower().encode("utf-8"), digest_size=NAME_HASH_SIZE, person=kind
+    ).digest()
+
+
+def _identity_key(identity_id: str) -> bytes:
+    """
+    Returns the 16-byte key of a UUID identity, or None if it is not a UUID.
+    """
+    try:
+        return uuid.UUID(identity_id).bytes
+    except ValueError:
+        return None
+
+
+def iter_whitelist_entries(whitelist_type: str, whitelist_path: str):
+    """
+    Yields (game_name, identity_id) for every whitelisted player in a JSON or database whitelist.
+    """
+    if whitelist_type == "json":
+        for player in iter_json_players(whitelist_path):
+            if player.get("whitelisted", 0) == 1:
+                yield player.get("game_name", ""), player.get("identity_id", "")
+    elif whitelist_type == "database":
+        with sqlite3.connect(whitelist_path) as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(user_data)")}
+            identity_column = "identity_id" if "identity_id" in columns else "NULL"
+            rows = conn.execute(
+                "SELECT game_name, %s FROM user_data WHERE whitelisted = 1"
+                % identity_column
+            )
+            for game_name, identity_id in rows:
+                yield game_name or "", identity_id or ""
+        conn.close()
+    else:
+        raise ValueError("Unknown whitelist type: %s" % whitelist_type)
+
+
+def compile_snapshot(whitelist_type: str, whitelist_path: str, snapshot_path: str) -> tuple:
+    """
+    Writes a binary snapshot of a whitelist and returns its (identity, name) counts.
+    """
+    identities = set()
+    names = set()
+    for game_name, identity_id in iter_whitelist_entries(whitelist_type, whitelist_path):
+        if game_name:
+            names.add(_snapshot_hash(b"name", game_name))
+        if identity_id:
+            key = _identity_key(identity_id)
+            if key is not None:
+                identities.add(key)
+            else:
+                names.add(_snapshot_hash(b"identity", identity_id))
+
+    # The tables go to a new data file and snapshot_path is a small pointer to
+    # it. Only the pointer is replaced, never a file a SnapshotWhitelist has
+    # mapped, which Windows refuses to replace or delete.
+    data_path = "%s.%s%s" % (snapshot_path, uuid.uuid4().hex, SNAPSHOT_DATA_SUFFIX)
+    with open(data_path, "wb") as file:
+        file.write(
+            SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(identities), len(names)
+            )
+        )
+        file.write(b"".join(sorted(identities)))
+        file.write(b"".join(sorted(names)))
+        file.flush()
+        os.fsync(file.fileno())
+    temp_path = snapshot_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        file.write(os.path.basename(data_path))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, snapshot_path)
+    remove_old_snapshot_data(snapshot_path, data_path)
+    logging.info(
+        "Compiled snapshot %s with %s identities and %s names.",
+        snapshot_path,
+        len(identities),
+        len(names),
+    )
+    return len(identities), len(names)
+
+
+def remove_old_snapshot_data(snapshot_path: str, current_path: str) -> None:
+    """
+    Deletes the data files of earlier compiles of a snapshot. Files that are
+    still mapped on Windows are left for a later compile to remove.
+    """
+    directory = os.path.dirname(os.path.abspath(snapshot_path))
+    pattern = re.compile(
+        re.escape(os.path.basename(snapshot_path))
+        + r"\.[0-9a-f]{32}"
+        + re.escape(SNAPSHOT_DATA_SUFFIX)
+        + "$"
+    )
+    for name in os.listdir(directory):
+        if name == os.path.basename(current_path) or not pattern.match(name):
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError as e:
+            logging.debug("Keeping old snapshot data %s: %s", name, e)
+
+
+def _search_sorted(buffer, offset: int, count: int, width: int, key: bytes) -> bool:
+    """
+    Binary searches a sorted array of fixed-width keys in buffer.
+    """
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        start = offset + middle * width
+        probe = buffer[start:start + width]
+        if probe == key:
+            return True
+        if probe < key:
+            low = middle + 1
+        else:
+            high = middle
+    return False
+
+
+class SnapshotWhitelist(WhitelistStore):
+    """
+    Memory-mapped binary whitelist snapshot, remapped when the pointer file is replaced.
+    """
+
+    def __init__(self, snapshot_path: str, reload_interval: float = 2.0) -> None:
+        super().__init__(reload_interval)
+        self.snapshot_path = snapshot_path
+        # (mmap, identity count, name count, data file name), swapped as one
+        # object on reload.
+        self._snapshot = None
+        self._retired = None
+        self._signature = None
+        self._reload_lock = threading.Lock()
+
+    def _file_signature(self) -> tuple:
+        """
+        Returns the (inode, mtime, size) triple used to detect a replaced pointer file.
+        """
+        stat = os.stat(self.snapshot_path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def load(self) -> bool:
+        """
+        Maps the snapshot file and swaps it in.
+        Returns False and keeps the last good snapshot if the file is missing or invalid.
+        """
+        with self._reload_lock:
+            try:
+                signature = self._file_signature()
+                with open(self.snapshot_path, "r", encoding="utf-8") as pointer:
+                    data_name = os.path.basename(pointer.read().strip())
+                data_path = os.path.join(os.path.dirname(self.snapshot_path), data_name)
+                with open(data_path, "rb") as file:
+                    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as map_error:
+                logging.error("Unable to map whitelist snapshot: %s", map_error)
+                return False
+
+            try:
+                magic, version, identity_count, name_count = SNAPSHOT_HEADER.unpack_from(mapped)
+            except struct.error:
+                magic = version = None
+            expected_size = (
+                SNAPSHOT_HEADER.size
+                + identity_count * IDENTITY_KEY_SIZE
+                + name_count * NAME_HASH_SIZE
+                if magic == SNAPSHOT_MAGIC
+                else None
+            )
+            if (
+                magic != SNAPSHOT_MAGIC
+                or version != SNAPSHOT_VERSION
+                or len(mapped) != expected_size
+            ):
+                mapped.close()
+                logging.error("Whitelist snapshot %s is not valid.", self.snapshot_path)
+                return False
+
+            # A lookup on another thread may still be reading the previous
+            # mapping, so it is closed one reload later. Closing it lets
+            # compile-snapshot delete its data file on Windows.
+            if self._retired is not None:
+                self._retired.close()
+            self._retired = self._snapshot[0] if self._snapshot is not None else None
+            self._snapshot = (mapped, identity_count, name_count, data_name)
+            self._signature = signature
+            logging.info(
+                "Mapped whitelist snapshot %s with %s identities and %s names.",
+                self.snapshot_path,
+                identity_count,
+                name_count,
+            )
+        self.notify_listeners()
+        return True
+
+    def refresh(self) -> bool:
+        """
+        Remaps the snapshot if the file has been replaced.
+        """
+        try:
+            signature = self._file_signature()
+        except OSError:
+            return False
+        if signature == self._signature:
+            return False
+        return self.load()
+
+    def version(self) -> str:
+        """
+        Returns the name of the mapped data file, which is new for every compile.
+        """
+        snapshot = self._snapshot
+        return snapshot[3] if snapshot is not None else None
+
+    def is_whitelisted(self, player_name: str, identity_id: str) -> bool:
+        """
+        Checks the player's identity and name against the mapped tables.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return False
+        mapped, identity_count, name_count, _ = snapshot
+        names_offset = SNAPSHOT_HEADER.size + identity_count * IDENTITY_KEY_SIZE
+        if identity_id:
+            key = _identity_key(identity_id)
+            if key is not None:
+                if _search_sorted(
+                    mapped, SNAPSHOT_HEADER.size, identity_count, IDENTITY_KEY_SIZE, key
+                ):
+                    return True
+            elif _search_sorted(
+                mapped,
+                names_offset,
+                name_count,
+                NAME_HASH_SIZE,
+                _snapshot_hash(b"identity", identity_id),
+            ):
+                return True
+        return bool(player_name) and _search_sorted(
+            mapped,
+            names_offset,
+            name_count,
+            NAME_HASH_SIZE,
+            _snapshot_hash(b"name", player_name),
+        )
+
+
+_snapshot_whitelists = {}
+_snapshot_whitelists_lock = threading.Lock()
+
+
+def get_snapshot_whitelist(snapshot_path: str) -> SnapshotWhitelist:
+    """
+    Returns the shared, auto-remapping view of a whitelist snapshot.
+    """
+    with _snapshot_whitelists_lock:
+        whitelist = _snapshot_whitelists.get(snapshot_path)
+        if whitelist is None:
+            whitelist = SnapshotWhitelist(snapshot_path)
+            whitelist.load()
+            whitelist.start()
+            _snapshot_whitelists[snapshot_path] = whitelist
+        return whitelist
+
+
+def is_player_in_snapshot(player_name: str, identity_id: str, snapshot_path: str) -> bool:
+    """
+    Checks if the player's identifier is in the snapshot.
+    """
+    if get_snapshot_whitelist(snapshot_path).is_whitelisted(player_name, identity_id):
+        logging.info(
+            "Player %s or IdentityId %s found in snapshot and is whitelisted.",
+            player_name,
+            identity_id,
+        )
+        return True
+    logging.info(
+        "Player %s or IdentityId %s not found in snapshot or not whitelisted.",
+        player_name,
+        identity_id,
+    )
+    return False
+
+
+def _player_row(player: dict) -> tuple:
+    """
+    Returns the (game_name, identity_id, whitelisted) row for a JSON player entry.
+    """
+    return (
+        player.get("game_name") or None,
+        player.get("identity_id") or None,
+        1 if player.get("whitelisted", 0) == 1 else 0,
+    )
+
+
+def _row_key(game_name: str, identity_id: str) -> tuple:
+    return ((game_name or "").lower(), (identity_id or "").lower())
+
+
+def _open_import_database(db_path: str) -> sqlite3.Connection:
+    """
+    Creates or migrates user_data and returns a connection in autocommit mode.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_data "
+            "(game_name TEXT, whitelisted INTEGER, identity_id TEXT)"
+        )
+    except sqlite3.Error:
+        conn.close()
+        raise
+    conn.close()
+    migrate_database(db_path)
+    return sqlite3.connect(db_path, isolation_level=None)
+
+
+def _batches(rows, batch_size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_json_to_database(json_path: str, db_path: str, batch_size: int = 5000) -> int:
+    """
+    Replaces the rows of user_data with the players of a JSON whitelist.
+    Returns the number of rows inserted.
+    """
+    conn = _open_import_database(db_path)
+    inserted = 0
+    try:
+        # One transaction, so a running whitelist keeps seeing the old rows
+        # until the import commits.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DROP INDEX IF EXISTS idx_user_data_game_name")
+            conn.execute("DROP INDEX IF EXISTS idx_user_data_identity_id")
+            conn.execute("DELETE FROM user_data")
+            rows = (_player_row(player) for player in iter_json_players(json_path))
+            for batch in _batches(rows, batch_size):
+                conn.executemany(
+                    "INSERT INTO user_data (game_name, identity_id, whitelisted) "
+                    "VALUES (?, ?, ?)",
+                    batch,
+                )
+                inserted += len(batch)
+            # Building the indexes once at the end is cheaper than updating
+            # them on every insert.
+            conn.execute(
+                "CREATE INDEX idx_user_data_game_name "
+                "ON user_data (game_name COLLATE NOCASE)"
+            )
+            conn.execute(
+                "CREATE INDEX idx_user_data_identity_id "
+                "ON user_data (identity_id COLLATE NOCASE)"
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    logging.info("Imported %s players from %s into %s.", inserted, json_path, db_path)
+    return inserted
+
+
+def sync_json_to_database(json_path: str, db_path: str, batch_size: int = 5000) -> tuple:
+    """
+    Applies only the differences between a JSON whitelist and user_data.
+    Returns the (inserted, updated, deleted) row counts.
+    """
+    conn = _open_import_database(db_path)
+    inserted = updated = deleted = 0
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = {}
+            stale = []
+            for rowid, game_name, identity_id, whitelisted in conn.execute(
+                "SELECT rowid, game_name, identity_id, whitelisted FROM user_data"
+            ):
+                key = _row_key(game_name, identity_id)
+                if key in existing:
+                    stale.append((rowid,))
+                else:
+                    existing[key] = (rowid, whitelisted)
+
+            inserts = []
+            updates = []
+            seen = set()
+            for player in iter_json_players(json_path):
+                row = _player_row(player)
+                key = _row_key(row[0], row[1])
+                if key in seen:
+                    continue
+                seen.add(key)
+                current = existing.pop(key, None)
+                if current is None:
+                    inserts.append(row)
+                elif current[1] != row[2]:
+                    updates.append((row[2], current[0]))
+                if len(inserts) >= batch_size:
+                    conn.executemany(
+                        "INSERT INTO user_data (game_name, identity_id, whitelisted) "
+                        "VALUES (?, ?, ?)",
+                        inserts,
+                    )
+                    inserted += len(inserts)
+                    inserts = []
+                if len(updates) >= batch_size:
+                    conn.executemany(
+                        "UPDATE user_data SET whitelisted = ? WHERE rowid = ?", updates
+                    )
+                    updated += len(updates)
+                    updates = []
+            conn.executemany(
+                "INSERT INTO user_data (game_name, identity_id, whitelisted) "
+                "VALUES (?, ?, ?)",
+                inserts,
+            )
+            inserted += len(inserts)
+            conn.executemany(
+                "UPDATE user_data SET whitelisted = ? WHERE rowid = ?", updates
+            )
+            updated += len(updates)
+
+            stale.extend((rowid,) for rowid, _ in existing.values())
+            for batch in _batches(stale, batch_size):
+                conn.executemany("DELETE FROM user_data WHERE rowid = ?", batch)
+            deleted = len(stale)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    logging.info(
+        "Synced %s into %s: %s inserted, %s updated, %s deleted.",
+        json_path,
+        db_path,
+        inserted,
+        updated,
+        deleted,
+    )
+    return inserted, updated, deleted
+
+
+def export_database_to_json(db_path: str, json_path: str) -> int:
+    """
+    Writes every row of user_data to a JSON whitelist, replacing the file atomically.
+    Returns the number of players written.
+    """
+    exported = 0
+    temp_path = json_path + ".tmp"
+    with sqlite3.connect(db_path) as conn:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(user_data)")}
+        if not columns:
+            raise sqlite3.OperationalError("no such table: user_data")
+        identity_column = "identity_id" if "identity_id" in columns else "NULL"
+        rows = conn.execute(
+            "SELECT game_name, %s, whitelisted FROM user_data ORDER BY rowid"
+            % identity_column
+        )
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write('{"players": [')
+            for game_name, identity_id, whitelisted in rows:
+                player = {"game_name": game_name or "", "whitelisted": whitelisted}
+                if identity_id:
+                    player["identity_id"] = identity_id
+                file.write(",\n  " if exported else "\n  ")
+                file.write(json.dumps(player))
+                exported += 1
+            file.write("\n]}\n")
+            file.flush()
+            os.fsync(file.fileno())
+    conn.close()
+    # JsonWhitelist only ever sees the old file or the complete new one.
+    os.replace(temp_path, json_path)
+    logging.info("Exported %s players from %s to %s.", exported, db_path, json_path)
+    return exported
+
+
+class KickResult(NamedTuple):
+    """
+    Outcome of a single kick command.
+    """
+
+    player_id: str
+    success: bool
+    error: str = None
+
+
+def parse_rcon_packet(data: bytes):
+    """
+    Parses one BattlEye RCON packet into its response type.
+    """
+    header = Header.from_bytes(data[:HEADER_SIZE])
+    return RESPONSE_TYPES[header.type].from_bytes(header, data[HEADER_SIZE:])
+
+
+def merge_response_part(parts: dict, payload: bytes) -> bytes:
+    """
+    Returns the full payload of a command response, collecting the parts of a
+    multi-packet response in parts until all have arrived, or None until then.
+    """
+    # Multi-packet responses start with 0x00, the packet count and the index.
+    if len(payload) >= 3 and payload[0] == 0:
+        parts[payload[2]] = payload[3:]
+        if len(parts) < payload[1]:
+            return None
+        payload = b"".join(parts[index] for index in sorted(parts))
+    return payload
+
+
+class RconSession:
+    """
+    A single authenticated BattlEye RCON session over UDP.
+    """
+
+    def __init__(
+        self, rcon_host: str, rcon_port: int, rcon_password: str, timeout: float = 5.0
+    ) -> None:
+        self.rcon_host = rcon_host
+        self.rcon_port = rcon_port
+        self.rcon_password = rcon_password
+        self.timeout = timeout
+        self._socket = None
+        self._seq = 0
+        # Reconnect backoff, managed by the worker that owns the session.
+        self.backoff = 0.0
+        self.next_connect = 0.0
+
+    @property
+    def connected(self) -> bool:
+        return self._socket is not None
+
+    def connect(self) -> None:
+        """
+        Opens the socket and logs in.
+        """
+        self.close()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect((self.rcon_host, self.rcon_port))
+            sock.send(bytes(LoginRequest(self.rcon_password)))
+            while True:
+                response = self._receive(sock)
+                if isinstance(response, LoginResponse):
+                    break
+        except Exception:
+            sock.close()
+            raise
+        if not response.success:
+            sock.close()
+            raise WrongPassword()
+        self._socket = sock
+        self._seq = 0
+
+    def _receive(self, sock: socket.socket):
+        """
+        Receives one packet and acknowledges server messages.
+        """
+        response = parse_rcon_packet(sock.recv(4096))
+        if isinstance(response, ServerMessage):
+            sock.send(bytes(ServerMessageAck(response.seq)))
+        return response
+
+    def command(self, command: str) -> str:
+        """
+        Sends a command and waits for the response with the same sequence number.
+        """
+        if self._socket is None:
+            raise ConnectionError("RCON session is not connected")
+        seq = self._seq
+        self._seq = (seq + 1) % 256
+        self._socket.send(bytes(CommandRequest(seq, command)))
+
+        parts = {}
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            response = self._receive(self._socket)
+            if not isinstance(response, CommandResponse) or response.seq != seq:
+                continue
+            payload = merge_response_part(parts, response.payload)
+            if payload is not None:
+                return payload.decode("ascii", errors="replace")
+        raise TimeoutError("No response to RCON command %s" % seq)
+
+    def keepalive(self) -> None:
+        """
+        Sends an empty command so the server keeps the session open.
+        """
+        self.command("")
+
+    def close(self) -> None:
+        """
+        Closes the socket if it is open.
+        """
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class TokenBucket:
+    """
+    Token bucket limiting how many RCON commands are sent per second.
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token and returns how many seconds to wait before using it.
+        """
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # Going into debt keeps waiting callers in the order they arrived.
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+def jittered_backoff(attempt: int, base: float, maximum: float) -> float:
+    """
+    Returns the delay before retry number attempt, doubling each time with +/-50%
+    jitter and never longer than maximum.
+    """
+    return min(maximum, base * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+KICK_PRIORITY_FRESH = 0
+KICK_PRIORITY_RETRY = 1
+KICK_PRIORITY_STOP = 2
+
+
+class KickQueue(abc.ABC):
+    """
+    Bookkeeping shared by the threaded and asyncio kick queues: de-duplicating
+    kicks per player, dropping kicks when the queue is full, scheduling
+    retries and recording outcomes.
+    Queue items are (priority, order, player_id, future, queued, attempt), so
+    fresh kicks go ahead of retries and each priority stays FIFO.
+    """
+
+    def __init__(
+        self, kick_attempts: int = 3, max_backoff: float = 60.0, retry_delay: float = 1.0
+    ) -> None:
+        self.kick_attempts = kick_attempts
+        self.max_backoff = max_backoff
+        self.retry_delay = retry_delay
+        self._order = itertools.count()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def kick(self, player_id: str) -> concurrent.futures.Future:
+        """
+        Queues a kick and returns a future resolving to its KickResult.
+        A player whose kick is already queued gets the pending future back.
+        Safe to call from any thread.
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(player_id)
+            if future is not None:
+                return future
+            future = self._inflight[player_id] = concurrent.futures.Future()
+        self._submit(
+            (KICK_PRIORITY_FRESH, next(self._order), player_id, future, time.monotonic(), 0)
+        )
+        return future
+
+    @abc.abstractmethod
+    def _submit(self, item: tuple) -> None:
+        """
+        Puts an item on the queue, calling _drop if the queue is full.
+        """
+
+    def _drop(self, item: tuple) -> None:
+        _, _, player_id, future, _, _ = item
+        logging.error("Kick queue is full, dropping kick for player ID %s", player_id)
+        KICKS.inc(labels=("dropped",))
+        with self._inflight_lock:
+            self._inflight.pop(player_id, None)
+        future.set_result(KickResult(player_id, False, "kick queue is full"))
+
+    def _retry(self, item: tuple, result: KickResult) -> tuple:
+        """
+        Returns the delay and the queue item for another attempt at a failed
+        kick, or None if it should not be retried.
+        """
+        priority, order, player_id, future, queued, attempt = item
+        if result.success or attempt + 1 >= self.kick_attempts:
+            return None
+        KICK_RETRIES.inc()
+        delay = jittered_backoff(attempt, self.retry_delay, self.max_backoff)
+        logging.warning(
+            "Kick for player ID %s failed (%s), retrying in %.1fs",
+            player_id,
+            result.error,
+            delay,
+        )
+        return delay, (KICK_PRIORITY_RETRY, order, player_id, future, queued, attempt + 1)
+
+    def _finish(
+        self,
+        player_id: str,
+        future: concurrent.futures.Future,
+        queued: float,
+        result: KickResult,
+    ) -> None:
+        """
+        Records the outcome of a kick and resolves its future.
+        """
+        KICKS.inc(labels=("success" if result.success else "failure",))
+        if result.success:
+            KICK_SECONDS.observe(time.monotonic() - queued)
+        else:
+            logging.error(
+                "Unexpected error executing kick command for player ID %s: %s",
+                player_id,
+                result.error,
+            )
+        with self._inflight_lock:
+            self._inflight.pop(player_id, None)
+        future.set_result(result)
+
+
+class RconManager(KickQueue):
+    """
+    Drains kick commands from a bounded priority queue with a small pool of RCON sessions.
+    """
+
+    def __init__(
+        self,
+        rcon_host: str,
+        rcon_port: int,
+        rcon_password: str,
+        keepalive_interval: float = 30.0,
+        max_queue: int = 256,
+        kick_attempts: int = 3,
+        max_backoff: float = 60.0,
+        workers: int = 1,
+        command_rate: float = 10.0,
+        command_burst: int = 20,
+        retry_delay: float = 1.0,
+    ) -> None:
+        super().__init__(kick_attempts, max_backoff, retry_delay)
+        self.rcon_host = rcon_host
+        self.rcon_port = rcon_port
+        self.rcon_password = rcon_password
+        self.keepalive_interval = keepalive_interval
+        self.workers = max(1, workers)
+        self.bucket = TokenBucket(command_rate, command_burst)
+        self._queue = queue.PriorityQueue(maxsize=max_queue)
+        self._threads = []
+        self._sessions = []
+        # Kick attempts made by the workers, for the watchdog.
+        self.attempts = 0
+
+    @property
+    def server(self) -> str:
+        return "%s:%s" % (self.rcon_host, self.rcon_port)
+
+    def start(self) -> None:
+        """
+        Starts the worker threads, each with its own RCON session.
+        """
+        if self._threads:
+            return
+        _active_queues["kick:%s" % self.server] = self._queue.qsize
+        _active_stages["kick:%s" % self.server] = (
+            lambda: self.attempts,
+            self._queue.qsize,
+            self.revive,
+        )
+        _rcon_states[self.server] = self.session_state
+        self._sessions = [
+            RconSession(self.rcon_host, self.rcon_port, self.rcon_password)
+            for _ in range(self.workers)
+        ]
+        self._threads = [self._start_worker(index) for index in range(self.workers)]
+
+    def _start_worker(self, index: int) -> threading.Thread:
+        worker = threading.Thread(
+            target=self._run,
+            args=(self._sessions[index],),
+            name="RconThread-%s-%s" % (self.server, index),
+            daemon=True,
+        )
+        worker.start()
+        return worker
+
+    def revive(self) -> None:
+        """
+        Replaces worker threads that have died.
+        """
+        for index, worker in enumerate(self._threads):
+            if worker.is_alive():
+                continue
+            logging.warning("%s died, starting a new RCON worker.", worker.name)
+            self._sessions[index].close()
+            self._threads[index] = self._start_worker(index)
+
+    def session_state(self) -> str:
+        """
+        Describes the RCON sessions and the kick queue for the heartbeat.
+        """
+        connected = sum(session.connected for session in self._sessions)
+        if connected == len(self._sessions):
+            state = "connected"
+        elif connected:
+            state = "%s of %s sessions connected" % (connected, len(self._sessions))
+        else:
+            retry = max(
+                (session.next_connect for session in self._sessions), default=0.0
+            ) - time.monotonic()
+            state = "reconnecting in %.0fs" % retry if retry > 0 else "not connected"
+        return "%s, %s kicks queued" % (state, self._queue.qsize())
+
+    def stop(self) -> None:
+        """
+        Lets the workers finish the queued kicks, then closes their sessions.
+        """
+        if not self._threads:
+            return
+        for _ in self._threads:
+            self._queue.put((KICK_PRIORITY_STOP, next(self._order), None, None, None, 0))
+        for worker in self._threads:
+            worker.join()
+        self._threads = []
+        _active_stages.pop("kick:%s" % self.server, None)
+        _rcon_states.pop(self.server, None)
+
+    def _submit(self, item: tuple) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._drop(item)
+
+    def _ensure_session(self, session: RconSession) -> None:
+        """
+        Connects the session, waiting out the reconnect backoff first.
+        """
+        if session.connected:
+            return
+        delay = session.next_connect - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            session.connect()
+        except Exception:
+            session.backoff = min(self.max_backoff, max(1.0, session.backoff * 2))
+            session.next_connect = time.monotonic() + session.backoff
+            raise
+        session.backoff = 0.0
+        logging.info(
+            "RCON session established with %s:%s",
+            self.rcon_host,
+            self.rcon_port,
+        )
+
+    def _execute_kick(self, session: RconSession, player_id: str) -> KickResult:
+        """
+        Runs the kick command once, within the command rate limit.
+        """
+        try:
+            self._ensure_session(session)
+            wait = self.bucket.reserve()
+            if wait > 0:
+                RCON_THROTTLE_SECONDS.inc(wait)
+                time.sleep(wait)
+            session.command("#kick %s" % player_id)
+        except Exception as e:
+            session.close()
+            return KickResult(player_id, False, str(e))
+        logging.info(
+            "Successfully executed kick command for player ID %s",
+            player_id,
+        )
+        return KickResult(player_id, True)
+
+    def _run(self, session: RconSession) -> None:
+        """
+        Drains the kick queue, retrying failures after a jittered backoff and
+        keeping the session alive while idle.
+        """
+        # Retries waiting out their backoff, as (due, order, item).
+        delayed = []
+        stopped = False
+        try:
+            stopped = self._drain(session, delayed)
+        finally:
+            if stopped:
+                for _, _, item in delayed:
+                    _, _, player_id, future, queued, _ = item
+                    self._finish(
+                        player_id,
+                        future,
+                        queued,
+                        KickResult(player_id, False, "RCON manager stopped"),
+                    )
+            else:
+                self._requeue(delayed)
+            session.close()
+
+    def _requeue(self, delayed: list) -> None:
+        """
+        Puts the retries of a dying worker back on the queue so the revived
+        worker attempts them and their futures still resolve.
+        """
+        for _, _, item in sorted(delayed):
+            logging.warning("Requeueing kick retry for player ID %s", item[2])
+            self._submit(item)
+
+    def _drain(self, session: RconSession, delayed: list) -> bool:
+        """
+        Runs the worker loop until a stop item is taken, returning True.
+        """
+        idle_since = time.monotonic()
+        while True:
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now:
+                due, order, item = heapq.heappop(delayed)
+                try:
+                    self._queue.put_nowait(item)
+                except queue.Full:
+                    heapq.heappush(delayed, (now + self.retry_delay, order, item))
+                    break
+            timeout = idle_since + self.keepalive_interval - now
+            if delayed:
+                timeout = min(timeout, delayed[0][0] - now)
+            try:
+                item = self._queue.get(timeout=max(0.0, timeout))
+            except queue.Empty:
+                if time.monotonic() - idle_since >= self.keepalive_interval:
+                    try:
+                        self._ensure_session(session)
+                        session.keepalive()
+                    except Exception as e:
+                        logging.warning("RCON keepalive failed: %s", e)
+                        session.close()
+                    idle_since = time.monotonic()
+                continue
+            priority, order, player_id, future, queued, attempt = item
+            if priority == KICK_PRIORITY_STOP:
+                return True
+            try:
+                result = self._execute_kick(session, player_id)
+            except BaseException as e:
+                self._finish(
+                    player_id, future, queued, KickResult(player_id, False, "RCON worker died: %s" % e)
+                )
+                raise
+            self.attempts += 1
+            idle_since = time.monotonic()
+            retry = self._retry(item, result)
+            if retry is not None:
+                delay, retry_item = retry
+                heapq.heappush(delayed, (time.monotonic() + delay, order, retry_item))
+                continue
+            self._finish(player_id, future, queued, result)
+
+
+_rcon_managers = {}
+_rcon_managers_lock = threading.Lock()
+_rcon_options = {}
+# Kick queues of servers guarded by the asyncio runtime, which kicks over its
+# own RCON session instead of an RconManager.
+_kick_queues = {}
+
+
+def set_rcon_options(**options) -> None:
+    """
+    Sets the RconManager and AsyncRconClient options used for servers connected from now on.
+    """
+    _rcon_options.update(
+        (name, value) for name, value in options.items() if value is not None
+    )
+
+
+def get_rcon_manager(rcon_host: str, rcon_port: int, rcon_password: str) -> RconManager:
+    """
+    Returns the shared, running RCON manager for a server.
+    """
+    key = (rcon_host, rcon_port, rcon_password)
+    with _rcon_managers_lock:
+        manager = _rcon_managers.get(key)
+        if manager is None:
+            manager = RconManager(rcon_host, rcon_port, rcon_password, **_rcon_options)
+            manager.start()
+            _rcon_managers[key] = manager
+        return manager
+
+
+def register_kick_queue(
+    rcon_host: str, rcon_port: int, rcon_password: str, kick_queue: KickQueue
+) -> None:
+    """
+    Sends the server's kicks to kick_queue, or back to its RconManager when None.
+    """
+    key = (rcon_host, rcon_port, rcon_password)
+    with _rcon_managers_lock:
+        if kick_queue is None:
+            _kick_queues.pop(key, None)
+        else:
+            _kick_queues[key] = kick_queue
+
+
+def get_kick_queue(rcon_host: str, rcon_port: int, rcon_password: str) -> KickQueue:
+    """
+    Returns the queue that kicks players from a server for the running runtime.
+    """
+    with _rcon_managers_lock:
+        kick_queue = _kick_queues.get((rcon_host, rcon_port, rcon_password))
+    if kick_queue is not None:
+        return kick_queue
+    return get_rcon_manager(rcon_host, rcon_port, rcon_password)
+
+
+def execute_kick_command(
+    player_id: str, rcon_host: str, rcon_port: int, rcon_password: str
+) -> concurrent.futures.Future:
+    """
+    Queues a kick on the server's RCON session IF a player is not whitelisted.
+    """
+    return get_kick_queue(rcon_host, rcon_port, rcon_password).kick(player_id)
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+LOG_FILE_EVENTS = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_DELETE_SELF | IN_MOVE_SELF
+LOG_DIR_EVENTS = IN_CREATE | IN_MOVED_TO
+
+
+class InotifyWaiter:
+    """
+    Blocks until inotify reports a change to one of the watched paths.
+    """
+
+    def __init__(self) -> None:
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path: str, mask: int = LOG_FILE_EVENTS) -> int:
+        """
+        Watches a file or directory for the given events.
+        """
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def remove_watch(self, wd: int) -> None:
+        self._libc.inotify_rm_watch(self._fd, wd)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Waits up to timeout seconds for an event and drains the event queue.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return False
+        self._drain()
+        return True
+
+    async def wait_async(self, timeout: float) -> bool:
+        """
+        Waits on the running event loop, which watches the inotify descriptor
+        with the rest of its I/O, up to timeout seconds for an event.
+        """
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_reader(self._fd, lambda: ready.done() or ready.set_result(True))
+        try:
+            await asyncio.wait_for(ready, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(self._fd)
+        self._drain()
+        return True
+
+    def _drain(self) -> None:
+        try:
+            while os.read(self._fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+    def reset(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollWaiter:
+    """
+    Sleeps between reads, backing off while the log is idle.
+    """
+
+    def __init__(self, min_interval: float = 0.05, max_interval: float = 0.5) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._interval = min_interval
+
+    def add_watch(self, path: str, mask: int = LOG_FILE_EVENTS) -> None:
+        pass
+
+    def remove_watch(self, wd: int) -> None:
+        pass
+
+    def wait(self, timeout: float) -> bool:
+        time.sleep(self._next_interval(timeout))
+        return False
+
+    async def wait_async(self, timeout: float) -> bool:
+        await asyncio.sleep(self._next_interval(timeout))
+        return False
+
+    def _next_interval(self, timeout: float) -> float:
+        interval = min(self._interval, timeout)
+        self._interval = min(self.max_interval, self._interval * 2)
+        return interval
+
+    def reset(self) -> None:
+        self._interval = self.min_interval
+
+    def close(self) -> None:
+        pass
+
+
+def create_log_waiter(poll_interval: float = 0.05):
+    """
+    Returns an inotify waiter, or an adaptive poller where inotify is unavailable.
+    """
+    try:
+        return InotifyWaiter()
+    except (OSError, AttributeError) as e:
+        logging.info("inotify unavailable (%s), falling back to polling.", e)
+        return PollWaiter(min_interval=poll_interval)
+
+
+class Checkpoint:
+    """
+    Persists how far the tailer got through a console.log.
+    """
+
+    def __init__(self, checkpoint_path: str) -> None:
+        self.checkpoint_path = checkpoint_path
+
+    def load(self) -> dict:
+        """
+        Returns the saved path, inode and offset, or None if there is no usable checkpoint.
+        """
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(
+                "Ignoring unreadable checkpoint %s: %s",
+                self.checkpoint_path,
+                e,
+            )
+            return None
+        if not all(key in state for key in ("path", "inode", "offset")):
+            return None
+        return state
+
+    def save(self, log_path: str, inode: int, offset: int) -> None:
+        """
+        Atomically replaces the checkpoint file.
+        """
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {"path": os.path.realpath(log_path), "inode": inode, "offset": offset},
+                file,
+            )
+        os.replace(temp_path, self.checkpoint_path)
+
+
+class LogTailer:
+    """
+    Follows a log file and passes every complete line to the callback.
+    In batch mode the callback gets each block of complete lines as one string.
+    When the callback only queues its lines, after_handled is given each
+    checkpoint save to run once the lines queued before it are handled.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        callback: callable,
+        buffer_size: int = 65536,
+        max_wait: float = 1.0,
+        follow_sessions: bool = True,
+        batch: bool = False,
+        checkpoint: Checkpoint = None,
+        checkpoint_interval: float = 5.0,
+        after_handled: callable = None,
+    ) -> None:
+        self.file_path = file_path
+        self.callback = callback
+        self.batch = batch
+        self.checkpoint = checkpoint
+        self.after_handled = after_handled
+        self.checkpoint_interval = checkpoint_interval
+        self._last_checkpoint = 0.0
+        self.buffer_size = buffer_size
+        self.max_wait = max_wait
+        self.directory_watcher = (
+            LogDirectoryWatcher.for_log_file(file_path) if follow_sessions else None
+        )
+        self._file = None
+        self._pending = b""
+        self.bytes_read = 0
+        self._waiter = None
+        self._file_watch = None
+        self._watched_dirs = set()
+        self._stop_event = threading.Event()
+
+    def open(self, offset: int = None) -> None:
+        """
+        Opens the file at offset, or at the end of the file if no offset is given.
+        """
+        self._file = open(self.file_path, "rb")
+        if offset is None:
+            self._file.seek(0, 2)
+        else:
+            self._file.seek(offset)
+        self._pending = b""
+        _active_tailers.add(self)
+
+    @property
+    def position(self) -> int:
+        return self._file.tell()
+
+    def lag_bytes(self) -> int:
+        """
+        Returns how many bytes the tailer is behind the end of the file.
+        """
+        return os.fstat(self._file.fileno()).st_size - self._file.tell()
+
+    def read_available(self) -> int:
+        """
+        Reads everything written since the last call and returns the bytes read.
+        """
+        if os.fstat(self._file.fileno()).st_size < self._file.tell():
+            logging.warning(
+                "Log file %s was truncated, reading from the start.",
+                self.file_path,
+            )
+            self._file.seek(0)
+            self._pending = b""
+
+        total = 0
+        while True:
+            chunk = self._file.read(self.buffer_size)
+            if not chunk:
+                return total
+            total += len(chunk)
+            self.bytes_read += len(chunk)
+            LOG_BYTES.inc(len(chunk))
+            data = self._pending + chunk
+            end = data.rfind(b"\n")
+            # Everything after the last newline is an incomplete line. Keep it
+            # for the next read.
+            self._pending = data[end + 1:]
+            if end < 0:
+                continue
+            LOG_LINES.inc(data.count(b"\n", 0, end) + 1)
+            if self.batch:
+                self.callback(data[:end].decode("utf-8", errors="replace"))
+                continue
+            for line in data[:end].split(b"\n"):
+                self.callback(line.rstrip(b"\r").decode("utf-8", errors="replace"))
+
+    def run(self) -> None:
+        """
+        Reads new lines until stopped, waiting on inotify or polling between reads.
+        """
+        if self._file is None:
+            self.open()
+        self.watch()
+        try:
+            while not self._stop_event.is_set():
+                if self.poll():
+                    self.save_checkpoint()
+                    continue
+                self._waiter.wait(self.max_wait)
+        finally:
+            self.unwatch()
+            self.close()
+
+    def watch(self, poll_interval: float = 0.05) -> None:
+        """
+        Starts watching the log file and the session directories for changes.
+        """
+        self._waiter = create_log_waiter(poll_interval)
+        self._file_watch = self._waiter.add_watch(self.file_path)
+        self._watched_dirs = set()
+        self._watch_directories()
+
+    def unwatch(self) -> None:
+        if self._waiter is not None:
+            self._waiter.close()
+            self._waiter = None
+
+    def poll(self) -> bool:
+        """
+        Reads new lines, or switches to a new session's log.
+        Returns False if there was nothing to do.
+        """
+        if self.read_available():
+            self._waiter.reset()
+            return True
+        if self.directory_watcher is not None:
+            new_log_path = self.directory_watcher.check()
+            if new_log_path:
+                self.switch_to(new_log_path)
+                return True
+            self._watch_directories()
+        return False
+
+    async def wait_async(self) -> None:
+        """
+        Waits on the event loop until the log may have changed.
+        """
+        await self._waiter.wait_async(self.max_wait)
+
+    def save_checkpoint(self, force: bool = False) -> None:
+        """
+        Records the offset of the first unprocessed line, at most once per interval.
+        """
+        if self.checkpoint is None or self._file is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_checkpoint < self.checkpoint_interval:
+            return
+        self._last_checkpoint = now
+        checkpoint = self.checkpoint
+        state = (
+            self.file_path,
+            os.fstat(self._file.fileno()).st_ino,
+            self._file.tell() - len(self._pending),
+        )
+
+        def save() -> None:
+            try:
+                checkpoint.save(*state)
+            except OSError as e:
+                logging.warning("Unable to save checkpoint: %s", e)
+
+        if self.after_handled is None:
+            save()
+        else:
+            self.after_handled(save)
+
+    def _watch_directories(self) -> None:
+        """
+        Watches the directories where a new session's console.log can appear.
+        """
+        if self.directory_watcher is None:
+            return
+        for path in self.directory_watcher.watch_paths:
+            if path not in self._watched_dirs:
+                try:
+                    self._waiter.add_watch(path, LOG_DIR_EVENTS)
+                except OSError as e:
+                    logging.warning("Unable to watch %s: %s", path, e)
+                self._watched_dirs.add(path)
+
+    def switch_to(self, file_path: str) -> None:
+        """
+        Finishes the current file and follows a new one from its first line.
+        """
+        self.read_available()
+        if self._pending:
+            self.callback(self._pending.rstrip(b"\r").decode("utf-8", errors="replace"))
+        self.close()
+        logging.info("New server session detected, now following %s", file_path)
+        self.file_path = file_path
+        self.open(offset=0)
+        self.save_checkpoint(force=True)
+        if self._waiter is not None:
+            self._waiter.remove_watch(self._file_watch)
+            self._file_watch = self._waiter.add_watch(file_path)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def close(self) -> None:
+        _active_tailers.discard(self)
+        self.save_checkpoint(force=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def tail_log_file(
+    file_path: str,
+    callback: callable,
+    batch: bool = False,
+    offset: int = None,
+    checkpoint: Checkpoint = None,
+    after_handled: callable = None,
+) -> None:
+    """
+    Follows the log from offset, or its current end, and passes each new line to the callback.
+    """
+    try:
+        tailer = LogTailer(
+            file_path,
+            callback,
+            batch=batch,
+            checkpoint=checkpoint,
+            after_handled=after_handled,
+        )
+        tailer.open(offset)
+        tailer.run()
+    except FileNotFoundError:
+        logging.error("Log file not found: %s", file_path)
+    except Exception:
+        logging.exception("Error reading log file")
+
+
+PLAYER_EVENT_MARKER = "player: PlayerId="
+PLAYER_EVENT_PATTERN = re.compile(
+    r"(Creating|Updating|Disconnecting) player: PlayerId=(\d+)"
+    r"(?:, Name=([^,\n]+))?(?:, IdentityId=([a-f0-9-]+))?"
+)
+PLAYER_LEFT_ACTION = "Disconnecting"
+
+
+class PlayerEvent(NamedTuple):
+    """
+    A player event parsed from the console log.
+    """
+
+    action: str
+    player_id: str
+    player_name: str
+    identity_id: str
+
+
+def parse_log_line(line: str) -> PlayerEvent:
+    """
+    Returns the player event on the line, or None for any other line.
+    """
+    # Nearly every console line is engine noise, and a substring test is
+    # far cheaper than running the regex on it.
+    if PLAYER_EVENT_MARKER not in line:
+        return None
+    match = PLAYER_EVENT_PATTERN.search(line)
+    if match is None:
+        return None
+    action, player_id, player_name, identity_id = match.groups("")
+    # Join events are only acted on with both a name and an identity.
+    if action != PLAYER_LEFT_ACTION and not (player_name and identity_id):
+        return None
+    return PlayerEvent(action, player_id, player_name.strip(), identity_id)
+
+
+def parse_log_buffer(text: str) -> list:
+    """
+    Returns every player event in a block of complete log lines.
+    """
+    if PLAYER_EVENT_MARKER not in text:
+        return []
+    return [
+        PlayerEvent(action, player_id, player_name.strip(), identity_id)
+        for action, player_id, player_name, identity_id in PLAYER_EVENT_PATTERN.findall(text)
+        if action == PLAYER_LEFT_ACTION or (player_name and identity_id)
+    ]
+
+
+class DecisionCache:
+    """
+    Bounded LRU cache of whitelist decisions keyed by PlayerId and IdentityId.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 300.0) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, player_id: str, identity_id: str) -> bool:
+        """
+        Returns the cached decision, or None if there is no fresh entry.
+        """
+        key = (player_id, identity_id.lower())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            is_whitelisted, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return is_whitelisted
+
+    def put(self, player_id: str, identity_id: str, is_whitelisted: bool) -> None:
+        key = (player_id, identity_id.lower())
+        with self._lock:
+            self._entries[key] = (is_whitelisted, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class PersistentDecisionCache:
+    """
+    SQLite sidecar that remembers decisions across restarts and between
+    processes, tagged with the version of the whitelist they were made against
+    (WhitelistStore.version). Decisions from an older version are revalidated
+    on a background thread.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS decisions (
+            whitelist TEXT NOT NULL,
+            identity_id TEXT NOT NULL,
+            player_name TEXT NOT NULL,
+            whitelisted INTEGER NOT NULL,
+            version TEXT NOT NULL,
+            checked REAL NOT NULL,
+            PRIMARY KEY (whitelist, identity_id, player_name)
+        ) WITHOUT ROWID
+        """
+    SELECT_QUERY = """
+        SELECT whitelisted, version
+        FROM decisions
+        WHERE whitelist = ? AND identity_id = ? AND player_name = ?
+        """
+    UPSERT_QUERY = """
+        INSERT OR REPLACE INTO decisions
+            (whitelist, identity_id, player_name, whitelisted, version, checked)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """
+
+    def __init__(
+        self,
+        cache_path: str,
+        max_age: float = 7 * 86400.0,
+        revalidate_delay: float = 1.0,
+    ) -> None:
+        self.cache_path = cache_path
+        self.max_age = max_age
+        self.revalidate_delay = revalidate_delay
+        self._revalidating = set()
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        with self._conn:
+            self._conn.execute(self.SCHEMA)
+            pruned = self._conn.execute(
+                "DELETE FROM decisions WHERE checked < ?", (time.time() - max_age,)
+            ).rowcount
+        logging.info(
+            "Using decision cache %s, pruned %s old decisions.", cache_path, pruned
+        )
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._run, name="DecisionCacheThread", daemon=True
+        )
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.cache_path, timeout=5.0, check_same_thread=False)
+        # WAL lets other processes read while one of them writes.
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    @staticmethod
+    def _key(whitelist_type: str, whitelist_path: str) -> str:
+        return "%s:%s" % (whitelist_type, os.path.abspath(whitelist_path))
+
+    def get(
+        self, whitelist_type: str, whitelist_path: str, player_name: str, identity_id: str
+    ) -> tuple:
+        """
+        Returns the remembered decision and whether it was made against the
+        current whitelist version, or None if there is none.
+        """
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    self.SELECT_QUERY,
+                    (
+                        self._key(whitelist_type, whitelist_path),
+                        identity_id.lower(),
+                        player_name.lower(),
+                    ),
+                ).fetchone()
+        except sqlite3.Error as e:
+            logging.warning("Unable to read decision cache: %s", e)
+            return None
+        if row is None:
+            return None
+        whitelisted, version = row
+        current = get_whitelist_store(whitelist_type, whitelist_path).version()
+        return bool(whitelisted), version == current
+
+    def put(
+        self,
+        whitelist_type: str,
+        whitelist_path: str,
+        player_name: str,
+        identity_id: str,
+        is_whitelisted: bool,
+        version: str,
+    ) -> None:
+        """
+        Queues a decision made against the given version for writing.
+        """
+        self._queue.put(
+            (
+                "put",
+                (
+                    self._key(whitelist_type, whitelist_path),
+                    identity_id.lower(),
+                    player_name.lower(),
+                    int(is_whitelisted),
+                    version,
+                    time.time(),
+                ),
+            )
+        )
+
+    def revalidate(
+        self, whitelist_type: str, whitelist_path: str, player_name: str, identity_id: str
+    ) -> None:
+        """
+        Queues a stale decision to be looked up again.
+        """
+        player = (whitelist_type, whitelist_path, player_name, identity_id.lower())
+        with self._lock:
+            if player in self._revalidating:
+                return
+            self._revalidating.add(player)
+        self._queue.put(("revalidate", player, time.monotonic() + self.revalidate_delay))
+
+    def _run(self) -> None:
+        conn = self._connect()
+        # Stale decisions waiting to be looked up again, as (due, player). The
+        # delay batches a warm start's first wave into one lookup, and gives the
+        # join that was let in time to reach the roster before it is re-checked.
+        pending = []
+        while True:
+            timeout = max(0.0, pending[0][0] - time.monotonic()) if pending else None
+            items = []
+            try:
+                items.append(self._queue.get(timeout=timeout))
+                while True:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            rows = [item[1] for item in items if item is not None and item[0] == "put"]
+            pending.extend(
+                (item[2], item[1])
+                for item in items
+                if item is not None and item[0] == "revalidate"
+            )
+            try:
+                if rows:
+                    with conn:
+                        conn.executemany(self.UPSERT_QUERY, rows)
+                if None in items:
+                    break
+                now = time.monotonic()
+                due = [player for due, player in pending if due <= now]
+                if due:
+                    pending = [entry for entry in pending if entry[0] > now]
+                    self._revalidate(conn, due)
+            except Exception:
+                logging.exception("Error updating decision cache")
+        conn.close()
+
+    def _revalidate(self, conn: sqlite3.Connection, players: list) -> None:
+        """
+        Looks stale decisions up again and kicks connected players who were
+        let in on a decision that no longer holds.
+        """
+        groups = {}
+        for whitelist_type, whitelist_path, player_name, identity_id in players:
+            groups.setdefault((whitelist_type, whitelist_path), []).append(
+                (player_name, identity_id)
+            )
+        for (whitelist_type, whitelist_path), pairs in groups.items():
+            store = get_whitelist_store(whitelist_type, whitelist_path)
+            version = store.version()
+            try:
+                results = store.is_whitelisted_many(pairs)
+            except sqlite3.Error as database_error:
+                # Keep the stale decisions, the next join asks again.
+                logging.warning("Unable to revalidate decisions: %s", database_error)
+                results = None
+            finally:
+                with self._lock:
+                    self._revalidating.difference_update(
+                        (whitelist_type, whitelist_path, name, identity)
+                        for name, identity in pairs
+                    )
+            if results is None:
+                continue
+            # Results are only tagged if the whitelist did not change under the lookup.
+            if version is not None and store.version() == version:
+                key = self._key(whitelist_type, whitelist_path)
+                now = time.time()
+                with conn:
+                    conn.executemany(
+                        self.UPSERT_QUERY,
+                        [
+                            (key, identity, name.lower(), int(result), version, now)
+                            for (name, identity), result in zip(pairs, results)
+                        ],
+                    )
+            revoked = [pair for pair, result in zip(pairs, results) if not result]
+            logging.info(
+                "Revalidated %s remembered decisions, %s no longer whitelisted.",
+                len(pairs),
+                len(revoked),
+            )
+            if revoked:
+                # The roster enforcer re-checks and kicks the affected players.
+                store.notify_listeners(
+                    WhitelistChange(
+                        frozenset(),
+                        frozenset(name.lower() for name, _ in revoked),
+                        frozenset(),
+                        frozenset(identity for _, identity in revoked),
+                    )
+                )
+
+    def close(self) -> None:
+        """
+        Writes the queued decisions, then closes the sidecar.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        with self._lock:
+            self._conn.close()
+
+
+_persistent_decisions = None
+
+
+def set_persistent_decision_cache(cache_path: str) -> PersistentDecisionCache:
+    """
+    Remembers decisions in the SQLite sidecar at cache_path, or stops if it is None.
+    """
+    global _persistent_decisions
+    if _persistent_decisions is not None:
+        _persistent_decisions.close()
+        atexit.unregister(_persistent_decisions.close)
+    _persistent_decisions = (
+        PersistentDecisionCache(cache_path) if cache_path else None
+    )
+    if _persistent_decisions is not None:
+        atexit.register(_persistent_decisions.close)
+    return _persistent_decisions
+
+
+class RosterEntry:
+    """
+    A player connected to a server.
+    """
+
+    __slots__ = ("player_id", "player_name", "identity_id", "joined")
+
+    def __init__(self, player_id: str, player_name: str, identity_id: str, joined: float) -> None:
+        self.player_id = player_id
+        self.player_name = player_name
+        self.identity_id = identity_id
+        self.joined = joined
+
+
+class Roster:
+    """
+    Players currently connected to one server, indexed by name and identity.
+    """
+
+    def __init__(self) -> None:
+        self._players = {}
+        self._by_name = collections.defaultdict(set)
+        self._by_identity = collections.defaultdict(set)
+        self._lock = threading.Lock()
+
+    def join(self, event: PlayerEvent) -> None:
+        """
+        Adds or updates a whitelisted player.
+        """
+        with self._lock:
+            self._remove(event.player_id)
+            entry = RosterEntry(
+                event.player_id, event.player_name, event.identity_id, time.time()
+            )
+            self._players[event.player_id] = entry
+            self._by_name[event.player_name.lower()].add(event.player_id)
+            self._by_identity[event.identity_id.lower()].add(event.player_id)
+
+    def leave(self, player_id: str) -> None:
+        """
+        Removes a player who disconnected or was kicked.
+        """
+        with self._lock:
+            self._remove(player_id)
+
+    def _remove(self, player_id: str) -> None:
+        entry = self._players.pop(player_id, None)
+        if entry is None:
+            return
+        for index, key in (
+            (self._by_name, entry.player_name.lower()),
+            (self._by_identity, entry.identity_id.lower()),
+        ):
+            index[key].discard(player_id)
+            if not index[key]:
+                del index[key]
+
+    def matching(self, names: frozenset, identities: frozenset) -> list:
+        """
+        Returns the connected players with one of the given lowercased names or identities.
+        """
+        with self._lock:
+            player_ids = set()
+            for name in names:
+                player_ids.update(self._by_name.get(name, ()))
+            for identity_id in identities:
+                player_ids.update(self._by_identity.get(identity_id, ()))
+            return [self._players[player_id] for player_id in player_ids]
+
+    def entries(self) -> list:
+        with self._lock:
+            return list(self._players.values())
+
+    def __len__(self) -> int:
+        return len(self._players)
+
+
+REVOKED_ACTION = "Revoked"
+
+
+class RosterEnforcer:
+    """
+    Re-checks a server's connected players when the whitelist changes and
+    kicks the ones no longer whitelisted.
+    """
+
+    def __init__(
+        self,
+        whitelist_type: str,
+        whitelist_path: str,
+        rcon_host: str,
+        rcon_port: int,
+        rcon_password: str,
+    ) -> None:
+        self.whitelist_type = whitelist_type
+        self.whitelist_path = whitelist_path
+        self.rcon_host = rcon_host
+        self.rcon_port = rcon_port
+        self.rcon_password = rcon_password
+        self.roster = Roster()
+
+    def on_change(self, change: WhitelistChange) -> None:
+        """
+        Re-checks the players affected by a change, or everyone if the change is unknown.
+        """
+        if change is None:
+            entries = self.roster.entries()
+        else:
+            entries = self.roster.matching(
+                change.removed_names, change.removed_identities
+            )
+        if not entries:
+            return
+        events = [
+            PlayerEvent(REVOKED_ACTION, entry.player_id, entry.player_name, entry.identity_id)
+            for entry in entries
+        ]
+        decisions = check_players(events, self.whitelist_type, self.whitelist_path)
+        for event, decision in zip(events, decisions):
+            if decision.whitelisted:
+                continue
+            self.roster.leave(event.player_id)
+            enforce_decision(
+                event,
+                decision,
+                self.whitelist_type,
+                self.whitelist_path,
+                self.rcon_host,
+                self.rcon_port,
+                self.rcon_password,
+                time.monotonic(),
+            )
+
+
+_roster_enforcers = {}
+_roster_enforcers_lock = threading.Lock()
+
+
+def get_roster_enforcer(
+    whitelist_type: str,
+    whitelist_path: str,
+    rcon_host: str,
+    rcon_port: int,
+    rcon_password: str,
+) -> RosterEnforcer:
+    """
+    Returns the roster of a server, re-checked whenever its whitelist changes.
+    """
+    key = (whitelist_type, whitelist_path, rcon_host, rcon_port)
+    with _roster_enforcers_lock:
+        enforcer = _roster_enforcers.get(key)
+        if enforcer is None:
+            enforcer = RosterEnforcer(
+                whitelist_type, whitelist_path, rcon_host, rcon_port, rcon_password
+            )
+            # The decision cache registers its listener first, so it is
+            # cleared before the roster is re-checked.
+            get_decision_cache(whitelist_type, whitelist_path)
+            get_whitelist_store(whitelist_type, whitelist_path).add_listener(
+                enforcer.on_change
+            )
+            _roster_enforcers[key] = enforcer
+        return enforcer
+
+
+def scan_log_backlog(file_path: str, offset: int) -> tuple:
+    """
+    Returns the player events in the complete lines after offset, and the offset after them.
+    """
+    with open(file_path, "rb") as log_file:
+        size = os.fstat(log_file.fileno()).st_size
+        if size <= offset:
+            return [], offset
+        events = []
+        marker = PLAYER_EVENT_MARKER.encode("ascii")
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as backlog:
+            end = backlog.rfind(b"\n", offset, size)
+            if end < 0:
+                return [], offset
+            # Jump from marker to marker so only join lines are decoded and parsed.
+            position = backlog.find(marker, offset, end)
+            while position >= 0:
+                line_start = backlog.rfind(b"\n", offset, position) + 1
+                line_end = backlog.find(b"\n", position, end + 1)
+                event = parse_log_line(
+                    backlog[max(line_start, offset):line_end].decode("utf-8", errors="replace")
+                )
+                if event:
+                    events.append(event)
+                position = backlog.find(marker, line_end, end)
+        return events, end + 1
+
+
+def drop_departed_joins(events: list) -> list:
+    """
+    Drops the join events of players who disconnect later in the list, so a
+    backlog does not kick players who are no longer on the server.
+    """
+    departed = set()
+    kept = []
+    # Walk backwards so a PlayerId reused after a disconnect keeps its new join.
+    for event in reversed(events):
+        if event.action == PLAYER_LEFT_ACTION:
+            departed.add(event.player_id)
+        elif event.player_id in departed:
+            continue
+        kept.append(event)
+    kept.reverse()
+    return kept
+
+
+def resume_from_checkpoint(
+    file_path: str, checkpoint: Checkpoint, handle_event: callable
+) -> int:
+    """
+    Handles the joins written while the whitelist was not running and returns
+    the offset to tail from, or None to tail from the end of the file.
+    """
+    state = checkpoint.load()
+    if state is None:
+        return None
+    stat = os.stat(file_path)
+    # Compared as real paths, since a relative --base-log-dir and the absolute
+    # paths of a followed session name the same file differently.
+    if (
+        os.path.realpath(state["path"]) == os.path.realpath(file_path)
+        and state["inode"] == stat.st_ino
+        and state["offset"] <= stat.st_size
+    ):
+        offset = state["offset"]
+    else:
+        # The server moved on to a new log since the checkpoint, so every join
+        # in the current one happened while we were down.
+        offset = 0
+
+    events, resume_offset = scan_log_backlog(file_path, offset)
+    scanned = len(events)
+    events = drop_departed_joins(events)
+    logging.info(
+        "Caught up on %s bytes of %s with %s player events, skipping %s joins "
+        "of players who already left.",
+        resume_offset - offset,
+        file_path,
+        len(events),
+        scanned - len(events),
+    )
+    for event in events:
+        handle_event(event)
+    return resume_offset
+
+
+def get_whitelist_store(whitelist_type: str, whitelist_path: str) -> WhitelistStore:
+    """
+    Returns the shared store for the configured whitelist backend.
+    """
+    if whitelist_type == "database":
+        return get_database_whitelist(whitelist_path)
+    if whitelist_type == "json":
+        return get_json_whitelist(whitelist_path)
+    if whitelist_type == "snapshot":
+        return get_snapshot_whitelist(whitelist_path)
+    raise ValueError("Unknown whitelist type: %s" % whitelist_type)
+
+
+_decision_caches = {}
+_decision_caches_lock = threading.Lock()
+
+
+def get_decision_cache(whitelist_type: str, whitelist_path: str) -> DecisionCache:
+    """
+    Returns the decision cache for a whitelist, cleared whenever the whitelist changes.
+    """
+    key = (whitelist_type, whitelist_path)
+
+    def on_change(change: WhitelistChange) -> None:
+        cache.clear()
+
+    with _decision_caches_lock:
+        cache = _decision_caches.get(key)
+        if cache is None:
+            cache = DecisionCache()
+            try:
+                get_whitelist_store(whitelist_type, whitelist_path).add_listener(on_change)
+            except ValueError:
+                pass
+            _decision_caches[key] = cache
+        return cache
+
+
+def is_player_whitelisted(
+    player_name: str, identity_id: str, whitelist_type: str, whitelist_path: str
+) -> bool:
+    """
+    Checks the player against the configured whitelist backend.
+    """
+    if whitelist_type == "database":
+        return is_player_in_database(player_name, identity_id, whitelist_path)
+    if whitelist_type == "json":
+        return is_player_in_json(player_name, identity_id, whitelist_path)
+    if whitelist_type == "snapshot":
+        return is_player_in_snapshot(player_name, identity_id, whitelist_path)
+    raise ValueError("Unknown whitelist type: %s" % whitelist_type)
+
+
+def are_players_whitelisted(
+    players: list, whitelist_type: str, whitelist_path: str
+) -> list:
+    """
+    Checks a list of (player_name, identity_id) pairs against the configured
+    whitelist backend in one lookup, returning one bool per pair.
+    """
+    store = get_whitelist_store(whitelist_type, whitelist_path)
+    try:
+        results = store.is_whitelisted_many(players)
+    except sqlite3.Error as database_error:
+        logging.error("Database error: %s", database_error)
+        LOOKUP_ERRORS.inc()
+        return [False] * len(players)
+    logging.debug(
+        "Checked %s players against %s whitelist %s in one lookup.",
+        len(players),
+        whitelist_type,
+        whitelist_path,
+    )
+    return results
+
+
+class Decision(NamedTuple):
+    """
+    Whether a player is whitelisted and how the answer was found.
+    """
+
+    whitelisted: bool
+    cached: bool
+    lookup_seconds: float = None
+
+
+def cached_decision(
+    cache: DecisionCache,
+    whitelist_type: str,
+    whitelist_path: str,
+    player_id: str,
+    player_name: str,
+    identity_id: str,
+    use_persistent: bool = True,
+) -> bool:
+    """
+    Returns the decision from the in-memory cache or the persistent cache, or None on a miss.
+    """
+    is_whitelisted = cache.get(player_id, identity_id)
+    if is_whitelisted is not None:
+        DECISION_CACHE_REQUESTS.inc(labels=("hit",))
+        return is_whitelisted
+    if _persistent_decisions is not None and use_persistent:
+        remembered = _persistent_decisions.get(
+            whitelist_type, whitelist_path, player_name, identity_id
+        )
+        if remembered is not None:
+            is_whitelisted, current = remembered
+            if current:
+                DECISION_CACHE_REQUESTS.inc(labels=("warm",))
+                cache.put(player_id, identity_id, is_whitelisted)
+                return is_whitelisted
+            # Letting a player in on a stale decision is undone by the roster
+            # if revalidation disagrees, a kick cannot be taken back.
+            if is_whitelisted:
+                DECISION_CACHE_REQUESTS.inc(labels=("stale",))
+                _persistent_decisions.revalidate(
+                    whitelist_type, whitelist_path, player_name, identity_id
+                )
+                return True
+    DECISION_CACHE_REQUESTS.inc(labels=("miss",))
+    return None
+
+
+def remember_decision(
+    cache: DecisionCache,
+    whitelist_type: str,
+    whitelist_path: str,
+    player_id: str,
+    player_name: str,
+    identity_id: str,
+    is_whitelisted: bool,
+    version: str = None,
+) -> None:
+    """
+    Caches a looked up decision, and persists it if it was made against a known version.
+    """
+    cache.put(player_id, identity_id, is_whitelisted)
+    if _persistent_decisions is not None and version is not None:
+        _persistent_decisions.put(
+            whitelist_type, whitelist_path, player_name, identity_id, is_whitelisted, version
+        )
+
+
+def decision_version(whitelist_type: str, whitelist_path: str) -> str:
+    """
+    Returns the version of the whitelist lookups are answered from, or None
+    if decisions are not persisted. It is read before and after a lookup, and
+    the decision is only persisted if both reads agree.
+    """
+    if _persistent_decisions is None:
+        return None
+    return get_whitelist_store(whitelist_type, whitelist_path).version()
+
+
+def check_player(
+    player_id: str,
+    player_name: str,
+    identity_id: str,
+    whitelist_type: str,
+    whitelist_path: str,
+) -> Decision:
+    """
+    Returns the cached decision for the player's session, looking it up on a miss.
+    """
+    cache = get_decision_cache(whitelist_type, whitelist_path)
+    is_whitelisted = cached_decision(
+        cache, whitelist_type, whitelist_path, player_id, player_name, identity_id
+    )
+    if is_whitelisted is not None:
+        return Decision(is_whitelisted, True)
+
+    version = decision_version(whitelist_type, whitelist_path)
+    errors = LOOKUP_ERRORS.value()
+    started = time.perf_counter()
+    is_whitelisted = is_player_whitelisted(
+        player_name, identity_id, whitelist_type, whitelist_path
+    )
+    lookup_seconds = time.perf_counter() - started
+    LOOKUP_SECONDS.observe(lookup_seconds, (whitelist_type,))
+    if LOOKUP_ERRORS.value() != errors:
+        # A failed lookup is not a decision worth remembering across restarts.
+        version = None
+    elif version != decision_version(whitelist_type, whitelist_path):
+        # The whitelist changed under the lookup, so the answer may be from either version.
+        version = None
+    remember_decision(
+        cache,
+        whitelist_type,
+        whitelist_path,
+        player_id,
+        player_name,
+        identity_id,
+        is_whitelisted,
+        version,
+    )
+    return Decision(is_whitelisted, False, lookup_seconds)
+
+
+def check_players(
+    events: list, whitelist_type: str, whitelist_path: str
+) -> list:
+    """
+    Returns a Decision per join event, looking up all cache misses together.
+    """
+    cache = get_decision_cache(whitelist_type, whitelist_path)
+    decisions = [None] * len(events)
+    misses = {}
+    for index, event in enumerate(events):
+        is_whitelisted = cached_decision(
+            cache,
+            whitelist_type,
+            whitelist_path,
+            event.player_id,
+            event.player_name,
+            event.identity_id,
+            # A revocation re-check must come from the whitelist itself.
+            use_persistent=event.action != REVOKED_ACTION,
+        )
+        if is_whitelisted is not None:
+            decisions[index] = Decision(is_whitelisted, True)
+        else:
+            key = (event.player_id, event.identity_id.lower())
+            misses.setdefault(key, []).append(index)
+    if not misses:
+        return decisions
+
+    version = decision_version(whitelist_type, whitelist_path)
+    errors = LOOKUP_ERRORS.value()
+    lookups = [events[indexes[0]] for indexes in misses.values()]
+    started = time.perf_counter()
+    results = are_players_whitelisted(
+        [(event.player_name, event.identity_id) for event in lookups],
+        whitelist_type,
+        whitelist_path,
+    )
+    lookup_seconds = time.perf_counter() - started
+    LOOKUP_SECONDS.observe(lookup_seconds, (whitelist_type,))
+    if (
+        LOOKUP_ERRORS.value() != errors
+        or version != decision_version(whitelist_type, whitelist_path)
+    ):
+        version = None
+    for event, indexes, is_whitelisted in zip(lookups, misses.values(), results):
+        remember_decision(
+            cache,
+            whitelist_type,
+            whitelist_path,
+            event.player_id,
+            event.player_name,
+            event.identity_id,
+            is_whitelisted,
+            version,
+        )
+        for index in indexes:
+            decisions[index] = Decision(is_whitelisted, False, lookup_seconds)
+    return decisions
+
+
+def audit_fields(
+    event: PlayerEvent, decision: Decision, whitelist_type: str, server: str
+) -> dict:
+    """
+    Builds the audit record for a decision, without the kick outcome.
+    """
+    return {
+        "server": server,
+        "action": event.action,
+        "player_id": event.player_id,
+        "player": event.player_name,
+        "identity": event.identity_id,
+        "backend": whitelist_type,
+        "whitelisted": decision.whitelisted,
+        "cached": decision.cached,
+        "lookup_ms": (
+            None
+            if decision.lookup_seconds is None
+            else round(decision.lookup_seconds * 1000, 3)
+        ),
+    }
+
+
+def record_kick_result(result: KickResult, started: float, fields: dict) -> None:
+    """
+    Records the join-to-kick latency and audits the kick outcome.
+    """
+    if result.success:
+        JOIN_TO_KICK_SECONDS.observe(time.monotonic() - started)
+    audit(kick="success" if result.success else "failure", kick_error=result.error, **fields)
+
+
+def enforce_decision(
+    event: PlayerEvent,
+    decision: Decision,
+    whitelist_type: str,
+    whitelist_path: str,
+    rcon_host: str,
+    rcon_port: int,
+    rcon_password: str,
+    started: float,
+) -> None:
+    """
+    Logs and audits a decision, kicking the player if they are not whitelisted.
+    """
+    action, player_id, player_name, identity_id = event
+    logging.info(
+        "%s Player - ID: %s, Name: %s, IdentityId: %s",
+        action,
+        player_id,
+        player_name,
+        identity_id,
+    )
+    fields = audit_fields(
+        event, decision, whitelist_type, "%s:%s" % (rcon_host, rcon_port)
+    )
+
+    if not decision.whitelisted:
+        logging.warning(
+            "Player: %s with IdentityId: %s is NOT whitelisted! Kicking...",
+            player_name,
+            identity_id,
+        )
+        get_roster_enforcer(
+            whitelist_type, whitelist_path, rcon_host, rcon_port, rcon_password
+        ).roster.leave(player_id)
+        kick = execute_kick_command(player_id, rcon_host, rcon_port, rcon_password)
+        if isinstance(kick, concurrent.futures.Future):
+            kick.add_done_callback(
+                lambda future: record_kick_result(future.result(), started, fields)
+            )
+    else:
+        logging.info(
+            "Player: %s with IdentityId: %s is whitelisted!",
+            player_name,
+            identity_id,
+        )
+        audit(**fields)
+        get_roster_enforcer(
+            whitelist_type, whitelist_path, rcon_host, rcon_port, rcon_password
+        ).roster.join(event)
+
+
+def handle_player_event(
+    event: PlayerEvent,
+    whitelist_type: str,
+    whitelist_path: str,
+    rcon_host: str,
+    rcon_port: int,
+    rcon_password: str,
+) -> None:
+    """
+    Checks a join event against the whitelist and kicks the player if needed.
+    """
+    started = time.monotonic()
+    if event.action == PLAYER_LEFT_ACTION:
+        apply_player_events(
+            [(event, (rcon_host, rcon_port, rcon_password), started)],
+            whitelist_type,
+            whitelist_path,
+        )
+        return
+    try:
+        decision = check_player(
+            event.player_id,
+            event.player_name,
+            event.identity_id,
+            whitelist_type,
+            whitelist_path,
+        )
+    except ValueError as type_error:
+        logging.error(type_error)
+        return
+    enforce_decision(
+        event,
+        decision,
+        whitelist_type,
+        whitelist_path,
+        rcon_host,
+        rcon_port,
+        rcon_password,
+        started,
+    )
+
+
+def apply_player_events(
+    items: list,
+    whitelist_type: str,
+    whitelist_path: str,
+    decisions: list = None,
+) -> None:
+    """
+    Looks up the joins among (event, (rcon_host, rcon_port, rcon_password), started)
+    items together, unless their decisions are given, then enforces them and
+    applies disconnects in log order.
+    """
+    if decisions is None:
+        joins = [event for event, _, _ in items if event.action != PLAYER_LEFT_ACTION]
+        decisions = check_players(joins, whitelist_type, whitelist_path) if joins else ()
+    decisions = iter(decisions)
+    for event, rcon, started in items:
+        if event.action == PLAYER_LEFT_ACTION:
+            logging.info("Player disconnected - ID: %s", event.player_id)
+            get_roster_enforcer(whitelist_type, whitelist_path, *rcon).roster.leave(
+                event.player_id
+            )
+        else:
+            enforce_decision(
+                event, next(decisions), whitelist_type, whitelist_path, *rcon, started
+            )
+
+
+def handle_player_events(
+    events: list,
+    whitelist_type: str,
+    whitelist_path: str,
+    rcon_host: str,
+    rcon_port: int,
+    rcon_password: str,
+    started: float = None,
+) -> None:
+    """
+    Checks several player events with one whitelist lookup and kicks players as needed.
+    """
+    if started is None:
+        started = time.monotonic()
+    rcon = (rcon_host, rcon_port, rcon_password)
+    try:
+        apply_player_events(
+            [(event, rcon, started) for event in events], whitelist_type, whitelist_path
+        )
+    except ValueError as type_error:
+        logging.error(type_error)
+
+
+class JoinCoalescer:
+    """
+    Groups join events arriving within a short window so each group costs one lookup.
+    """
+
+    def __init__(
+        self,
+        whitelist_type: str,
+        whitelist_path: str,
+        window: float = 0.01,
+        max_batch: int = 256,
+    ) -> None:
+        self.whitelist_type = whitelist_type
+        self.whitelist_path = whitelist_path
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._after_batch = []
+        self.batches = 0
+
+    def add(
+        self, events: list, rcon_host: str, rcon_port: int, rcon_password: str
+    ) -> None:
+        """
+        Queues join events read from the log of the given server.
+        """
+        added = time.monotonic()
+        for event in events:
+            self._queue.put((event, (rcon_host, rcon_port, rcon_password), added))
+
+    def after_handled(self, callback: callable) -> None:
+        """
+        Runs the callback once every event queued before it has been handled.
+        """
+        self._queue.put(callback)
+
+    def start(self) -> None:
+        """
+        Starts the lookup thread.
+        """
+        if self._thread is not None:
+            return
+        name = "coalesce:%s" % self.whitelist_path
+        _active_queues[name] = self._queue.qsize
+        _active_stages[name] = (lambda: self.batches, self._queue.qsize, self.revive)
+        self._start_thread()
+
+    def _start_thread(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="CoalesceThread", daemon=True
+        )
+        self._thread.start()
+
+    def revive(self) -> None:
+        """
+        Starts a new lookup thread if the current one has died.
+        """
+        if self._thread is None or self._thread.is_alive():
+            return
+        logging.warning("Lookup thread died, starting a new one.")
+        self._start_thread()
+
+    def stop(self) -> None:
+        """
+        Handles the queued events, then stops the lookup thread.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        _active_queues.pop("coalesce:%s" % self.whitelist_path, None)
+        _active_stages.pop("coalesce:%s" % self.whitelist_path, None)
+
+    def _next_batch(self) -> tuple:
+        """
+        Waits for an event, then collects whatever else arrives within the window.
+        Returns the batch and whether the coalescer was asked to stop.
+        """
+        batch = []
+        deadline = None
+        while len(batch) < self.max_batch:
+            try:
+                if deadline is None:
+                    item = self._queue.get()
+                elif deadline > time.monotonic():
+                    item = self._queue.get(timeout=deadline - time.monotonic())
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            if callable(item):
+                if not batch:
+                    # Every earlier event is handled already.
+                    self._run_callback(item)
+                    continue
+                # The batch ends here, so the callback runs right after it.
+                self._after_batch.append(item)
+                break
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.window
+        return batch, False
+
+    def _run_callback(self, callback: callable) -> None:
+        try:
+            callback()
+        except Exception:
+            logging.exception("Error in join handled callback")
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if batch:
+                try:
+                    apply_player_events(batch, self.whitelist_type, self.whitelist_path)
+                except Exception:
+                    logging.exception("Error handling %s join events", len(batch))
+                self.batches += 1
+            for callback in self._after_batch:
+                self._run_callback(callback)
+            self._after_batch.clear()
+
+
+def process_log_line(
+    line: str,
+    whitelist_type: str,
+    whitelist_path: str,
+    rcon_host: str,
+    rcon_port: int,
+    rcon_password: str,
+) -> None:
+    """
+    Processes and checks the line of the log, passes it for checks if it is a player join event.
+    """
+    event = parse_log_line(line)
+    if event:
+        handle_player_event(
+            event, whitelist_type, whitelist_path, rcon_host, rcon_port, rcon_password
+        )
+
+
+def process_log_lines(
+    text: str,
+    whitelist_type: str,
+    whitelist_path: str,
+    rcon_host: str,
+    rcon_port: int,
+    rcon_password: str,
+) -> None:
+    """
+    Processes a block of complete log lines, checking all player join events in it together.
+    """
+    events = parse_log_block(text)
+    if events:
+        handle_player_events(
+            events, whitelist_type, whitelist_path, rcon_host, rcon_port, rcon_password
+        )
+
+
+def parse_log_block(text: str) -> list:
+    """
+    Parses a block of complete log lines, recording the parse time and the last join.
+    """
+    global _last_join
+
+    started = time.perf_counter()
+    events = parse_log_buffer(text)
+    PARSE_SECONDS.observe(time.perf_counter() - started)
+    for event in reversed(events):
+        if event.action != PLAYER_LEFT_ACTION:
+            _last_join = (time.monotonic(), event.player_name)
+            break
+    return events
+
+
+class AsyncRconProtocol(asyncio.DatagramProtocol):
+    """
+    asyncio datagram protocol for a BattlEye RCON session.
+    """
+
+    def __init__(self) -> None:
+        self.transport = None
+        self.login_future = None
+        self.pending = {}
+        self._parts = {}
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        try:
+            response = parse_rcon_packet(data)
+        except (KeyError, ValueError):
+            logging.warning("Ignoring malformed RCON packet from %s", addr)
+            return
+
+        if isinstance(response, LoginResponse):
+            if self.login_future is not None and not self.login_future.done():
+                self.login_future.set_result(response.success)
+        elif isinstance(response, ServerMessage):
+            self.transport.sendto(bytes(ServerMessageAck(response.seq)))
+        else:
+            future = self.pending.get(response.seq)
+            if future is None or future.done():
+                return
+            payload = merge_response_part(
+                self._parts.setdefault(response.seq, {}), response.payload
+            )
+            if payload is None:
+                return
+            del self._parts[response.seq]
+            future.set_result(payload.decode("ascii", errors="replace"))
+
+    def error_received(self, exc: Exception) -> None:
+        self._fail(exc)
+
+    def connection_lost(self, exc: Exception) -> None:
+        self._fail(exc or ConnectionError("RCON connection closed"))
+
+    def _fail(self, exc: Exception) -> None:
+        """
+        Fails every waiting request with the given error.
+        """
+        futures = list(self.pending.values())
+        if self.login_future is not None:
+            futures.append(self.login_future)
+        for future in futures:
+            if not future.done():
+                future.set_exception(exc)
+
+
+class AsyncRconClient:
+    """
+    Long-lived BattlEye RCON session for the asyncio runtime.
+    """
+
+    def __init__(
+        self,
+        rcon_host: str,
+        rcon_port: int,
+        rcon_password: str,
+        timeout: float = 5.0,
+        keepalive_interval: float = 30.0,
+        kick_attempts: int = 3,
+        max_backoff: float = 60.0,
+        command_rate: float = 10.0,
+        command_burst: int = 20,
+        retry_delay: float = 1.0,
+    ) -> None:
+        self.rcon_host = rcon_host
+        self.rcon_port = rcon_port
+        self.rcon_password = rcon_password
+        self.timeout = timeout
+        self.keepalive_interval = keepalive_interval
+        self.kick_attempts = kick_attempts
+        self.max_backoff = max_backoff
+        self.retry_delay = retry_delay
+        self.bucket = TokenBucket(command_rate, command_burst)
+        self._protocol = None
+        self._seq = 0
+        self._backoff = 0.0
+        self._lock = asyncio.Lock()
+        # Commands sent, for the watchdog.
+        self.commands = 0
+
+    async def _connect(self) -> None:
+        """
+        Opens the datagram endpoint and logs in.
+        """
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            AsyncRconProtocol, remote_addr=(self.rcon_host, self.rcon_port)
+        )
+        protocol.login_future = loop.create_future()
+        transport.sendto(bytes(LoginRequest(self.rcon_password)))
+        try:
+            success = await asyncio.wait_for(protocol.login_future, self.timeout)
+        except BaseException:
+            transport.close()
+            raise
+        if not success:
+            transport.close()
+            raise WrongPassword()
+        self._protocol = protocol
+        self._seq = 0
+        self._backoff = 0.0
+        logging.info(
+            "RCON session established with %s:%s",
+            self.rcon_host,
+            self.rcon_port,
+        )
+
+    async def _command(self, command: str) -> str:
+        """
+        Sends a command on the open session and waits for its response.
+        """
+        if self._protocol is None:
+            if self._backoff:
+                await asyncio.sleep(self._backoff)
+            try:
+                await self._connect()
+            except Exception:
+                self._backoff = min(self.max_backoff, max(1.0, self._backoff * 2))
+                raise
+        protocol = self._protocol
+        seq = self._seq
+        self._seq = (seq + 1) % 256
+        future = asyncio.get_running_loop().create_future()
+        protocol.pending[seq] = future
+        protocol.transport.sendto(bytes(CommandRequest(seq, command)))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            protocol.pending.pop(seq, None)
+
+    async def command(self, command: str) -> str:
+        """
+        Runs a command, dropping the session if it fails.
+        """
+        async with self._lock:
+            try:
+                return await self._command(command)
+            except Exception:
+                self.close()
+                raise
+            finally:
+                self.commands += 1
+
+    def state(self) -> str:
+        """
+        Describes the session for the heartbeat.
+        """
+        if self._protocol is not None:
+            return "connected"
+        if self._backoff:
+            return "reconnecting, backing off %.0fs" % self._backoff
+        return "not connected"
+
+    async def kick(self, player_id: str) -> KickResult:
+        """
+        Runs the kick command once, within the command rate limit.
+        """
+        wait = self.bucket.reserve()
+        if wait > 0:
+            RCON_THROTTLE_SECONDS.inc(wait)
+            await asyncio.sleep(wait)
+        try:
+            await self.command("#kick %s" % player_id)
+        except Exception as e:
+            return KickResult(player_id, False, str(e))
+        logging.info(
+            "Successfully executed kick command for player ID %s",
+            player_id,
+        )
+        return KickResult(player_id, True)
+
+    async def keepalive(self) -> None:
+        """
+        Sends an empty command whenever the session has been idle.
+        """
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            try:
+                await self.command("")
+            except Exception as e:
+                logging.warning("RCON keepalive failed: %s", e)
+
+    def close(self) -> None:
+        """
+        Closes the datagram endpoint if it is open.
+        """
+        if self._protocol is not None:
+            self._protocol.transport.close()
+            self._protocol = None
+
+
+async def read_log_lines_async(
+    file_path: str,
+    join_queue: asyncio.Queue,
+    poll_interval: float = 0.05,
+    checkpoint: Checkpoint = None,
+) -> None:
+    """
+    Follows the log file and puts parsed join events on the join queue.
+    """
+    events = []
+    offset = None
+    if checkpoint is not None:
+        offset = await asyncio.get_running_loop().run_in_executor(
+            None,
+            resume_from_checkpoint,
+            file_path,
+            checkpoint,
+            lambda event: events.append((event, time.monotonic())),
+        )
+
+    def collect_events(text: str) -> None:
+        parsed = parse_log_block(text)
+        read_at = time.monotonic()
+        events.extend((event, read_at) for event in parsed)
+
+    # Checkpoint saves follow the events on the join queue, so the lookup
+    # stage runs them once everything read before them is handled.
+    saves = []
+    tailer = LogTailer(
+        file_path,
+        collect_events,
+        batch=True,
+        checkpoint=checkpoint,
+        after_handled=saves.append,
+    )
+    tailer.open(offset)
+    # inotify wakes the loop directly; polling is only the fallback.
+    tailer.watch(poll_interval)
+    try:
+        while True:
+            if not events and not tailer.poll():
+                await tailer.wait_async()
+                continue
+            tailer.save_checkpoint()
+            for item in events + saves:
+                # put() waits while the lookup stage is behind.
+                await join_queue.put(item)
+            events.clear()
+            saves.clear()
+    finally:
+        tailer.unwatch()
+        tailer.close()
+
+
+async def next_join_batch(
+    join_queue: asyncio.Queue, window: float, max_batch: int
+) -> list:
+    """
+    Waits for a join event, then collects whatever else arrives within the window.
+    """
+    batch = [await join_queue.get()]
+    deadline = time.monotonic() + window
+    while len(batch) < max_batch:
+        timeout = deadline - time.monotonic()
+        try:
+            if timeout > 0:
+                batch.append(await asyncio.wait_for(join_queue.get(), timeout))
+            else:
+                batch.append(join_queue.get_nowait())
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            break
+    return batch
+
+
+class AsyncKickQueue(KickQueue):
+    """
+    Kick queue of the asyncio runtime, drained over one RCON session on the event loop.
+    """
+
+    def __init__(
+        self,
+        client: AsyncRconClient,
+        loop: asyncio.AbstractEventLoop,
+        max_queue: int = 1024,
+    ) -> None:
+        super().__init__(client.kick_attempts, client.max_backoff, client.retry_delay)
+        self.client = client
+        self.loop = loop
+        self.queue = asyncio.PriorityQueue(maxsize=max_queue)
+
+    def _submit(self, item: tuple) -> None:
+        # Kicks can be queued from lookup threads as well as from the loop.
+        self.loop.call_soon_threadsafe(self._put, item)
+
+    def _put(self, item: tuple) -> None:
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._drop(item)
+
+    async def run(self) -> None:
+        """
+        Drains the kick queue over the RCON session, fresh kicks ahead of retries.
+        """
+        while True:
+            item = await self.queue.get()
+            _, _, player_id, future, queued, _ = item
+            try:
+                result = await self.client.kick(player_id)
+                retry = self._retry(item, result)
+                if retry is not None:
+                    delay, retry_item = retry
+                    self.loop.call_later(delay, self._put, retry_item)
+                    continue
+                self._finish(player_id, future, queued, result)
+            finally:
+                self.queue.task_done()
+
+
+# Joins per executor lookup when a batch is fanned out, so small batches stay
+# one lookup.
+LOOKUP_CHUNK_SIZE = 64
+
+
+async def lookup_players_async(
+    join_queue: asyncio.Queue,
+    executor: concurrent.futures.Executor,
+    whitelist_type: str,
+    whitelist_path: str,
+    rcon: tuple,
+    coalesce_window: float = 0.01,
+    max_batch: int = 256,
+    lookup_workers: int = 4,
+) -> None:
+    """
+    Takes coalesced batches off the join queue one at a time, fans each batch's
+    lookups out to the executor and enforces the decisions in log order.
+    Checkpoint saves on the queue run after the batch they arrived in.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        items = await next_join_batch(join_queue, coalesce_window, max_batch)
+        batch = [item for item in items if not callable(item)]
+        joins = [event for event, _ in batch if event.action != PLAYER_LEFT_ACTION]
+        size = max(LOOKUP_CHUNK_SIZE, -(-len(joins) // lookup_workers))
+        try:
+            chunks = await asyncio.gather(
+                *(
+                    loop.run_in_executor(
+                        executor,
+                        check_players,
+                        joins[index:index + size],
+                        whitelist_type,
+                        whitelist_path,
+                    )
+                    for index in range(0, len(joins), size)
+                )
+            )
+            apply_player_events(
+                [(event, rcon, read_at) for event, read_at in batch],
+                whitelist_type,
+                whitelist_path,
+                [decision for chunk in chunks for decision in chunk],
+            )
+        except ValueError as type_error:
+            logging.error(type_error)
+        finally:
+            for _ in items:
+                join_queue.task_done()
+        # Not reached if the task is cancelled before the batch is handled.
+        for item in items:
+            if callable(item):
+                item()
+
+
+async def run_async_pipeline(
+    file_path: str,
+    whitelist_type: str,
+    whitelist_path: str,
+    rcon_host: str,
+    rcon_port: int,
+    rcon_password: str,
+    lookup_workers: int = 4,
+    queue_size: int = 1024,
+    executor: concurrent.futures.Executor = None,
+    checkpoint: Checkpoint = None,
+    coalesce_window: float = 0.01,
+) -> None:
+    """
+    Runs tail, lookup and kick as concurrent tasks joined by bounded queues.
+    """
+    join_queue = asyncio.Queue(maxsize=queue_size)
+    client = AsyncRconClient(
+        rcon_host,
+        rcon_port,
+        rcon_password,
+        **{
+            name: value
+            for name, value in _rcon_options.items()
+            if name in ("kick_attempts", "command_rate", "command_burst", "retry_delay")
+        },
+    )
+    owns_executor = executor is None
+    if owns_executor:
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=lookup_workers, thread_name_prefix="LookupThread"
+        )
+    kicks = AsyncKickQueue(client, asyncio.get_running_loop(), queue_size)
+    server = "%s:%s" % (rcon_host, rcon_port)
+    _active_queues["join:%s" % file_path] = join_queue.qsize
+    _active_queues["async_kick:%s" % server] = kicks.queue.qsize
+    # A stalled lookup stage fills the join queue and stops the tailer, so the
+    # tail stage covers it.
+    _active_stages["async_kick:%s" % server] = (
+        lambda: client.commands,
+        kicks.queue.qsize,
+        None,
+    )
+    _rcon_states[server] = client.state
+    # Joins and whitelist revocations both kick through this runtime's session.
+    register_kick_queue(rcon_host, rcon_port, rcon_password, kicks)
+    tasks = [
+        asyncio.create_task(
+            read_log_lines_async(file_path, join_queue, checkpoint=checkpoint)
+        ),
+        asyncio.create_task(kicks.run()),
+        asyncio.create_task(client.keepalive()),
+        asyncio.create_task(
+            lookup_players_async(
+                join_queue,
+                executor,
+                whitelist_type,
+                whitelist_path,
+                (rcon_host, rcon_port, rcon_password),
+                coalesce_window,
+                lookup_workers=lookup_workers,
+            )
+        ),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        _active_queues.pop("join:%s" % file_path, None)
+        _active_queues.pop("async_kick:%s" % server, None)
+        _active_stages.pop("async_kick:%s" % server, None)
+        _rcon_states.pop(server, None)
+        register_kick_queue(rcon_host, rcon_port, rcon_password, None)
+        client.close()
+        if owns_executor:
+            executor.shutdown(wait=False)
+
+
+def load_servers_config(config_path: str) -> dict:
+    """
+    Reads and validates a configuration file. Besides option values it can
+    list several servers to guard from one process.
     """
-    log_file = os.path.join(log_directory, "whitelist.log")
-
-    if not os.path.exists(log_directory):
-        os.makedirs(log_directory)
+    with open(config_path, "r", encoding="utf-8") as file:
+        config = json.load(file)
 
-    file_handler = logging.FileHandler(log_file, mode="a")
-    file_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-    file_handler.setFormatter(file_formatter)
+    if config.get("whitelist_type") not in (None, "database", "json", "snapshot"):
+        raise ValueError("Unknown whitelist type: %s" % config["whitelist_type"])
+    servers = config.get("servers")
+    if servers is not None and not servers:
+        raise ValueError("No servers defined in %s" % config_path)
+    for index, server in enumerate(servers or ()):
+        missing = [
+            key
+            for key in ("base_log_dir", "rcon_host", "rcon_port", "rcon_password")
+            if key not in server
+        ]
+        if missing:
+            raise ValueError(
+                "Server %s in %s is missing %s" % (index, config_path, ", ".join(missing))
+            )
+        server["rcon_port"] = int(server["rcon_port"])
+        server.setdefault("name", "%s:%s" % (server["rcon_host"], server["rcon_port"]))
+    return config
 
-    console_handler = logging.StreamHandler()
-    console_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-    console_handler.setFormatter(console_formatter)
 
-    logging.basicConfig(level=logging.INFO, handlers=[file_handler, console_handler])
+def option_defaults(
+    parser: argparse.ArgumentParser, config: dict = None, environ: dict = None
+) -> dict:
+    """
+    Returns option defaults from the config file, overridden by WHITELIST_*
+    environment variables. Options given on the command line override both.
+    """
+    environ = os.environ if environ is None else environ
+    defaults = {}
+    for action in parser._actions:
+        if not action.option_strings or action.dest == "help":
+            continue
+        value = (config or {}).get(action.dest)
+        # --whitelist-type is read from WHITELIST_TYPE, --rcon-host from WHITELIST_RCON_HOST.
+        name = "WHITELIST_%s" % re.sub(r"^whitelist_", "", action.dest).upper()
+        value = environ.get(name, value)
+        if value is None:
+            continue
+        if action.nargs == 0:
+            if not isinstance(value, bool):
+                value = str(value).lower() in ("1", "true", "yes", "on")
+        else:
+            # String defaults go through the option's type like command line values.
+            value = str(value)
+            if action.choices and value not in action.choices:
+                raise ValueError(
+                    "%s must be one of %s" % (action.dest, ", ".join(action.choices))
+                )
+        defaults[action.dest] = value
+    return defaults
 
 
-def heartbeat(count: int) -> None:
+def server_checkpoint(log_directory: str, server_name: str = None) -> Checkpoint:
     """
-    Initiates the heartbeat for application whilst it is running.
+    Returns the checkpoint for a server, kept next to whitelist.log.
     """
-    while True:
-        logging.info("Whitelist is running...")
-        time.sleep(count)
+    if server_name is None:
+        return Checkpoint(os.path.join(log_directory, "checkpoint.json"))
+    return Checkpoint(
+        os.path.join(
+            log_directory,
+            "checkpoint-%s.json" % re.sub(r"[^A-Za-z0-9_.-]", "_", server_name),
+        )
+    )
 
 
-def find_latest_log_dir(base_log_dir: str) -> str:
+def run_servers(
+    servers: list,
+    whitelist_type: str,
+    whitelist_path: str,
+    use_async: bool = False,
+    log_directory: str = None,
+    coalesce_window: float = 0.01,
+) -> None:
     """
-    Used to find the latest game server log directory.
+    Guards several servers from one process with a shared whitelist index.
     """
-    dir_pattern = re.compile(r"logs_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}")
-    log_dirs = [
-        d
-        for d in os.listdir(base_log_dir)
-        if os.path.isdir(os.path.join(base_log_dir, d)) and dir_pattern.match(d)
-    ]
+    # Each server gets its own tailer and RCON session, while lookups go
+    # through the one index or connection cached per whitelist path.
+    targets = []
+    for server in servers:
+        console_log_path = find_latest_log_dir(server["base_log_dir"])
+        if not console_log_path:
+            logging.error(
+                "No recent log file found for server %s in %s",
+                server["name"],
+                server["base_log_dir"],
+            )
+            continue
+        logging.info("Monitoring server %s: %s", server["name"], console_log_path)
+        targets.append((server, console_log_path))
 
-    if not log_dirs:
-        return None
+    if not targets:
+        logging.error("No recent log file found to process.")
+        return
+
+    checkpoints = {
+        server["name"]: server_checkpoint(log_directory, server["name"])
+        if log_directory
+        else None
+        for server, console_log_path in targets
+    }
+
+    if use_async:
+        async def run_all():
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=4, thread_name_prefix="LookupThread"
+            ) as executor:
+                await asyncio.gather(
+                    *(
+                        run_async_pipeline(
+                            console_log_path,
+                            whitelist_type,
+                            whitelist_path,
+                            server["rcon_host"],
+                            server["rcon_port"],
+                            server["rcon_password"],
+                            executor=executor,
+                            checkpoint=checkpoints[server["name"]],
+                            coalesce_window=coalesce_window,
+                        )
+                        for server, console_log_path in targets
+                    )
+                )
+
+        asyncio.run(run_all())
+        return
+
+    # Joins from every server go through one coalescer, so a restart storm
+    # across servers is still looked up in as few rounds as possible.
+    coalescer = JoinCoalescer(whitelist_type, whitelist_path, coalesce_window)
+    coalescer.start()
+    tail_threads = []
+    try:
+        for server, console_log_path in targets:
+            rcon = (server["rcon_host"], server["rcon_port"], server["rcon_password"])
+            checkpoint = checkpoints[server["name"]]
+            offset = None
+            if checkpoint is not None:
+                offset = resume_from_checkpoint(
+                    console_log_path,
+                    checkpoint,
+                    lambda event, rcon=rcon: coalescer.add([event], *rcon),
+                )
+            tail_thread = threading.Thread(
+                target=tail_log_file,
+                args=(
+                    console_log_path,
+                    lambda text, rcon=rcon: coalescer.add(parse_log_block(text), *rcon),
+                ),
+                kwargs={
+                    "batch": True,
+                    "offset": offset,
+                    "checkpoint": checkpoint,
+                    "after_handled": coalescer.after_handled,
+                },
+                name="TailThread-%s" % server["name"],
+                daemon=True,
+            )
+            tail_thread.start()
+            tail_threads.append(tail_thread)
+        # Joining with a timeout keeps the main thread responsive to Ctrl+C.
+        while any(tail_thread.is_alive() for tail_thread in tail_threads):
+            for tail_thread in tail_threads:
+                tail_thread.join(timeout=1.0)
+    finally:
+        coalescer.stop()
 
-    latest_log_dir = max(
-        log_dirs, key=lambda d: datetime.datetime.strptime(d, "logs_%Y-%m-%d_%H-%M-%S")
+
+def migrate_db_command(argv: list) -> None:
+    """
+    Runs the opt-in schema migration for a database whitelist.
+    """
+    parser = argparse.ArgumentParser(
+        prog="Reforger Whitelist migrate-db",
+        description="Add the identity_id column and lookup indexes to a whitelist database.",
+    )
+    parser.add_argument(
+        "--wp", "--whitelist-path",
+        type=str,
+        required=True,
+        help="Path to the whitelist database.",
+        dest="whitelist_path",
     )
-    return os.path.join(base_log_dir, latest_log_dir, "console.log")
+    args = parser.parse_args(argv)
 
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    migrate_database(args.whitelist_path)
 
-def is_player_in_database(player_name: str, identity_id: str, db_path: str) -> bool:
+
+def compile_snapshot_command(argv: list) -> None:
     """
-    Checks if the player's identifier is in the database.
+    Compiles a JSON or database whitelist into a binary snapshot.
     """
-    try:
-        with sqlite3.connect(db_path) as conn:
-            cur = conn.cursor()
-            cur.execute(
-                """
-                SELECT whitelisted 
-                FROM user_data 
-                WHERE (LOWER(game_name) = LOWER(?) OR LOWER(game_name) = LOWER(?)) 
-                AND whitelisted = 1
-                """,
-                (player_name, identity_id),
-            )
-            is_whitelisted = cur.fetchone()
-            if is_whitelisted is not None:
-                logging.info(
-                    "Player %s or IdentityId %s found in database and is whitelisted." % (
-                        player_name,
-                        identity_id,
-                    )
-                )
-                return True
-            else:
-                logging.info(
-                    "Player %s or IdentityId %s not found in database or not whitelisted." % (
-                        player_name,
-                        identity_id,
-                    )
-                )
-                return False
-    except sqlite3.Error as database_error:
-        logging.error("Database error: %s" % database_error)
-        return False
+    parser = argparse.ArgumentParser(
+        prog="Reforger Whitelist compile-snapshot",
+        description="Compile a whitelist into a memory-mapped snapshot for the snapshot whitelist type.",
+    )
+    parser.add_argument(
+        "--wt", "--whitelist-type",
+        type=str,
+        required=True,
+        choices=["database", "json"],
+        help="Type of the source whitelist.",
+        dest="whitelist_type",
+    )
+    parser.add_argument(
+        "--wp", "--whitelist-path",
+        type=str,
+        required=True,
+        help="Path to the source whitelist.",
+        dest="whitelist_path",
+    )
+    parser.add_argument(
+        "--out", "--snapshot-path",
+        type=str,
+        required=True,
+        help="Path to write the snapshot to.",
+        dest="snapshot_path",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    compile_snapshot(args.whitelist_type, args.whitelist_path, args.snapshot_path)
 
 
-def is_player_in_json(player_name: str, identity_id: str, json_path: str) -> bool:
+def _transfer_parser(command: str, description: str) -> argparse.ArgumentParser:
     """
-    Checks if the player's identifier is in the JSON.
+    Returns the argument parser shared by the JSON and database transfer commands.
     """
-    try:
-        with open(json_path, "r", encoding="utf-8") as file:
-            data = json.load(file)
-            for player in data.get("players", []):
-                if (
-                    player_name.lower() == player.get("game_name", "").lower()
-                    or identity_id.lower() == player.get("identity_id", "").lower()
-                ):
-                    if player.get("whitelisted", 0) == 1:
-                        logging.info(
-                            "Player %s or IdentityId %s found in JSON and is whitelisted." % (
-                                player_name,
-                                identity_id,
-                            )
-                        )
-                        return True
-            logging.info(
-                "Player %s or IdentityId %s not found in JSON or not whitelisted." % (
-                    player_name,
-                    identity_id,
-                )
-            )
-            return False
-    except json.JSONDecodeError as json_error:
-        logging.error("JSON error: %s" % json_error)
-        return False
+    parser = argparse.ArgumentParser(
+        prog="Reforger Whitelist %s" % command, description=description
+    )
+    parser.add_argument(
+        "--json", "--json-path",
+        type=str,
+        required=True,
+        help="Path to the JSON whitelist.",
+        dest="json_path",
+    )
+    parser.add_argument(
+        "--db", "--database-path",
+        type=str,
+        required=True,
+        help="Path to the whitelist database.",
+        dest="db_path",
+    )
+    return parser
 
 
-def execute_kick_command(
-    player_id: str, rcon_host: str, rcon_port: int, rcon_password: str
-) -> None:
+def import_json_command(argv: list) -> None:
     """
-    Initiates the kick_thread IF a player is not whitelisted.
+    Replaces a database whitelist with the contents of a JSON whitelist.
     """
-    def kick_player():
-        """
-        Establishes a connection with BERCon and executes the kick command.
-        """
-        command = "#kick %s" % player_id
-        
-        try:
-            with Client(host=rcon_host, port=rcon_port, passwd=rcon_password) as client:
-                rsp = client.run(command=command)
-                client.close()
-            logging.info(
-                "Successfully executed kick command for player ID %s" % player_id
-            )
-        except Exception as e:
-            logging.error(
-                "Unexpected error executing kick command for player ID %s: %s" % (
-                    player_id,
-                    e
-                )
-            )
+    parser = _transfer_parser(
+        "import-json", "Bulk import a JSON whitelist into user_data, replacing its rows."
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=5000,
+        help="Rows inserted per executemany call.",
+        dest="batch_size",
+    )
+    args = parser.parse_args(argv)
 
-    kick_thread = threading.Thread(target=kick_player, name=f"KickThread-{player_id}")
-    kick_thread.start()
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    import_json_to_database(args.json_path, args.db_path, args.batch_size)
 
 
-def tail_log_file(file_path: str, callback: callable) -> None:
+def sync_json_command(argv: list) -> None:
     """
-    This functions grabs the last line of the log.
+    Brings a database whitelist in line with a JSON whitelist.
     """
-    try:
-        with open(file_path, "r", encoding="utf-8") as log_file:
-            log_file.seek(0, 2)
-            while True:
-                chunk = log_file.read(1024)
-                if not chunk:
-                    time.sleep(0.05)
-                    continue
-                for line in chunk.splitlines():
-                    callback(line)
-    except FileNotFoundError:
-        logging.error("Log file not found: %s" % file_path)
-    except Exception:
-        logging.exception("Error reading log file")
+    parser = _transfer_parser(
+        "sync-json", "Apply only the differences between a JSON whitelist and user_data."
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=5000,
+        help="Rows written per executemany call.",
+        dest="batch_size",
+    )
+    args = parser.parse_args(argv)
 
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    sync_json_to_database(args.json_path, args.db_path, args.batch_size)
 
-def process_log_line(
-    line: str,
-    whitelist_type: str,
-    whitelist_path: str,
-    rcon_host: str,
-    rcon_port: int,
-    rcon_password: str,
-) -> None:
+
+def export_json_command(argv: list) -> None:
     """
-    Processes and checks the line of the log, passes it for checks if it is a player join event.
+    Writes a database whitelist out as a JSON whitelist.
     """
-    match = re.search(
-        r"(Creating|Updating) player: PlayerId=(\d+), Name=([^,]+), IdentityId=([a-f0-9-]+)",
-        line,
+    parser = _transfer_parser(
+        "export-json", "Export user_data to a JSON whitelist."
     )
-    if match:
-        action, player_id, player_name, identity_id = match.groups()
-        player_name = player_name.strip()
-        logging.info(
-            "%s Player - ID: %s, Name: %s, IdentityId: %s" % (
-                action,
-                player_id,
-                player_name,
-                identity_id,
-            )
-        )
+    args = parser.parse_args(argv)
 
-        if whitelist_type == "database":
-            is_whitelisted = is_player_in_database(
-                player_name, identity_id, whitelist_path
-            )
-        elif whitelist_type == "json":
-            is_whitelisted = is_player_in_json(player_name, identity_id, whitelist_path)
-        else:
-            logging.error("Unknown whitelist type: %s" % whitelist_type)
-            return
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    export_database_to_json(args.db_path, args.json_path)
 
-        if not is_whitelisted:
-            logging.warning(
-                "Player: %s with IdentityId: %s is NOT whitelisted! Kicking..." % (
-                    player_name,
-                    identity_id,
-                )
-            )
-            execute_kick_command(player_id, rcon_host, rcon_port, rcon_password)
-        else:
-            logging.info(
-                "Player: %s with IdentityId: %s is whitelisted!" % (
-                    player_name,
-                    identity_id,
-                )
-            )
-    else:
-        logging.debug("Unmatched line: %s" % line)
 
+COMMANDS = {
+    "migrate-db": migrate_db_command,
+    "compile-snapshot": compile_snapshot_command,
+    "import-json": import_json_command,
+    "sync-json": sync_json_command,
+    "export-json": export_json_command,
+}
+
+
+def main(argv: list = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        COMMANDS[argv[0]](argv[1:])
+        return
 
-def main():
     parser = argparse.ArgumentParser(
         prog="Reforger Whitelist",
         description="Whitelist script to monitor logs and kick non-whitelisted players.",
@@ -272,43 +5153,37 @@ def main():
     parser.add_argument(
         "--wt", "--whitelist-type",
         type=str,
-        choices=["database", "json"],
-        required=True,
-        help="Type of whitelist to use (database or json).",
+        choices=["database", "json", "snapshot"],
+        help="Type of whitelist to use (database, json or snapshot).",
         dest="whitelist_type",
     )
     parser.add_argument(
         "--wp", "--whitelist-path",
         type=str,
-        required=True,
         help="Path to the whitelist file (database or JSON).",
         dest="whitelist_path",
     )
     parser.add_argument(
         "--bl", "--base-log-dir",
         type=str,
-        required=True,
         help="Base directory to look for log files for whitelist.",
         dest="base_log_dir",
     )
     parser.add_argument(
         "--rh", "--rcon-host", 
         type=str, 
-        required=True, 
         help="RCON host address.",
         dest="rcon_host",
     )
     parser.add_argument(
         "--rp", "--rcon-port", 
         type=int, 
-        required=True, 
         help="RCON port number.",
         dest="rcon_port",
     )
     parser.add_argument(
         "--rpw", "--rcon-password", 
         type=str, 
-        required=True, 
         help="RCON password.",
         dest="rcon_password",
     )
@@ -319,65 +5194,261 @@ def main():
         help="Interval in seconds when the application should log it's alive.",
         dest="heartbeat",
     )
+    parser.add_argument(
+        "--stall-seconds",
+        type=float,
+        default=60.0,
+        help="Flag pipeline stages that make no progress for this long (0 to disable the watchdog).",
+        dest="stall_seconds",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Start without asking to confirm the settings, for systemd and containers.",
+        dest="daemon",
+    )
+    parser.add_argument(
+        "--mp", "--metrics-port",
+        type=int,
+        help="Serve Prometheus metrics on this local port.",
+        dest="metrics_port",
+    )
+    parser.add_argument(
+        "--cw", "--coalesce-window",
+        type=float,
+        default=0.01,
+        help="Seconds to wait for more joins before looking them up together.",
+        dest="coalesce_window",
+    )
+    parser.add_argument(
+        "--kick-rate",
+        type=float,
+        help="Maximum RCON kick commands per second to each server (default 10, 0 for no limit).",
+        dest="kick_rate",
+    )
+    parser.add_argument(
+        "--kick-burst",
+        type=int,
+        help="Kick commands allowed back to back before the rate limit applies (default 20).",
+        dest="kick_burst",
+    )
+    parser.add_argument(
+        "--kick-queue",
+        type=int,
+        help="Maximum kicks waiting per server before new ones are dropped (default 256).",
+        dest="kick_queue",
+    )
+    parser.add_argument(
+        "--kick-workers",
+        type=int,
+        help="RCON sessions per server used to send kicks (default 1).",
+        dest="kick_workers",
+    )
+    parser.add_argument(
+        "--profile-seconds",
+        type=float,
+        default=30.0,
+        help="Length of the sampling profile captured on SIGUSR1 or each diagnostics interval.",
+        dest="profile_seconds",
+    )
+    parser.add_argument(
+        "--diagnostics-interval",
+        type=float,
+        default=0,
+        help="Capture a profile and memory report every this many seconds (0 to only capture on SIGUSR1).",
+        dest="diagnostics_interval",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Trace allocations from the first diagnostics capture on, to report memory growth.",
+        dest="trace_memory",
+    )
+    parser.add_argument(
+        "--dc", "--decision-cache",
+        type=str,
+        help="Remember decisions across restarts in this SQLite file.",
+        dest="decision_cache",
+    )
+    parser.add_argument(
+        "--al", "--audit-log",
+        type=str,
+        help="Append a JSON line per whitelist decision to this file.",
+        dest="audit_log",
+    )
+    parser.add_argument(
+        "--cf", "--config",
+        type=str,
+        help="Path to a JSON file listing several servers to guard from one process.",
+        dest="config",
+    )
+    parser.add_argument(
+        "--async",
+        action="store_true",
+        help="Run tail, lookup and kick as concurrent asyncio tasks.",
+        dest="use_async",
+    )
 
-    args = parser.parse_args()
+    try:
+        parser.set_defaults(**option_defaults(parser))
+    except ValueError as environment_error:
+        parser.error("invalid environment: %s" % environment_error)
+    args = parser.parse_args(argv)
 
-    confirm_args = input(
-        """
-    Log Directory: %s\n
-    Whitelist Type: %s\n
-    Whitelist Path: %s\n
-    Base Game Log Directory: %s\n
+    servers = None
+    required = ["whitelist_type", "whitelist_path"]
+    if args.config:
+        try:
+            config = load_servers_config(args.config)
+            parser.set_defaults(**option_defaults(parser, config))
+        except (OSError, ValueError) as config_error:
+            parser.error("invalid config file: %s" % config_error)
+        args = parser.parse_args(argv)
+        servers = config.get("servers")
+    if not servers:
+        required += ["base_log_dir", "rcon_host", "rcon_port", "rcon_password"]
+    missing = [name for name in required if getattr(args, name) is None]
+    if missing:
+        parser.error(
+            "the following arguments are required: %s" % ", ".join(
+                "--" + name.replace("_", "-") for name in missing
+            )
+        )
+
+    if servers:
+        server_details = "Servers: %s\n" % ", ".join(server["name"] for server in servers)
+    else:
+        server_details = """Base Game Log Directory: %s\n
     RCON Host: %s\n
     RCON Port: %s\n
-    RCON Password: %s\n
-    Heartbeat Count (secs): %s\n
-    Correct? [Y/n]: 
-    """ % (
-            args.log_directory,
-            args.whitelist_type,
-            args.whitelist_path,
+    RCON Password: %s\n""" % (
             args.base_log_dir,
             args.rcon_host,
             args.rcon_port,
             args.rcon_password,
-            args.heartbeat,
         )
-    )
 
-    if confirm_args.lower() in ('n', 'no'):
-        print("Please restart the application to try again.")
-        return
+    # There is nobody to answer the prompt under systemd or in a container.
+    if not args.daemon and sys.stdin is not None and sys.stdin.isatty():
+        confirm_args = input(
+            """
+    Log Directory: %s\n
+    Whitelist Type: %s\n
+    Whitelist Path: %s\n
+    %s
+    Heartbeat Count (secs): %s\n
+    Correct? [Y/n]: 
+    """ % (
+                args.log_directory,
+                args.whitelist_type,
+                args.whitelist_path,
+                server_details,
+                args.heartbeat,
+            )
+        )
+
+        if confirm_args.lower() in ('n', 'no'):
+            print("Please restart the application to try again.")
+            return
 
     setup_logging(args.log_directory)
 
+    if args.metrics_port is not None:
+        start_metrics_server(args.metrics_port)
+
+    if args.audit_log:
+        set_audit_log(args.audit_log)
+
+    if args.decision_cache:
+        try:
+            set_persistent_decision_cache(args.decision_cache)
+        except sqlite3.Error as cache_error:
+            logging.warning("Decision cache disabled: %s", cache_error)
+
+    install_diagnostics(
+        args.log_directory,
+        args.profile_seconds,
+        args.diagnostics_interval,
+        args.trace_memory,
+    )
+
+    set_rcon_options(
+        command_rate=args.kick_rate,
+        command_burst=args.kick_burst,
+        max_queue=args.kick_queue,
+        workers=args.kick_workers,
+    )
+
+    if args.stall_seconds > 0:
+        start_watchdog(args.stall_seconds)
+
     heartbeat_thread = threading.Thread(
-        target=heartbeat(args.heartbeat), name="HeartbeatThread"
+        target=heartbeat, args=(args.heartbeat,), name="HeartbeatThread"
     )
     heartbeat_thread.daemon = True
     heartbeat_thread.start()
 
+    if servers:
+        try:
+            run_servers(
+                servers,
+                args.whitelist_type,
+                args.whitelist_path,
+                args.use_async,
+                args.log_directory,
+                args.coalesce_window,
+            )
+        except KeyboardInterrupt:
+            logging.info("Script interrupted by user.")
+        except Exception as e:
+            logging.exception("Unexpected error occurred in main process: %s", e)
+        return
+
     latest_console_log_path = find_latest_log_dir(args.base_log_dir)
+    checkpoint = server_checkpoint(args.log_directory)
 
     try:
-        if latest_console_log_path:
-            tail_log_file(
-                latest_console_log_path,
-                lambda line: process_log_line(
-                    line,
+        if latest_console_log_path and args.use_async:
+            asyncio.run(
+                run_async_pipeline(
+                    latest_console_log_path,
                     args.whitelist_type,
                     args.whitelist_path,
                     args.rcon_host,
                     args.rcon_port,
                     args.rcon_password,
-                ),
+                    checkpoint=checkpoint,
+                    coalesce_window=args.coalesce_window,
+                )
+            )
+        elif latest_console_log_path:
+            rcon = (args.rcon_host, args.rcon_port, args.rcon_password)
+            coalescer = JoinCoalescer(
+                args.whitelist_type, args.whitelist_path, args.coalesce_window
             )
+            coalescer.start()
+            try:
+                offset = resume_from_checkpoint(
+                    latest_console_log_path,
+                    checkpoint,
+                    lambda event: coalescer.add([event], *rcon),
+                )
+                tail_log_file(
+                    latest_console_log_path,
+                    lambda text: coalescer.add(parse_log_block(text), *rcon),
+                    batch=True,
+                    offset=offset,
+                    checkpoint=checkpoint,
+                    after_handled=coalescer.after_handled,
+                )
+            finally:
+                coalescer.stop()
         else:
             logging.error("No recent log file found to process.")
     except KeyboardInterrupt:
         logging.info("Script interrupted by user.")
     except Exception as e:
-        logging.exception("Unexpected error occurred in main process: %s" % e)
+        logging.exception("Unexpected error occurred in main process: %s", e)
 
 
 if __name__ == "__main__":